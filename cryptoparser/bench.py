@@ -0,0 +1,265 @@
+#!/usr/bin/env python3.6
+
+"""Benchmarks of the Scanner, without touching the internet.
+
+logging: the CPU time per url at each log level. Requests are answered
+from memory, so only the time spent in the Scanner is measured.
+
+throughput: urls/sec, p50/p99 fetch latency and peak RSS of a whole run,
+in each --mode given, against a local stand-in server (see standin.py).
+
+prefilter: the time to match --pattern on a corpus of pages, with and
+without the literal prefilter (see prefilter.py). The pages are made up,
+of real sizes, unless --corpus is a directory of saved pages.
+
+    $ python3.6 bench.py logging [-n 3000]
+    $ python3.6 bench.py throughput -n 2000 --latency 0.05 --mode workers=32 --mode concurrency=32
+    $ python3.6 bench.py prefilter -n 500 [--corpus DIR]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+
+# Package modules.
+import cryptoparser
+import scanner
+import sinks
+import standin
+
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+# A miner, a page without one, and a host which doesn't answer.
+FILLER = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n' * 30
+PAGES = {
+    'http://miner.bench': (200, FILLER + "<script>var miner = new CoinHive.Anonymous("
+                                         "'8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2');</script>"),
+    'http://clean.bench': (200, FILLER),
+    }
+
+
+class MemoryScanner(scanner.Scanner):
+    """A Scanner which answers requests from PAGES."""
+
+    def request(self, url, timings=None, headers=None, received=None):
+        statuscode, content = PAGES.get(url, (-1, ''))
+        if statuscode == -1:
+            self.requestfailed(url, ConnectionRefusedError(111, 'Connection refused'))
+        return statuscode, content.encode('utf-8')
+
+
+def scanwith(logger, urls):
+    """Return the CPU seconds taken to scan and write *urls* with *logger*."""
+    scan = MemoryScanner(None, os.devnull, cryptoparser.coinhivehash, logger=logger,
+                         quietmode=True)
+    scan.compileregex()
+    scan.checklevels()
+    with sinks.opensink(os.devnull) as sink:
+        start_time = time.process_time()
+        for url in urls:
+            scan.write(sink, url, scan.results(url))
+        return time.process_time() - start_time
+
+
+def benchlogging(n):
+    """Print the CPU time per url at every log level, logging to a file
+    (os.devnull) in the same format as cryptoparser.py.
+    """
+    urls = ['miner.bench', 'clean.bench', 'dead.bench'] * (n // 3)
+    handler = logging.FileHandler(os.devnull)
+    handler.setFormatter(logging.Formatter('%(levelname)s: %(asctime)s: %(message)s',
+                                           '%Y-%m-%d-%H:%M:%S%p'))
+    print('{} urls, cpu time per url:'.format(len(urls)))
+    for level in LEVELS:
+        logger = logging.getLogger('bench.{}'.format(level.lower()))
+        logger.propagate = False
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        scanwith(logger, urls[:30]) # Warm up.
+        elapsed = scanwith(logger, urls)
+        print('{:<9} {:>8.1f} us/url'.format(level, elapsed / len(urls) * 1e6))
+
+
+def runmode(mode, infile, opts, results):
+    """Scan *infile* with a Scanner made with *opts* in *mode*: sequential,
+    or concurrency=N or workers=N. Put a tuple of (seconds, p50, p99,
+    peak RSS in KB, outcomes) on *results*. Run in a process of its own,
+    so the peak RSS is that of the run alone.
+    """
+    opts = dict(opts)
+    if mode != 'sequential':
+        option, n = mode.split('=')
+        opts[option] = int(n)
+    logger = logging.getLogger('bench')
+    logger.propagate = False
+    logger.addHandler(logging.NullHandler())
+    logger.setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        scan = scanner.Scanner(infile, os.path.join(tmpdir, 'out.csv'), cryptoparser.coinhivehash,
+                               logger=logger, quietmode=True, timings=True, **opts)
+        timer = scan.timer # Let go of by close, at the end of run.
+        start_time = time.monotonic()
+        scan.run()
+        elapsed = time.monotonic() - start_time
+    total = timer.stages['total']
+    results.put((elapsed, total.percentile(50), total.percentile(99),
+                 resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, dict(scan.outcomes)))
+
+
+def benchthroughput(args):
+    """Print the throughput of a run in every mode of args.mode, against a
+    stand-in server answering as args say.
+    """
+    site = standin.StandIn(latency=args.latency, jitter=args.jitter, size=args.size,
+                           miner_rate=args.miner_rate, fail_rate=args.fail_rate,
+                           drop_rate=args.drop_rate, redirect_rate=args.redirect_rate,
+                           compress=args.compress)
+    opts = dict(pool_size=args.pool_size, stream=args.stream, timeout=10)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        certfile = keyfile = None
+        if args.https:
+            certfile, keyfile = standin.selfsigned(tmpdir) or (None, None)
+            if not certfile:
+                raise SystemExit('bench: error: openssl not found; needed for --https')
+            opts['https_only'] = True
+        else:
+            opts['http_only'] = True
+        server = standin.serve(site, certfile=certfile, keyfile=keyfile)
+        infile = os.path.join(tmpdir, 'urls.txt')
+        with open(infile, 'w') as f:
+            for n in range(args.n):
+                f.write('127.0.0.1:{}/{}\n'.format(server.server_address[1], n))
+        print('{} urls, {}{}'.format(args.n, site, ', https' if args.https else ''))
+        print('{:<16}{:>10}{:>10}{:>10}{:>10}  {}'.format('mode', 'urls/sec', 'p50', 'p99',
+                                                          'peak RSS', 'outcomes'))
+        try:
+            for mode in args.mode or ['sequential']:
+                results = multiprocessing.Queue()
+                process = multiprocessing.Process(target=runmode,
+                                                  args=(mode, infile, opts, results))
+                process.start()
+                elapsed, p50, p99, rss, outcomes = results.get()
+                process.join()
+                print('{:<16}{:>10.1f}{:>8.1f}ms{:>8.1f}ms{:>8.1f}MB  {}'.format(
+                    mode, args.n / elapsed, (p50 or 0) * 1000, (p99 or 0) * 1000, rss / 1024,
+                    ', '.join('{} {}'.format(count, outcome)
+                              for outcome, count in sorted(outcomes.items()))))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def makecorpus(n, miner_rate=0.02, seed=0):
+    """Return *n* made up pages, as bytes, of 16 to 128KB (around the size
+    of the HTML of a home page), with a miner on *miner_rate* of them.
+    """
+    rng = random.Random(seed)
+    words = FILLER.split()
+    lines = ['<div class="{}"><a href="/{}">{}</a></div>'.format(*rng.sample(words, 3)),
+             '<script src="https://cdn.example.com/{}.js"></script>'.format(rng.choice(words)),
+             '<script>window.dataLayer = window.dataLayer || []; gtag("js", new Date());</script>',
+             '<p>' + ' '.join(rng.choice(words) for _ in range(40)) + '</p>',
+             '<meta name="description" content="Anonymous (and not) visitors welcome">']
+    miner = PAGES['http://miner.bench'][1][len(FILLER):]
+    corpus = []
+    for _ in range(n):
+        size = int(rng.uniform(16, 128) * 1024)
+        page = []
+        while sum(map(len, page)) < size:
+            page.append(rng.choice(lines))
+        if rng.random() < miner_rate:
+            page.insert(rng.randrange(len(page)), miner)
+        corpus.append('\n'.join(page).encode('utf-8'))
+    return corpus
+
+
+def loadcorpus(dir):
+    """Return the files in *dir*, as bytes."""
+    corpus = []
+    for name in sorted(os.listdir(dir)):
+        path = os.path.join(dir, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                corpus.append(f.read())
+    return corpus
+
+
+def benchprefilter(args):
+    """Print the CPU time per page to match args.pattern on a corpus, with
+    and without the prefilter, on decoded pages and with match_bytes.
+    """
+    corpus = loadcorpus(args.corpus) if args.corpus else makecorpus(args.n)
+    logger = logging.getLogger('bench')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    print('{} pages, {:.0f}KB on average, pattern: {}'.format(
+        len(corpus), sum(map(len, corpus)) / len(corpus) / 1024, args.pattern))
+    for match_bytes in (False, True):
+        scan = scanner.Scanner(None, None, args.pattern, logger=logger, match_bytes=match_bytes)
+        scan.compileregex()
+        pages = corpus if match_bytes else [page.decode('utf-8', 'replace') for page in corpus]
+        timed = {}
+        for literal in (None, scan.literal):
+            scan.literal = literal
+            start_time = time.process_time()
+            found = [scan.parsecontent(page) for page in pages]
+            timed[literal] = (time.process_time() - start_time, found)
+        (plain, plainfound), (filtered, filteredfound) = timed[None], timed[scan.literal]
+        assert plainfound == filteredfound, 'the prefilter changed what was found'
+        print('{:<12}{:>10.1f} us/page regex only, {:>8.1f} us/page with prefilter {!r} '
+              '({:.1f}x); {} found'.format('bytes' if match_bytes else 'str',
+                                          plain / len(pages) * 1e6, filtered / len(pages) * 1e6,
+                                          scan.literal, plain / filtered if filtered else 0,
+                                          sum(1 for match in found if match)))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench.py', description=__doc__.split('\n')[0])
+    parser.add_argument('benchmark', choices=['logging', 'throughput', 'prefilter'])
+    parser.add_argument('-n', type=int, metavar='INT', default=3000,
+                        help='number of urls to scan; default is 3000')
+    parser.add_argument('--mode', action='append', metavar='MODE',
+                        help=('throughput: sequential, concurrency=N or workers=N; may be given '
+                              'more than once; default is sequential'))
+    parser.add_argument('--pool-size', type=int, metavar='INT', default=None,
+                        help='throughput: as cryptoparser.py --pool-size')
+    parser.add_argument('--stream', action='store_true',
+                        help='throughput: as cryptoparser.py --stream')
+    parser.add_argument('--https', action='store_true',
+                        help='throughput: serve (and scan) https only')
+    parser.add_argument('--compress', action='store_true',
+                        help='throughput: serve pages gzipped')
+    parser.add_argument('--latency', type=float, metavar='FLOAT', default=0.0,
+                        help='throughput: seconds before every response; default is 0')
+    parser.add_argument('--jitter', type=float, metavar='FLOAT', default=0.0,
+                        help='throughput: up to FLOAT more seconds per response; default is 0')
+    parser.add_argument('--size', type=int, metavar='INT', default=16384,
+                        help='throughput: bytes per page; default is 16384')
+    parser.add_argument('--miner-rate', type=float, metavar='FLOAT', default=0.1,
+                        help='throughput: fraction of pages with a miner; default is 0.1')
+    parser.add_argument('--fail-rate', type=float, metavar='FLOAT', default=0.0,
+                        help='throughput: fraction of 500s; default is 0')
+    parser.add_argument('--drop-rate', type=float, metavar='FLOAT', default=0.0,
+                        help='throughput: fraction of dropped connections; default is 0')
+    parser.add_argument('--redirect-rate', type=float, metavar='FLOAT', default=0.0,
+                        help='throughput: fraction of redirects; default is 0')
+    parser.add_argument('-p', '--pattern', metavar='STR', default=cryptoparser.coinhivehash,
+                        help='prefilter: the pattern to match; default is as cryptoparser.py')
+    parser.add_argument('--corpus', metavar='PATH', default=None,
+                        help='prefilter: a directory of pages to match, instead of made up ones')
+    args = parser.parse_args()
+    if args.benchmark == 'logging':
+        benchlogging(args.n)
+    elif args.benchmark == 'throughput':
+        benchthroughput(args)
+    elif args.benchmark == 'prefilter':
+        benchprefilter(args)
+
+
+if __name__ == '__main__':
+    main()
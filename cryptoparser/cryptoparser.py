@@ -1,7 +1,7 @@
 #!/usr/bin/env python3.6
 
-__date__ = '2017-10-19'
-__version__ = (0,0,6)
+__date__ = '2026-10-18'
+__version__ = (0,0,7)
 
 # Standard Library.
 import argparse # ArgumentParser
@@ -14,6 +14,7 @@ import time
 # Package modules.
 try: # httplib2 dependency.
     import scanner
+    import shards
     missing_httplib2_error_message = False
 except ModuleNotFoundError:
     missing_httplib2_error_message = \
@@ -40,7 +41,47 @@ def main():
         description='Parse a HTML source for a pattern, provided a list of URLs from a file.')
     parser.add_argument('--http-only', action='store_true', help='only request to http://')
     parser.add_argument('--https-only', action='store_true', help='only request to https://')
-    parser.add_argument('infile', metavar='PATH', help='path to text file containing URLs')
+    parser.add_argument('-P', '--processes', type=int, metavar='INT', default=None,
+                        help=('split infile into INT shards by domain, scanned by a process '
+                              'each, and merge their output'))
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('-c', '--concurrency', type=int, metavar='INT', default=None,
+                      help='number of requests to keep in flight; default is one at a time')
+    mode.add_argument('-w', '--workers', type=int, metavar='INT', default=None,
+                      help='number of worker threads; rows are written by one writer thread')
+    parser.add_argument('--ordered', action='store_true',
+                        help='with --workers, write rows in input order')
+    parser.add_argument('--reorder-buffer', type=int, metavar='INT', default=None,
+                        help='with --ordered, max rows held back; default is 4 * workers')
+    parser.add_argument('--probe', default='sequential',
+                        choices=['sequential', 'first-wins', 'prefer-https', 'both'],
+                        help=('request http:// and https:// at once, and write the first to '
+                              'return a 200, https if it does, or both; default is https only '
+                              'after http fails'))
+    parser.add_argument('--resolve', action='store_true',
+                        help=('look up every host before requesting it, concurrently; hosts '
+                              'which do not exist are written as: domain,-2. Uses pooled '
+                              'connections, which connect to the addresses looked up'))
+    parser.add_argument('--hosts', metavar='PATH', default=None,
+                        help='with --resolve, a hosts file to look names up in before DNS')
+    parser.add_argument('--dns-workers', type=int, metavar='INT', default=32,
+                        help='with --resolve, number of concurrent lookups; default is 32')
+    parser.add_argument('--dns-ttl', type=int, metavar='INT', default=300,
+                        help='with --resolve, seconds to cache addresses; default is 300')
+    parser.add_argument('--dns-negative-ttl', type=int, metavar='INT', default=60,
+                        help='with --resolve, seconds to cache names which do not exist; default is 60')
+    parser.add_argument('--ip-rate', type=float, metavar='FLOAT', default=None,
+                        help='max requests per second to any one address')
+    parser.add_argument('--domain-rate', type=float, metavar='FLOAT', default=None,
+                        help='max requests per second to any one registrable domain')
+    parser.add_argument('--asn-rate', type=float, metavar='FLOAT', default=None,
+                        help='max requests per second to any one ASN; needs --asn-map')
+    parser.add_argument('--asn-map', metavar='PATH', default=None,
+                        help='file of lines of: PREFIX/LENGTH ASN (or a routeviews pfx2as file)')
+    parser.add_argument('--rate-burst', type=int, metavar='INT', default=1,
+                        help='requests allowed at once before a rate applies; default is 1')
+    parser.add_argument('infile', metavar='PATH', help=('path to text file containing URLs; may be compressed (.gz, .xz, .bz2), '
+                              'or - to read from stdin'))
     parser.add_argument('-l', '--log-level', metavar='STR', dest='loglevel', default='INFO',
                         choices=['debug', 'DEBUG', 'info', 'INFO', 'warning', 'WARNING',
                                  'error', 'ERROR', 'critical', 'CRITICAL'],
@@ -48,16 +89,111 @@ def main():
     parser.add_argument('outfile', nargs='?', metavar='PATH',
                         default=os.path.join(SCRIPTDIR, SCRIPTNAME + '.csv'),
                         help='path to output destination; default is $CWD/cryptoparser.out')
+    parser.add_argument('-f', '--format', choices=['legacy', 'csv', 'jsonl', 'sqlite'],
+                        default='legacy',
+                        help=("how to write outfile: 'legacy' rows (domain,hash,schema), 'csv' "
+                              "or 'jsonl' with every field, or an 'sqlite' database keeping "
+                              "every run; default is legacy"))
+    parser.add_argument('--buffer', type=int, metavar='INT', default=None,
+                        help=('write rows to outfile INT at a time; default is 100 (500 for '
+                              'sqlite)'))
+    parser.add_argument('--state', metavar='PATH', default=None,
+                        help=('keep a digest and the match of every page, and what was found '
+                              'per entry, in an SQLite database at PATH; pages unchanged since '
+                              'the last scan are not matched again'))
+    parser.add_argument('--diff', choices=['match', 'page'], default=None,
+                        help=("with --state, only write the rows of entries which changed since "
+                              "the last scan: 'match' if the miners found changed (infected, "
+                              "cleaned or a new key), 'page' also if the page did"))
+    parser.add_argument('--http-cache', metavar='PATH', default=None,
+                        help=('keep the ETag/Last-Modified and match of every page in an SQLite '
+                              'database at PATH, kept between runs; unchanged pages are then '
+                              'not downloaded again (304). Uses pooled connections'))
+    parser.add_argument('--http-cache-size', type=int, metavar='INT', default=100000,
+                        help=('with --http-cache, keep at most INT urls, evicting the least '
+                              'recently used; default is 100000'))
+    parser.add_argument('--progress', action='store_true',
+                        help=('show entries done (of how many), urls/sec, requests in flight, '
+                              'hits, errors and eta on a line of stderr, as the run goes'))
+    parser.add_argument('--status-file', metavar='PATH', default=None,
+                        help='write the same, as JSON, to PATH as the run goes')
+    parser.add_argument('--status-socket', metavar='PATH', default=None,
+                        help='answer connections to a UNIX socket at PATH with the same JSON')
+    parser.add_argument('--progress-interval', type=float, metavar='FLOAT', default=2.0,
+                        help=('seconds between updates of --progress and --status-file; '
+                              'default is 2'))
+    parser.add_argument('--timings', action='store_true',
+                        help=('time the stages of every request (dns, connect, tls, first '
+                              'byte, download, match) and print percentiles at the end; the '
+                              'first five only over pooled connections, see --pool-size'))
+    parser.add_argument('--timings-file', metavar='PATH', default=None,
+                        help='also write the timings of every request to PATH, as JSON Lines')
+    parser.add_argument('--pool-size', type=int, metavar='INT', default=None,
+                        help=('reuse up to INT keep-alive connections per host, instead of a '
+                              'new connection per request'))
+    parser.add_argument('--idle-timeout', type=int, metavar='INT', default=30,
+                        help='with --pool-size, seconds to keep an idle connection; default is 30')
+    parser.add_argument('--max-decompressed', type=int, metavar='INT', default=32 * 1024 * 1024,
+                        help=('with pooled connections, give up on a compressed page once it '
+                              'decompresses to over INT bytes; default is 33554432 (32MB)'))
+    parser.add_argument('--stream', action='store_true',
+                        help=('read pages a chunk at a time, stopping as soon as the pattern is '
+                              'found; uses pooled connections'))
+    parser.add_argument('--max-bytes', type=int, metavar='INT', default=None,
+                        help='give up on a page after INT bytes, as if not found; implies --stream')
+    parser.add_argument('-b', '--match-bytes', action='store_true',
+                        help=('match the pattern against the undecoded page, decoding only '
+                              'the match; finds matches in pages which are not utf-8'))
+    parser.add_argument('--scripts', action='store_true',
+                        help=('also search the scripts a page references (<script src>), if '
+                              'the page has no match; each script is fetched once per run'))
+    parser.add_argument('--max-scripts', type=int, metavar='INT', default=20,
+                        help='with --scripts, search at most INT scripts per page; default is 20')
     parser.add_argument('-p', '--pattern', metavar='STR', type=str, default=coinhivehash,
                         help='string or regex to search for')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help=('skip entries already scanned into outfile, as recorded in '
+                              'its journal (outfile.journal)'))
+    parser.add_argument('--no-journal', dest='journal', action='store_false',
+                        help='do not keep a journal of the entries scanned; no --resume')
+    parser.add_argument('-d', '--dedup', action='store_true',
+                        help=('canonicalize entries (schema, case, trailing slash) and scan each '
+                              'only once; reports the duplicates before scanning'))
+    parser.add_argument('--www', choices=['keep', 'strip'], default='keep',
+                        help="with --dedup, 'strip' treats www.a.com as a.com; default is keep")
+    parser.add_argument('-S', '--signatures', metavar='PATH', default=None,
+                        help=('path to a JSON signature pack (e.g. signatures.json) to search '
+                              'for instead of --pattern; adds a signature column'))
     parser.add_argument('-q', '--quiet-mode', dest='quietmode', action='store_true',
                         help='do not print any output to stdout')
     parser.add_argument('-s', '--sleep', type=int, metavar='INT', default=None,
-                        help='time in seconds to delay between targets')
+                        help=('time in seconds to delay between targets (per worker); see '
+                              '--ip-rate, --domain-rate and --asn-rate to only slow down per host'))
     parser.add_argument('-t', '--timeout', type=int, metavar='INT', default=None,
                         help=('time in seconds to wait before giving up on a host;'
                               "default is Python's default"))
+    parser.add_argument('--retries', type=int, metavar='INT', default=2,
+                        help=('times to retry a request whose connection was dropped part way, '
+                              'backing off; refused connections and timeouts are not retried; '
+                              'default is 2'))
+    parser.add_argument('--adaptive-timeout', action='store_true',
+                        help=('set the timeout per host from how fast hosts answer, up to '
+                              '--timeout (or 30s); hosts not seen yet get twice the 99th '
+                              'percentile of all so far'))
+    parser.add_argument('--breaker', metavar='PATH', default=None,
+                        help=('keep the hosts which failed in an SQLite database at PATH, and '
+                              'skip those which failed the last --breaker-runs runs; written '
+                              'as: domain,-3'))
+    parser.add_argument('--breaker-runs', type=int, metavar='INT', default=3,
+                        help='with --breaker, runs in a row a host fails to be skipped; default is 3')
+    parser.add_argument('--breaker-cooloff', type=int, metavar='INT', default=7 * 24 * 3600,
+                        help=('with --breaker, seconds a host is skipped for before being tried '
+                              'again; default is 604800 (a week)'))
     args = parser.parse_args()
+    if args.diff and not args.state:
+        parser.error('--diff needs --state')
+    if args.asn_rate and not args.asn_map:
+        parser.error('--asn-rate needs --asn-map')
 
     start_time = time.time()
 
@@ -92,26 +228,70 @@ def main():
     logger.info('Creating Scanner object.')
     logger.debug('Scanner object is being passed a pattern of: {}'.format(args.pattern))
 
-    # Does the same as below.
-    #opts = dict(**vars(args))
-    #del opts['loglevel'], opts['quietmode']
-    #opts['logger'] = logger
-    #scan = scanner.Scanner(**opts)
-
-    scan = scanner.Scanner(
+    opts = dict(
         infile=args.infile,
         outfile=args.outfile,
+        format=args.format,
+        buffer=args.buffer,
         pattern=args.pattern,
         cache=cache,
         timeout=args.timeout,
         sleep=args.sleep,
-        logger=logger,
         quietmode=args.quietmode,
         http_only=args.http_only,
-        https_only=args.https_only)
+        https_only=args.https_only,
+        concurrency=args.concurrency,
+        workers=args.workers,
+        ordered=args.ordered,
+        reorder_buffer=args.reorder_buffer,
+        pool_size=args.pool_size,
+        idle_timeout=args.idle_timeout,
+        stream=args.stream,
+        max_decompressed=args.max_decompressed,
+        max_bytes=args.max_bytes,
+        match_bytes=args.match_bytes,
+        signatures=args.signatures,
+        scripts=args.scripts,
+        max_scripts=args.max_scripts,
+        journal=args.outfile + '.journal' if args.journal else None,
+        resume=args.resume,
+        dedup=args.dedup,
+        www=args.www,
+        probe=args.probe,
+        resolve=args.resolve or bool(args.hosts),
+        hosts=args.hosts,
+        dns_workers=args.dns_workers,
+        dns_ttl=args.dns_ttl,
+        dns_negative_ttl=args.dns_negative_ttl,
+        ip_rate=args.ip_rate,
+        domain_rate=args.domain_rate,
+        asn_rate=args.asn_rate,
+        asn_map=args.asn_map,
+        rate_burst=args.rate_burst,
+        retries=args.retries,
+        adaptive_timeout=args.adaptive_timeout,
+        breaker=args.breaker,
+        breaker_runs=args.breaker_runs,
+        breaker_cooloff=args.breaker_cooloff,
+        state=args.state,
+        diff=args.diff,
+        http_cache=args.http_cache,
+        http_cache_size=args.http_cache_size,
+        progress=args.progress,
+        status_file=args.status_file,
+        status_socket=args.status_socket,
+        progress_interval=args.progress_interval,
+        timings=args.timings,
+        timings_file=args.timings_file)
 
-    logger.info('Starting scan.')
-    scan.run()
+    if args.processes and args.processes > 1:
+        # Each process makes its own Scanner, with its own cache directory.
+        logger.info('Starting scan in {} processes.'.format(args.processes))
+        shards.run(args.processes, opts, logger, quietmode=args.quietmode)
+    else:
+        scan = scanner.Scanner(logger=logger, **opts)
+        logger.info('Starting scan.')
+        scan.run()
 
     try: # Dir/files could be in use.
         shutil.rmtree(cache) # Delete the cache+contents.
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3.6
+
+"""Deduplication of url lists larger than memory."""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+
+
+class DiskSet:
+    """A set of strings kept in an SQLite database at *path* (a temporary
+    file in *dir* if not given), rather than in memory. Only a 16 byte
+    digest of each string is stored.
+    """
+
+    def __init__(self, path=None, dir=None, batch=10000):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='diskset-', suffix='.db', dir=dir)
+            os.close(fd)
+        self.path = path
+        self.batch = batch
+        self.pending = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode = OFF') # Scratch data.
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE IF NOT EXISTS items (digest BLOB PRIMARY KEY) WITHOUT ROWID')
+
+    def __repr__(self):
+        return 'DiskSet({!r})'.format(self.path)
+
+    @staticmethod
+    def digest(item):
+        return hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+
+    def add(self, item):
+        """Add *item*; return True if it was not in the set already."""
+        cursor = self.db.execute('INSERT OR IGNORE INTO items (digest) VALUES (?)',
+                                 (self.digest(item),))
+        self.pending += 1
+        if self.pending >= self.batch: # One transaction per batch.
+            self.db.commit()
+            self.pending = 0
+        return cursor.rowcount == 1
+
+    def __contains__(self, item):
+        return self.db.execute('SELECT 1 FROM items WHERE digest = ?',
+                               (self.digest(item),)).fetchone() is not None
+
+    def close(self, remove=True):
+        self.db.commit()
+        self.db.close()
+        if remove:
+            os.remove(self.path)
+
+
+class Deduplicator:
+    """Write the entries of a url list to a temporary file in *dir* as
+    given by *canonicalize*, each one only once.
+
+    Counts entries which are exact duplicates of an earlier line, and near
+    duplicates: different lines which canonicalize to the same entry, e.g.
+    http://a.com, https://a.com/ and A.com.
+    """
+
+    def __init__(self, canonicalize, dir=None):
+        self.canonicalize = canonicalize
+        self.dir = dir
+        self.path = None
+        self.total = 0
+        self.blank = 0
+        self.exact = 0
+        self.near = 0
+        self.unique = 0
+
+    def __repr__(self):
+        return ('Deduplicator(total={}, unique={}, exact={}, near={}, blank={})'
+                .format(self.total, self.unique, self.exact, self.near, self.blank))
+
+    def write(self, entries):
+        """Read *entries* through, writing the unique canonical entries to a
+        temporary file; return its path. Remove it with cleanup.
+        """
+        lines = DiskSet(dir=self.dir)
+        canonical = DiskSet(dir=self.dir)
+        fd, self.path = tempfile.mkstemp(prefix='dedup-', suffix='.txt', dir=self.dir)
+        try:
+            with os.fdopen(fd, 'w') as out:
+                for entry in entries:
+                    self.total += 1
+                    entry = entry.strip()
+                    if not entry:
+                        self.blank += 1
+                        continue
+                    if not lines.add(entry):
+                        self.exact += 1
+                        continue
+                    entry = self.canonicalize(entry)
+                    if not canonical.add(entry):
+                        self.near += 1
+                        continue
+                    self.unique += 1
+                    out.write(entry + '\n')
+        finally:
+            lines.close()
+            canonical.close()
+        return self.path
+
+    def read(self):
+        """Yield the unique entries written."""
+        with open(self.path) as f:
+            for entry in f:
+                yield entry.rstrip('\n')
+
+    def cleanup(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
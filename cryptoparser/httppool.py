@@ -0,0 +1,466 @@
+#!/usr/bin/env python3.6
+
+"""Keep-alive HTTP(S) connections for Scanner, reused per host.
+
+httplib2 is not used here: a new Http instance per request means a new
+connection, and a new SSL context, for every url and every schema.
+
+Bodies are asked for compressed (gzip or deflate), and decompressed as
+they are read, so a page is never held both compressed and not.
+"""
+
+import collections
+import contextlib
+import http.client
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+import zlib
+
+# Package modules.
+import timing
+
+USER_AGENT = 'cryptoparser'
+REDIRECTS = (301, 302, 303, 307, 308)
+ACCEPT_ENCODING = 'gzip, deflate'
+# Bytes of a compressed body read at a time.
+CHUNK_SIZE = 16384
+
+
+class BodyTooLarge(Exception):
+    """A compressed body decompressed to more than allowed; a compression
+    bomb, or a page too big to be worth matching.
+    """
+
+
+class Aborted(Exception):
+    """A request was aborted from another thread; see Abort."""
+
+
+class Abort:
+    """A handle on the request made by a thread (see
+    ConnectionPool.aborting), for another thread to abort it: the socket
+    it is connecting, or reading from, is shut down, so the thread blocked
+    on it returns straight away, and Aborted is raised in it.
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self.sock = None
+        self._lock = threading.Lock()
+
+    def attach(self, sock):
+        """Watch *sock*, the socket the request is now using."""
+        with self._lock:
+            if self.aborted:
+                raise Aborted('aborted before connecting')
+            self.sock = sock
+
+    def detach(self):
+        """Stop watching the socket, which may be reused by someone else.
+        Return True if the request was aborted.
+        """
+        with self._lock:
+            self.sock = None
+            return self.aborted
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            if self.sock is not None:
+                try: # Not SSLSocket's own, which may pull the SSL object from under a read.
+                    socket.socket.shutdown(self.sock, socket.SHUT_RDWR)
+                except OSError: # Closed already.
+                    pass
+
+
+def opensocket(conn):
+    """Return a TCP socket for *conn*, connected to its pre-resolved
+    address, if it has one, else to the first address of its host.
+
+    The lookup and the connect are added to conn.timings, if it has any.
+    The socket is attached to conn.abort, if it has one, before connecting.
+    """
+    start_time = time.monotonic()
+    address = conn.address
+    try:
+        if not address: # Looked up here, not in create_connection, to time it.
+            address = socket.getaddrinfo(conn.host, conn.port, type=socket.SOCK_STREAM)[0][4][0]
+    finally: # Failures are timed too; a dead host is the time it took to fail.
+        resolved = time.monotonic()
+        timing.addtime(conn.timings, 'dns', resolved - start_time)
+    # As socket.create_connection, but with the socket attached before it connects.
+    sock = socket.socket(socket.AF_INET6 if ':' in address else socket.AF_INET,
+                         socket.SOCK_STREAM)
+    try:
+        if conn.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            sock.settimeout(conn.timeout)
+        if conn.source_address:
+            sock.bind(conn.source_address)
+        if conn.abort is not None:
+            conn.abort.attach(sock)
+        sock.connect((address, conn.port))
+    except BaseException:
+        sock.close()
+        raise
+    finally:
+        timing.addtime(conn.timings, 'connect', time.monotonic() - resolved)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class HTTPConnection(http.client.HTTPConnection):
+    """An HTTPConnection which connects to *address*, a pre-resolved address
+    of host, if it is given one.
+    """
+
+    def __init__(self, host, port=None, address=None, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.address = address
+        self.timings = None
+        self.abort = None
+
+    def connect(self):
+        self.sock = opensocket(self)
+
+
+class HTTPSConnection(http.client.HTTPSConnection):
+    """An HTTPSConnection which resumes *session*, a previous TLS session to
+    the same host, if it is given one, and connects to *address* as
+    HTTPConnection does.
+    """
+
+    def __init__(self, host, port=None, session=None, address=None, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.session = session
+        self.address = address
+        self.timings = None
+        self.abort = None
+
+    def connect(self):
+        sock = opensocket(self)
+        start_time = time.monotonic()
+        try:
+            # The handshake is left until the wrapped socket is attached, as
+            # the socket attached before is detached by wrapping it.
+            self.sock = self._context.wrap_socket(sock, server_hostname=self.host,
+                                                  session=self.session,
+                                                  do_handshake_on_connect=False)
+            if self.abort is not None:
+                self.abort.attach(self.sock)
+            self.sock.do_handshake()
+        finally:
+            timing.addtime(self.timings, 'tls', time.monotonic() - start_time)
+
+
+class DecodedResponse:
+    """The body of *response*, an HTTPResponse, decompressed as its
+    Content-Encoding says as it is read, a CHUNK_SIZE of compressed bytes at
+    a time. More than *limit* bytes decompressed (None -> no limit) raises
+    BodyTooLarge. Anything else is as the response.
+    """
+
+    def __init__(self, response, limit=None):
+        self.response = response
+        self.limit = limit
+        self.received = 0 # Compressed bytes read.
+        self.decoded = 0
+        self._ended = False
+        self.encoding = (response.getheader('content-encoding') or '').strip().lower()
+        self._zlib = None
+        if self.encoding in ('gzip', 'x-gzip'):
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self._zlib = zlib.decompressobj()
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+    def read(self, size=-1):
+        """Return up to *size* bytes of the decompressed body; all of it if
+        *size* is negative. b'' at the end.
+        """
+        if self._zlib is None:
+            return self.response.read() if size is None or size < 0 else self.response.read(size)
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(CHUNK_SIZE), b''))
+        while not self._ended:
+            data = self._zlib.unconsumed_tail
+            if not data:
+                if self._zlib.eof:
+                    if not self.response.isclosed():
+                        self.response.read(CHUNK_SIZE) # So the end of a chunked body is seen.
+                    break
+                data = self.response.read(CHUNK_SIZE)
+                self.received += len(data)
+                if not data: # Cut short, or not framed; whatever is left.
+                    self._ended = True
+                    return self._count(self._zlib.flush())
+            try:
+                chunk = self._zlib.decompress(data, size)
+            except zlib.error:
+                if self.encoding != 'deflate' or self.decoded or self.received > len(data):
+                    raise
+                # Raw deflate, without the zlib header, as some servers send.
+                self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+                chunk = self._zlib.decompress(data, size)
+            if chunk:
+                return self._count(chunk)
+        return b''
+
+    def _count(self, chunk):
+        self.decoded += len(chunk)
+        if self.limit and self.decoded > self.limit:
+            raise BodyTooLarge('{} body over {} bytes decompressed'.format(self.encoding,
+                                                                           self.limit))
+        return chunk
+
+
+class ConnectionPool:
+    """Hand out connections per (schema, host, port), keeping up to *size*
+    idle connections per host alive for *idle_timeout* seconds.
+
+    All HTTPS connections share one SSL context, and the last TLS session
+    seen per host is offered for resumption on new connections to it.
+    Safe to share between threads; a connection is only ever used by the
+    thread which checked it out.
+
+    If given a *resolver* (resolver.Resolver), new connections are made to
+    the address it has for the host, rather than looking it up again.
+
+    Compressed bodies are decompressed up to *max_decompressed* bytes; see
+    DecodedResponse.
+
+    The requests a thread makes within aborting(abort) can be aborted by
+    another thread with abort.abort().
+    """
+
+    def __init__(self, size=4, idle_timeout=30, timeout=None, resolver=None, logger=None,
+                 max_decompressed=None):
+        self.size = size
+        self.max_decompressed = max_decompressed
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.resolver = resolver
+        self.logger = logger
+        # No certificate validation, as with httplib2's
+        # disable_ssl_certificate_validation=True.
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.context.check_hostname = False
+        self.context.verify_mode = ssl.CERT_NONE
+        self._idle = collections.defaultdict(collections.deque) # key -> (conn, last used)
+        self._sessions = {} # (host, port) -> ssl.SSLSession
+        self._lock = threading.Lock()
+        self._local = threading.local() # .abort, the Abort of the thread's requests.
+        # Counters.
+        self.created = 0
+        self.reused = 0
+        self.resumed = 0
+        self.received = 0 # Bytes of compressed bodies,
+        self.decoded = 0  # and what they decompressed to.
+
+    def __repr__(self):
+        return ('ConnectionPool(size={}, idle_timeout={}, created={}, reused={}, resumed={})'
+                .format(self.size, self.idle_timeout, self.created, self.reused, self.resumed))
+
+    @staticmethod
+    def splitkey(url):
+        """Return a tuple of ((schema, host, port), path) for *url*."""
+        parts = urllib.parse.urlsplit(url)
+        schema = parts.scheme.lower()
+        port = parts.port or (443 if schema == 'https' else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path = '?'.join((path, parts.query))
+        return (schema, parts.hostname, port), path
+
+    def _new(self, key):
+        schema, host, port = key
+        kwargs = {} if self.timeout is None else {'timeout': self.timeout}
+        if self.resolver:
+            addresses = self.resolver.lookup(host)
+            kwargs['address'] = addresses[0] if addresses else None
+        if schema == 'https':
+            with self._lock:
+                session = self._sessions.get((host, port))
+            conn = HTTPSConnection(host, port, session=session, context=self.context, **kwargs)
+        else:
+            conn = HTTPConnection(host, port, **kwargs)
+        with self._lock:
+            self.created += 1
+        return conn
+
+    @contextlib.contextmanager
+    def aborting(self, abort):
+        """Make the requests of this thread abortable with *abort*, an Abort
+        (None -> not abortable), within the with statement.
+        """
+        previous = getattr(self._local, 'abort', None)
+        self._local.abort = abort
+        try:
+            yield abort
+        finally:
+            if abort is not None:
+                abort.detach()
+            self._local.abort = previous
+
+    def aborted(self):
+        """Return True if the requests of this thread were aborted."""
+        abort = getattr(self._local, 'abort', None)
+        return abort is not None and abort.aborted
+
+    def checkout(self, key):
+        """Return a tuple of (connection, reused) for *key*; an idle
+        connection if there is one, else a new one.
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle[key]
+            while idle:
+                conn, last_used = idle.pop() # Most recently used first.
+                if now - last_used < self.idle_timeout:
+                    return conn, True
+                conn.close()
+        return self._new(key), False
+
+    def checkin(self, key, conn):
+        """Keep *conn* for reuse, unless the host already has self.size
+        idle connections.
+        """
+        sock = conn.sock
+        if sock is None: # Closed by the server (Connection: close).
+            return
+        with self._lock:
+            if key[0] == 'https' and getattr(sock, 'session', None):
+                self._sessions[key[1:]] = sock.session
+            idle = self._idle[key]
+            if len(idle) < self.size:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def send(self, key, path, headers=None, timings=None, timeout=None):
+        """Make a GET request for *path* over a connection for *key*.
+        Return a tuple of (connection, response); the body is not read.
+
+        If given *timings*, a dict, the time taken to connect (dns, connect
+        and tls; none for a reused connection) and the rest of the time to
+        the response (ttfb) are added to it. If given a *timeout*, it's used
+        instead of self.timeout, for this request and reading its body.
+        """
+        headers = dict({'User-Agent': USER_AGENT, 'Accept-Encoding': ACCEPT_ENCODING},
+                       **(headers or {}))
+        abort = getattr(self._local, 'abort', None)
+        while True:
+            conn, reused = self.checkout(key)
+            conn.timings = timings
+            conn.abort = abort
+            if timeout is not None:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+            start_time = time.monotonic()
+            connecting = timing.connecting(timings)
+            try:
+                if abort is not None and conn.sock is not None: # Reused.
+                    abort.attach(conn.sock)
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except (ConnectionError, http.client.BadStatusLine) as err:
+                conn.close()
+                if abort is not None and abort.aborted:
+                    raise Aborted(key) from err
+                if not reused:
+                    raise
+                # The server dropped an idle keep-alive connection; try again.
+                continue
+            except Exception as err:
+                conn.close()
+                if abort is not None and abort.aborted:
+                    raise Aborted(key) from err
+                raise
+            finally:
+                conn.timings = None
+                conn.abort = None
+                timing.addtime(timings, 'ttfb', time.monotonic() - start_time
+                               - (timing.connecting(timings) - connecting))
+            with self._lock:
+                if reused:
+                    self.reused += 1
+                elif getattr(conn.sock, 'session_reused', False):
+                    self.resumed += 1
+            return conn, response
+
+    def open(self, url, headers=None, redirects=5, timings=None, timeout=None):
+        """Request *url*, following up to *redirects* redirects.
+
+        Return a tuple of (key, connection, response), for reading the body
+        of response as it arrives, decompressed (a DecodedResponse). Pass
+        them to release when done. The time
+        taken is added to *timings*, and *timeout* used, as send does, for
+        every redirect.
+        """
+        for _ in range(redirects + 1):
+            key, path = self.splitkey(url)
+            conn, response = self.send(key, path, headers, timings, timeout)
+            location = response.getheader('location')
+            if response.status not in REDIRECTS or not location:
+                return key, conn, DecodedResponse(response, self.max_decompressed)
+            response.read()
+            self.release(key, conn, response)
+            url = urllib.parse.urljoin(url, location)
+            if self.logger:
+                self.logger.debug('httppool: redirected to: %s', url)
+        return key, conn, DecodedResponse(response, self.max_decompressed)
+
+    def release(self, key, conn, response):
+        """Return *conn* to the pool if *response* was read in full and the
+        server will keep the connection open, and the request wasn't
+        aborted; else close it.
+        """
+        abort = getattr(self._local, 'abort', None)
+        if abort is not None and abort.detach():
+            conn.close()
+            return
+        if getattr(response, 'encoding', None): # Compressed.
+            with self._lock:
+                self.received += response.received
+                self.decoded += response.decoded
+        if response.isclosed() and not response.will_close:
+            self.checkin(key, conn)
+        else:
+            conn.close()
+
+    def request(self, url, headers=None, timings=None, received=None, timeout=None):
+        """Return a tuple of (status code, body as bytes) for *url*. The time
+        taken is added to *timings*, and *timeout* used, as open does, and
+        the time to read the body added as download. The response headers,
+        with names in lower case, are put in *received*, a dict, if given.
+        """
+        key, conn, response = self.open(url, headers, timings=timings, timeout=timeout)
+        if received is not None:
+            received.update((name.lower(), value) for name, value in response.getheaders())
+        start_time = time.monotonic()
+        try:
+            content = response.read()
+        except Exception as err:
+            conn.close()
+            if self.aborted():
+                raise Aborted(url) from err
+            raise
+        if self.aborted(): # Cut short, without an error if there was no length.
+            conn.close()
+            raise Aborted(url)
+        timing.addtime(timings, 'download', time.monotonic() - start_time)
+        self.release(key, conn, response)
+        return response.status, content
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            for idle in self._idle.values():
+                while idle:
+                    idle.pop()[0].close()
+            self._idle.clear()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3.6
+
+"""Open url lists for reading a line at a time: plain, compressed or stdin."""
+
+import bz2
+import gzip
+import lzma
+import sys
+
+# Extension -> function to open a compressed file with.
+OPENERS = {'.gz': gzip.open, '.xz': lzma.open, '.bz2': bz2.open}
+
+
+class Stdin:
+    """Context manager for sys.stdin, which leaves it open on exit."""
+
+    def __enter__(self):
+        return sys.stdin
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def openinput(path):
+    """Return a text file object for *path*, to be used in a with statement.
+
+    '-' is stdin; a path ending in .gz, .xz or .bz2 is decompressed as it
+    is read. Nothing is read ahead, so entries can be scanned as they
+    arrive, however long the list is.
+    """
+    if path == '-':
+        return Stdin()
+    for extension, opener in OPENERS.items():
+        if path.endswith(extension):
+            return opener(path, 'rt')
+    return open(path)
+
+
+def count(path):
+    """Return the number of entries (lines which aren't blank) in *path*;
+    None for stdin, which can only be read once.
+    """
+    if path == '-':
+        return None
+    with openinput(path) as f:
+        return sum(1 for line in f if line.strip())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3.6
+
+"""Checkpoint journal of the entries of an infile which have been scanned."""
+
+import sqlite3
+import threading
+
+
+class Journal:
+    """An SQLite table of the infile entries whose rows were written, kept
+    at *path* (by default next to the outfile, as outfile.journal).
+
+    Lookups go to the database, so resuming never loads the journal, or
+    the outfile, into memory. Entries are committed *batch* at a time; the
+    caller flushes the outfile before each commit, so an entry is never
+    journaled before its row is on disk. At worst the rows of one batch are
+    written twice after a crash.
+
+    Unless *resume*, the journal is emptied, as for a new scan.
+    """
+
+    def __init__(self, path, resume=False, batch=100):
+        self.path = path
+        self.batch = batch
+        self.pending = 0 # Added since the last commit.
+        self._lock = threading.Lock()
+        # Written by a writer thread, read while queueing urls.
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS done (entry TEXT PRIMARY KEY)')
+        if not resume:
+            self.db.execute('DELETE FROM done')
+        self.db.commit()
+
+    def __repr__(self):
+        return 'Journal({!r})'.format(self.path)
+
+    def __contains__(self, entry):
+        with self._lock:
+            return self.db.execute('SELECT 1 FROM done WHERE entry = ?', (entry,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute('SELECT COUNT(*) FROM done').fetchone()[0]
+
+    def add(self, entry):
+        """Record *entry* as done, as of the next commit."""
+        with self._lock:
+            self.db.execute('INSERT OR IGNORE INTO done (entry) VALUES (?)', (entry,))
+            self.pending += 1
+
+    def commit(self):
+        with self._lock:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        self.commit()
+        with self._lock:
+            self.db.close()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3.6
+
+"""Literals a regex can't match without, found by parsing the pattern, so a
+page can be ruled out with a substring search before the regex is run.
+
+    >>> literal(r".*CoinHive.Anonymous\\('?\"?(?P<hash>\\w{,32})'?\"?\\)")
+    'Anonymous('
+"""
+
+try: # Moved, and sre_parse deprecated, in 3.11.
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+# Shorter literals rule out too little to be worth a pass over the page.
+MIN_LENGTH = 3
+
+
+def required(parsed):
+    """Return a list of the literals (as lists of character codes) which
+    every match of *parsed*, a parsed pattern, contains.
+
+    Only runs of literals in sequence count; alternations, character sets
+    and anything which may be repeated zero times are skipped, as are
+    groups which ignore case.
+    """
+    found, run = [], []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            run.append(av)
+            continue
+        if run: # Broken by anything else.
+            found.append(run)
+            run = []
+        if op is sre_parse.SUBPATTERN:
+            add_flags, sub = av[1], av[-1]
+            if not add_flags & sre_parse.SRE_FLAG_IGNORECASE:
+                found.extend(required(sub))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) \
+                or op is getattr(sre_parse, 'POSSESSIVE_REPEAT', None):
+            if av[0] >= 1:
+                found.extend(required(av[2]))
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            found.extend(required(av))
+    if run:
+        found.append(run)
+    return found
+
+
+def literal(pattern, flags=0):
+    """Return the longest literal every match of *pattern* (a string, or
+    bytes) contains, of the same type; None if there is none of at least
+    MIN_LENGTH characters, or the pattern ignores case.
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception: # Left to re.compile to complain about.
+        return None
+    state = getattr(parsed, 'state', None) or parsed.pattern # Named pattern before 3.7.
+    if state.flags & sre_parse.SRE_FLAG_IGNORECASE:
+        return None
+    runs = [run for run in required(parsed) if len(run) >= MIN_LENGTH]
+    if not runs:
+        return None
+    longest = max(runs, key=len)
+    if isinstance(pattern, bytes):
+        return bytes(longest)
+    return ''.join(map(chr, longest))
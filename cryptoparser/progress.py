@@ -0,0 +1,200 @@
+#!/usr/bin/env python3.6
+
+"""How far along a run is, refreshed every few seconds: a line on stderr, a
+JSON status file, and a UNIX socket answering with the same JSON, so a
+long run can be watched (or scraped) while it goes.
+
+    $ python3.6 -c "import socket; s = socket.socket(socket.AF_UNIX); \
+s.connect('scan.sock'); print(s.recv(65536).decode())"
+"""
+
+import collections
+import json
+import os
+import socketserver
+import threading
+import time
+
+
+def duration(seconds):
+    """Return *seconds* as H:MM:SS; ? if None."""
+    if seconds is None:
+        return '?'
+    minutes, seconds = divmod(int(seconds), 60)
+    return '{}:{:02}:{:02}'.format(minutes // 60, minutes % 60, seconds)
+
+
+class StatusHandler(socketserver.BaseRequestHandler):
+    """Answer every connection with the status, as a line of JSON."""
+
+    def handle(self):
+        self.request.sendall(json.dumps(self.server.progress.status()).encode('utf-8') + b'\n')
+
+
+class StatusServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Progress:
+    """Counts of a run, updated by the Scanner from any thread: entries done
+    and skipped (of *total*, if known), requests in flight, outcomes, and
+    errors by class. Every *interval* seconds, the status is written as a
+    line to *stream* (None -> not at all), and as JSON to *statusfile*; a
+    UNIX socket at *socketpath* answers with it whenever asked.
+
+    The rate is that of the last *window* seconds, so it follows changes of
+    pace (a slow patch of the list, raised concurrency) in a long run.
+    """
+
+    def __init__(self, total=None, interval=2.0, stream=None, statusfile=None, socketpath=None,
+                 window=30.0):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.statusfile = statusfile
+        self.socketpath = socketpath
+        self.window = window
+        self.done = 0
+        self.skipped = 0 # Not scanned: already in the journal.
+        self.inflight = 0
+        self.hits = 0
+        self.outcomes = collections.Counter()
+        self.errors = collections.Counter()
+        self.start_time = time.monotonic()
+        self.running = False
+        self._samples = collections.deque() # (time, done), the last self.window seconds.
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._ticker = None
+        self._server = None
+        self._tty = bool(stream) and stream.isatty()
+
+    def __repr__(self):
+        return 'Progress(interval={}, statusfile={!r}, socketpath={!r})'.format(
+            self.interval, self.statusfile, self.socketpath)
+
+    def settotal(self, total):
+        with self._lock:
+            self.total = total
+
+    def started(self):
+        with self._lock:
+            self.inflight += 1
+
+    def finished(self):
+        with self._lock:
+            self.inflight -= 1
+
+    def skip(self, n=1):
+        with self._lock:
+            self.skipped += n
+
+    def error(self, name):
+        """Count an error of class *name*, e.g. ConnectionRefusedError."""
+        with self._lock:
+            self.errors[name] += 1
+
+    def written(self, rows):
+        """Count an entry done, with *rows*, its Results."""
+        with self._lock:
+            self.done += 1
+            for row in rows:
+                self.outcomes[row.outcome] += 1
+                if row.found:
+                    self.hits += 1
+
+    def status(self):
+        """Return a dict of where the run is, and how fast it is going."""
+        now = time.monotonic()
+        with self._lock:
+            samples = self._samples
+            samples.append((now, self.done))
+            while len(samples) > 2 and now - samples[1][0] >= self.window:
+                samples.popleft()
+            then, donethen = samples[0]
+            rate = (self.done - donethen) / (now - then) if now > then else 0.0
+            remaining = None
+            if self.total is not None:
+                remaining = max(self.total - self.done - self.skipped, 0)
+            return collections.OrderedDict([
+                ('running', self.running),
+                ('elapsed', round(now - self.start_time, 1)),
+                ('done', self.done),
+                ('skipped', self.skipped),
+                ('total', self.total),
+                ('remaining', remaining),
+                ('inflight', self.inflight),
+                ('rate', round(rate, 2)),
+                ('eta', round(remaining / rate, 1) if remaining is not None and rate else None),
+                ('hits', self.hits),
+                ('outcomes', dict(self.outcomes)),
+                ('errors', dict(self.errors)),
+                ])
+
+    @staticmethod
+    def line(status):
+        """Return *status* as one line, for a terminal."""
+        done = '{}/{}'.format(status['done'], status['total']) if status['total'] is not None \
+            else str(status['done'])
+        errors = ', '.join('{} {}'.format(count, name) for name, count
+                           in sorted(status['errors'].items(), key=lambda item: -item[1])[:3])
+        return ('{} done, {:.1f} urls/s, {} in flight, {} hits, eta {}{}'
+                .format(done, status['rate'], status['inflight'], status['hits'],
+                        duration(status['eta']), '; errors: ' + errors if errors else ''))
+
+    def report(self):
+        """Write the status to self.stream and self.statusfile."""
+        status = self.status()
+        if self.stream:
+            line = self.line(status)
+            # Redrawn in place on a terminal; a line at a time into a file.
+            self.stream.write('\r{:<79}'.format(line) if self._tty else line + '\n')
+            self.stream.flush()
+        if self.statusfile:
+            partial = self.statusfile + '.tmp'
+            with open(partial, 'w') as f:
+                json.dump(status, f)
+                f.write('\n')
+            os.replace(partial, self.statusfile) # Never read half written.
+
+    def start(self):
+        """Report every self.interval seconds, and serve the socket, in
+        threads of their own, until stop.
+        """
+        self.running = True
+        self.start_time = time.monotonic()
+        self._samples.append((self.start_time, self.done))
+        if self.socketpath:
+            if os.path.exists(self.socketpath): # Left by a run which died.
+                os.remove(self.socketpath)
+            self._server = StatusServer(self.socketpath, StatusHandler)
+            self._server.progress = self
+            threading.Thread(target=self._server.serve_forever, name='progress-socket',
+                             daemon=True).start()
+        if self.stream or self.statusfile:
+            self._ticker = threading.Thread(target=self._tick, name='progress', daemon=True)
+            self._ticker.start()
+
+    def _tick(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        """Report once more, as finished, and stop."""
+        self.running = False
+        self._stopped.set()
+        if self._ticker:
+            self._ticker.join()
+            self._ticker = None
+        if self.stream or self.statusfile:
+            self.report()
+            if self._tty:
+                self.stream.write('\n')
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.remove(self.socketpath)
+            except OSError:
+                pass
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3.6
+
+"""Token bucket rate limits per target: address, registrable domain and ASN."""
+
+import ipaddress
+import threading
+import time
+
+# Second level labels under which country code TLDs register domains, e.g.
+# example.co.uk. Not the public suffix list, but close enough to group hosts.
+SECOND_LEVEL = {'ac', 'co', 'com', 'edu', 'gov', 'ltd', 'me', 'net', 'or', 'org', 'plc'}
+
+
+def registrable(host):
+    """Return the registrable domain of *host*.
+    Example: www.example.co.uk -> example.co.uk
+    """
+    try: # An address is its own domain.
+        return str(ipaddress.ip_address(host))
+    except ValueError:
+        pass
+    labels = host.lower().rstrip('.').split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+class TokenBucket:
+    """Allow *rate* requests per second, in bursts of up to *burst*."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def refill(self, now):
+        if now > self.last:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+    def reserve(self, now):
+        """Take a token, and return the seconds to wait until it is due; 0 if
+        one was there. Tokens may be owed, so waiters queue up in order.
+        """
+        self.refill(now)
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+class ASNMap:
+    """Address -> ASN, by longest prefix match, from a file of lines of:
+    PREFIX/LENGTH ASN, or PREFIX LENGTH ASN (as in a routeviews pfx2as file).
+    """
+
+    def __init__(self, path):
+        self.networks = {}
+        with open(path) as f:
+            for line in f:
+                fields = line.split('#', 1)[0].split()
+                if len(fields) == 3:
+                    fields = ['/'.join(fields[:2]), fields[2]]
+                if len(fields) != 2:
+                    continue
+                network = ipaddress.ip_network(fields[0], strict=False)
+                self.networks[network] = fields[1]
+        self.prefixlens = sorted({network.prefixlen for network in self.networks}, reverse=True)
+
+    def __len__(self):
+        return len(self.networks)
+
+    def lookup(self, address):
+        """Return the ASN announcing *address*, or None."""
+        address = ipaddress.ip_address(address)
+        for prefixlen in self.prefixlens:
+            if prefixlen > address.max_prefixlen:
+                continue
+            network = ipaddress.ip_network((address, prefixlen), strict=False)
+            if network in self.networks:
+                return self.networks[network]
+
+
+class RateLimiter:
+    """Token buckets per target, so a request only waits if it would take
+    its target over budget; requests to unrelated hosts don't wait at all.
+
+    *rates* is a dict of kind -> requests per second, for any of the kinds:
+    'ip' (the host's first resolved address, looked up with *resolver*),
+    'domain' (the registrable domain of the host) and 'asn' (the ASN of
+    the address, from *asnmap*, an ASNMap). Each bucket holds *burst*.
+    """
+
+    # Drop full buckets (as good as new) once there are more than this many.
+    prune = 10000
+
+    def __init__(self, rates, burst=1, resolver=None, asnmap=None, logger=None):
+        self.rates = {kind: rate for kind, rate in rates.items() if rate}
+        self.burst = burst
+        self.resolver = resolver
+        self.asnmap = asnmap
+        self.logger = logger
+        self._buckets = {} # (kind, target) -> TokenBucket
+        self._lock = threading.Lock()
+        # Counters.
+        self.waits = 0
+        self.waited = 0.0
+
+    def __repr__(self):
+        return 'RateLimiter(rates={}, burst={}, waits={}, waited={:.1f}s)'.format(
+            self.rates, self.burst, self.waits, self.waited)
+
+    def targets(self, host):
+        """Return a list of (kind, target) tuples which a request to *host*
+        counts against.
+        """
+        targets = []
+        if 'domain' in self.rates:
+            targets.append(('domain', registrable(host)))
+        if 'ip' in self.rates or 'asn' in self.rates:
+            addresses = self.resolver.lookup(host) if self.resolver else None
+            if addresses:
+                if 'ip' in self.rates:
+                    targets.append(('ip', addresses[0]))
+                asn = self.asnmap.lookup(addresses[0]) if self.asnmap else None
+                if 'asn' in self.rates and asn:
+                    targets.append(('asn', asn))
+        return targets
+
+    def acquire(self, host):
+        """Block until a request to *host* is within every budget."""
+        targets = self.targets(host)
+        now = time.monotonic()
+        wait = 0
+        with self._lock:
+            for kind, target in targets:
+                bucket = self._buckets.get((kind, target))
+                if bucket is None:
+                    bucket = self._buckets[kind, target] = TokenBucket(self.rates[kind], self.burst)
+                wait = max(wait, bucket.reserve(now))
+            if len(self._buckets) > self.prune:
+                for key in [key for key, bucket in self._buckets.items() if bucket.full(now)]:
+                    del self._buckets[key]
+            if wait:
+                self.waits += 1
+                self.waited += wait
+        if wait:
+            if self.logger:
+                self.logger.debug('ratelimit: waiting %.2fs for: %s', wait, host)
+            time.sleep(wait)
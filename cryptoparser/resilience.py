@@ -0,0 +1,192 @@
+#!/usr/bin/env python3.6
+
+"""Telling a host which blipped from one which is gone: retries with
+backoff for errors which may go away, timeouts which adapt to how fast
+hosts answer, and a circuit breaker, kept between runs, which stops
+requesting hosts that failed run after run.
+"""
+
+import http.client
+import random
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+
+# Package modules.
+import timing
+
+# Errors worth trying again: the connection was dropped part way. Refused
+# connections, timeouts, lookups and certificates fail the same way twice.
+RETRYABLE = (ConnectionResetError, ConnectionAbortedError, BrokenPipeError,
+             http.client.IncompleteRead, http.client.BadStatusLine, ssl.SSLEOFError)
+
+
+def retryable(err):
+    return isinstance(err, RETRYABLE)
+
+
+def timedout(err):
+    return isinstance(err, (socket.timeout, TimeoutError))
+
+
+class RetryPolicy:
+    """Retry up to *retries* times, waiting *base* seconds, doubled every
+    attempt up to *cap*, with the second half of every wait random so
+    retries of a host which dropped many connections at once don't all
+    arrive at once again. Safe to share between threads.
+    """
+
+    def __init__(self, retries=0, base=0.5, cap=8.0):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self._lock = threading.Lock()
+        # Counters.
+        self.retried = 0
+        self.waited = 0.0
+
+    def __repr__(self):
+        return 'RetryPolicy(retries={}, base={}, cap={})'.format(self.retries, self.base, self.cap)
+
+    def delay(self, attempt):
+        """Return the seconds to wait before retry number *attempt* + 1."""
+        delay = min(self.cap, self.base * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def wait(self, attempt):
+        delay = self.delay(attempt)
+        with self._lock:
+            self.retried += 1
+            self.waited += delay
+        time.sleep(delay)
+        return delay
+
+
+class AdaptiveTimeouts:
+    """Timeouts per host, from how long its requests took, as TCP sets its
+    retransmission timeout: a smoothed average plus four times the
+    variation, kept between *floor* and *ceiling* seconds (the ceiling
+    wins, if it's lower: it's the timeout the user asked for).
+
+    A host not seen yet gets *factor* times the 99th percentile of every
+    host's requests so far, once there are *warmup* of them (*ceiling*
+    until then), so dead hosts are given up on about as soon as live ones
+    would have answered. A host which times out has its timeout doubled.
+    Safe to share between threads.
+    """
+
+    def __init__(self, ceiling=30.0, floor=2.0, factor=2.0, warmup=100):
+        self.ceiling = ceiling
+        self.floor = min(floor, ceiling)
+        self.factor = factor
+        self.warmup = warmup
+        self.hosts = {} # host -> [smoothed seconds, variation, timeout]
+        self.seen = timing.Histogram()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'AdaptiveTimeouts(ceiling={}, floor={})'.format(self.ceiling, self.floor)
+
+    def clamp(self, seconds):
+        return max(self.floor, min(self.ceiling, seconds))
+
+    def timeout(self, host):
+        """Return the seconds to wait for *host*."""
+        with self._lock:
+            known = self.hosts.get(host)
+            if known is not None:
+                return known[2]
+            if self.seen.count < self.warmup:
+                return self.ceiling
+            return self.clamp(self.factor * self.seen.percentile(99))
+
+    def observe(self, host, seconds):
+        """Note that a request to *host* took *seconds*."""
+        with self._lock:
+            self.seen.add(seconds)
+            known = self.hosts.get(host)
+            if known is None:
+                smoothed, variation = seconds, seconds / 2
+            else:
+                smoothed, variation = known[0], known[1]
+                variation = 0.75 * variation + 0.25 * abs(smoothed - seconds)
+                smoothed = 0.875 * smoothed + 0.125 * seconds
+            self.hosts[host] = [smoothed, variation, self.clamp(smoothed + 4 * variation)]
+
+    def backoff(self, host):
+        """Double the timeout of *host*, which timed out."""
+        timeout = self.timeout(host)
+        with self._lock:
+            known = self.hosts.setdefault(host, [timeout, 0.0, timeout])
+            known[2] = self.clamp(2 * timeout)
+
+
+class CircuitBreaker:
+    """An SQLite table at *path* of the hosts which failed (no request to
+    them could be made) the last runs in a row. Once a host has failed
+    *runs* runs in a row, it isn't requested again until *cooloff* seconds
+    later; then it's tried once, and if it fails again, skipped for
+    another *cooloff*.
+
+    Outcomes are noted per run with record, and written by close. Safe to
+    share between threads, and between processes scanning different hosts.
+    """
+
+    def __init__(self, path, runs=3, cooloff=7 * 24 * 3600):
+        self.path = path
+        self.runs = runs
+        self.cooloff = cooloff
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, '
+                        'failures INTEGER, failed REAL, open_until REAL)')
+        self.db.commit()
+        # Hosts skipped this run -> until when.
+        self.open = dict(self.db.execute('SELECT host, open_until FROM hosts WHERE open_until > ?',
+                                         (time.time(),)))
+        self.outcomes = {} # host -> whether any request to it was made this run.
+        self._lock = threading.Lock()
+        # Counters.
+        self.skipped = 0
+        self.opened = 0
+
+    def __repr__(self):
+        return 'CircuitBreaker({!r}, runs={}, cooloff={})'.format(self.path, self.runs,
+                                                                  self.cooloff)
+
+    def isopen(self, host):
+        """Return True if *host* is to be skipped."""
+        if host not in self.open:
+            return False
+        with self._lock:
+            self.skipped += 1
+        return True
+
+    def record(self, host, ok):
+        """Note whether a request to *host* could be made (*ok*); a host
+        failed this run only if none could.
+        """
+        with self._lock:
+            self.outcomes[host] = ok or self.outcomes.get(host, False)
+
+    def close(self):
+        """Write the outcomes of this run: hosts which failed have another
+        failure, and are skipped if that makes self.runs; the rest are
+        forgotten.
+        """
+        now = time.time()
+        with self._lock:
+            failed = [host for host, ok in self.outcomes.items() if not ok]
+            self.db.executemany('DELETE FROM hosts WHERE host = ?',
+                                ((host,) for host, ok in self.outcomes.items() if ok))
+            self.db.executemany('INSERT OR IGNORE INTO hosts VALUES (?, 0, ?, 0)',
+                                ((host, now) for host in failed))
+            self.db.executemany('UPDATE hosts SET failures = failures + 1, failed = ? '
+                                'WHERE host = ?', ((now, host) for host in failed))
+            self.db.execute('UPDATE hosts SET open_until = ? WHERE failures >= ? AND failed = ?',
+                            (now + self.cooloff, self.runs, now))
+            self.opened = self.db.execute('SELECT changes()').fetchone()[0]
+            self.db.commit()
+            self.db.close()
+            self.outcomes = {}
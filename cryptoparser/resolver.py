@@ -0,0 +1,133 @@
+#!/usr/bin/env python3.6
+
+"""Resolve the hosts of a url list up front, concurrently, with a shared cache."""
+
+import concurrent.futures # ThreadPoolExecutor
+import ipaddress
+import itertools
+import socket
+import threading
+import time
+
+
+class Resolver:
+    """Cache of host name -> addresses, filled *workers* lookups at a time.
+
+    Addresses are kept for *ttl* seconds. Names which do not exist
+    (NXDOMAIN, or no addresses) are cached as None for *negative_ttl*
+    seconds. Other failures, e.g. a timed out lookup, are not cached, and
+    are returned as an empty list: unknown, rather than not resolving.
+
+    *hosts* is a dict of name -> addresses (see loadhosts) which is used
+    before anything else; *resolve* is the function used for the rest,
+    socket.getaddrinfo by default. Either can stand in for DNS in tests.
+    """
+
+    def __init__(self, ttl=300, negative_ttl=60, workers=32, hosts=None, resolve=None, logger=None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.workers = workers
+        self.hosts = hosts or {}
+        self.resolve = resolve or self.getaddrinfo
+        self.logger = logger
+        self._cache = {} # host -> (addresses or None, expires)
+        self._lock = threading.Lock()
+        # Counters.
+        self.resolved = 0
+        self.nxdomain = 0
+        self.failed = 0
+
+    def __repr__(self):
+        return ('Resolver(ttl={}, negative_ttl={}, workers={}, hosts={}, resolved={}, nxdomain={}, failed={})'
+                .format(self.ttl, self.negative_ttl, self.workers, len(self.hosts),
+                        self.resolved, self.nxdomain, self.failed))
+
+    @staticmethod
+    def loadhosts(path):
+        """Return a dict of name -> list of addresses from a file in the
+        format of /etc/hosts.
+        """
+        hosts = {}
+        with open(path) as f:
+            for line in f:
+                fields = line.split('#', 1)[0].split()
+                if len(fields) < 2:
+                    continue
+                for name in fields[1:]:
+                    hosts.setdefault(name.lower(), []).append(fields[0])
+        return hosts
+
+    @staticmethod
+    def getaddrinfo(host):
+        """Return a list of the addresses of *host*, None if it does not
+        exist. Other errors are raised.
+        """
+        try:
+            infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except socket.gaierror as err:
+            if err.errno in (socket.EAI_NONAME, getattr(socket, 'EAI_NODATA', socket.EAI_NONAME)):
+                return None
+            raise
+        addresses = []
+        for info in infos:
+            if info[4][0] not in addresses:
+                addresses.append(info[4][0])
+        return addresses or None
+
+    @staticmethod
+    def isaddress(host):
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    def lookup(self, host):
+        """Return the addresses of *host*, from the cache if possible; None
+        if it does not exist, [] if that isn't known.
+        """
+        host = host.lower()
+        if self.isaddress(host):
+            return [host]
+        if host in self.hosts:
+            return self.hosts[host]
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(host)
+        if cached and cached[1] > now:
+            return cached[0]
+        try:
+            addresses = self.resolve(host)
+        except Exception as err:
+            with self._lock:
+                self.failed += 1
+            if self.logger:
+                self.logger.debug('resolver: lookup of %s failed: %r', host, err)
+            return []
+        ttl = self.ttl if addresses else self.negative_ttl
+        with self._lock:
+            self._cache[host] = (addresses, now + ttl)
+            if addresses:
+                self.resolved += 1
+            else:
+                self.nxdomain += 1
+        return addresses
+
+    def prefetch(self, hosts):
+        """Look up every host in *hosts* at once, *workers* at a time."""
+        hosts = set(host.lower() for host in hosts)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self.lookup, hosts))
+
+    def prefetchall(self, entries, hostof, batch=1000):
+        """Yield *entries*, having looked up the host (given by *hostof*) of
+        each batch of them before yielding the first of the batch, so later
+        lookups are answered from the cache.
+        """
+        entries = iter(entries)
+        while True:
+            chunk = list(itertools.islice(entries, batch))
+            if not chunk:
+                return
+            self.prefetch(host for host in map(hostof, chunk) if host)
+            yield from chunk
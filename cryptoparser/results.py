@@ -0,0 +1,68 @@
+#!/usr/bin/env python3.6
+
+"""The outcome of scanning an entry of the infile."""
+
+import collections
+
+# Statuses which aren't HTTP status codes.
+FAILED = -1   # No request could be made, or it timed out.
+NXDOMAIN = -2 # The host doesn't resolve; no request was made.
+SKIPPED = -3  # The host failed the last runs; not requested (see resilience).
+
+FIELDS = ('entry', 'domain', 'schema', 'status', 'hash', 'signature', 'fetchtime', 'bytes',
+          'digest')
+
+
+class Result(collections.namedtuple('Result', FIELDS)):
+    """One row of output.
+
+    entry     -- the line of the infile scanned
+    domain    -- the domain requested, as in the original output
+    schema    -- http or https; None if no request was made
+    status    -- HTTP status code, or FAILED, NXDOMAIN or SKIPPED
+    hash      -- the match (the key, for a signature); None if not found
+    signature -- the name of the signature found, with a signature pack
+    fetchtime -- seconds taken by the request, including matching
+    bytes     -- size of the body read
+    digest    -- of the body read (see state.digest), with a state store
+    """
+
+    __slots__ = ()
+
+    @property
+    def found(self):
+        return self.hash is not None
+
+    @property
+    def outcome(self):
+        """found, nomatch (a page without the pattern), failed, nxdomain,
+        skipped, or status (any other HTTP status code).
+        """
+        if self.found:
+            return 'found'
+        if self.status == 200:
+            return 'nomatch'
+        if self.status == FAILED:
+            return 'failed'
+        if self.status == NXDOMAIN:
+            return 'nxdomain'
+        if self.status == SKIPPED:
+            return 'skipped'
+        return 'status'
+
+    def legacy(self):
+        """Return the row as originally written to the outfile:
+        domain,hash,schema (domain,key,schema,signature with a signature
+        pack) if found, else domain,0 if a page was returned, domain,-1 if
+        not, domain,-2 if the host doesn't resolve, and domain,-3 if it was
+        skipped.
+        """
+        if self.signature is not None:
+            return '{},{},{},{}'.format(self.domain, self.hash, self.schema, self.signature)
+        if self.found:
+            return '{},{},{}'.format(self.domain, self.hash, self.schema)
+        if self.status == 200:
+            return '{},0'.format(self.domain)
+        if self.status in (NXDOMAIN, SKIPPED):
+            return '{},{}'.format(self.domain, self.status)
+        return '{},{}'.format(self.domain, FAILED)
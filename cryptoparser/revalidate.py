@@ -0,0 +1,140 @@
+#!/usr/bin/env python3.6
+
+"""Validators (ETag, Last-Modified) and matches per url, kept between runs,
+so pages unchanged since the last scan aren't downloaded or matched again.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+class ValidatorCache:
+    """An SQLite table at *path* of url -> the validators its page was sent
+    with, and what was matched on it.
+
+    *fingerprint* is a string standing for what was searched for (see
+    Scanner.fingerprint); if it isn't the same as last time, every page is
+    forgotten, as its match would be out of date.
+
+    Bounded to *size* urls: the least recently used (stored or revalidated)
+    are evicted at each commit. Writes are held in memory, and written
+    *batch* at a time in one short transaction, so the database is never
+    locked for longer than that (readers aren't, in WAL mode); until then,
+    they aren't seen by headers or hit. Safe to share between threads, and
+    between processes (e.g. shards).
+    """
+
+    def __init__(self, path, fingerprint='', size=100000, batch=100):
+        self.path = path
+        self.size = size
+        self.batch = batch
+        self.pending = [] # Writes (sql, parameters) since the last commit.
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, etag TEXT, '
+                        'last_modified TEXT, match TEXT, bytes INTEGER, used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS pages_used ON pages (used)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            self.db.execute('DELETE FROM pages')
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+        self.db.commit()
+        # Counters.
+        self.hits = 0
+        self.misses = 0 # Downloaded in full.
+        self.stored = 0
+        self.evicted = 0
+        self.saved = 0 # Bytes not downloaded again.
+
+    def __repr__(self):
+        return 'ValidatorCache({!r}, size={})'.format(self.path, self.size)
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def headers(self, url):
+        """Return a dict of the conditional request headers for *url*; empty
+        if nothing is cached for it.
+        """
+        with self._lock:
+            row = self.db.execute('SELECT etag, last_modified FROM pages WHERE url = ?',
+                                  (url,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def hit(self, url):
+        """Return a tuple of (match, bytes) cached for *url*, which was not
+        modified (304), and mark it used; None if nothing is cached for it.
+        """
+        with self._lock:
+            row = self.db.execute('SELECT match, bytes FROM pages WHERE url = ?',
+                                  (url,)).fetchone()
+            if row is None:
+                return None
+            self.hits += 1
+            self.saved += row[1] or 0
+            self._written('UPDATE pages SET used = ? WHERE url = ?', (time.time(), url))
+        return self.loadmatch(row[0]), row[1]
+
+    def store(self, url, received, match, nbytes):
+        """Keep the validators in *received* (response headers, with names in
+        lower case) of the page at *url*, and *match*, what was matched on
+        its *nbytes* bytes. A page without validators is forgotten.
+        """
+        etag, last_modified = received.get('etag'), received.get('last-modified')
+        with self._lock:
+            self.misses += 1
+            if not etag and not last_modified: # Can't be revalidated.
+                self._written('DELETE FROM pages WHERE url = ?', (url,))
+            else:
+                self.stored += 1
+                self._written('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                              (url, etag, last_modified, json.dumps(match), nbytes, time.time()))
+
+    @staticmethod
+    def loadmatch(match):
+        """Return *match* as it was before being stored as JSON: a string,
+        None, or a list of (signature name, key) tuples.
+        """
+        match = json.loads(match)
+        if isinstance(match, list):
+            return [tuple(found) for found in match]
+        return match
+
+    def _written(self, sql, parameters):
+        """Hold a write until the next commit. The lock is held."""
+        self.pending.append((sql, parameters))
+        if len(self.pending) >= self.batch:
+            self._commit()
+
+    def _commit(self):
+        """Write what is pending, evict the least recently used urls over
+        self.size, and commit, in one transaction. The lock is held.
+        """
+        with self.db:
+            for sql, parameters in self.pending:
+                self.db.execute(sql, parameters)
+            over = self.db.execute('SELECT COUNT(*) FROM pages').fetchone()[0] - self.size
+            if over > 0:
+                self.db.execute('DELETE FROM pages WHERE url IN '
+                                '(SELECT url FROM pages ORDER BY used LIMIT ?)', (over,))
+                self.evicted += over
+        self.pending = []
+
+    def commit(self):
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        self.commit()
+        with self._lock:
+            self.db.close()
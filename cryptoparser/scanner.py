@@ -1,7 +1,15 @@
 #!/usr/bin/env python3.6
 
+import asyncio
+import codecs     # getincrementaldecoder
+import collections # OrderedDict
+import concurrent.futures # ThreadPoolExecutor
+import hashlib
+import logging
+import queue    # Queue
 import re
 import sys
+import threading
 import time
 
 try:
@@ -9,34 +17,218 @@ try:
 except ModuleNotFoundError: #noqa
     pass
 
+# Package modules.
+import dedup
+import httppool
+import inputs
+import journal
+import prefilter
+import progress
+import ratelimit
+import resilience
+import resolver
+import results
+import revalidate
+import scripts
+import signatures
+import sinks
+import state
+import timing
+
+# Used when no logger is given; silent unless the caller configures logging.
+LOGGER = logging.getLogger(__name__)
+LOGGER.addHandler(logging.NullHandler())
+
+# What fetch returns: status code, match (None if not found), bytes read,
+# seconds taken and the digest of the bytes read (None without a state store).
+Fetched = collections.namedtuple('Fetched', 'status match bytes seconds digest')
+
+
+class ByteCounter:
+    """Read from *response*, counting the bytes read and seconds taken, and
+    with *digest*, hashing them as state.digest does.
+    """
+
+    def __init__(self, response, digest=False):
+        self.response = response
+        self.bytes = 0
+        self.seconds = 0.0
+        self.hash = hashlib.blake2b(digest_size=8) if digest else None
+
+    def read(self, size):
+        start_time = time.monotonic()
+        chunk = self.response.read(size)
+        self.seconds += time.monotonic() - start_time
+        self.bytes += len(chunk)
+        if self.hash:
+            self.hash.update(chunk)
+        return chunk
+
+    def digest(self):
+        return self.hash.hexdigest() if self.hash else None
+
 
 class Scanner:
 
+    # Written instead of a status code for hosts which don't resolve.
+    NXDOMAIN = results.NXDOMAIN
+
     # Base domainname, removed of any protocol/schema.
     domain = re.compile(r'https?://(?P<addr>[^/]+(/?|$))').search
+    # The schema of a url, in any case.
+    schema = re.compile(r'^https?://', re.IGNORECASE).sub
 
-    def __init__(self, infile, outfile, pattern, cache=None,
+    def __init__(self, infile=None, outfile=None, pattern=None, cache=None,
                  timeout=None, sleep=None, logger=None, **kwargs):
         """
-        infile & outfile are paths
+        infile & outfile are paths; infile may be - (stdin), .gz, .xz or .bz2
+        (only needed by run; see scan_many)
         cache is path to dir
-        pattern is a string/regex
+        pattern is a string/regex (may be None with signaturefile)
         timeout & sleep are ints
-        logger is logger obj
+        logger is logger obj (None -> LOGGER)
         kwargs = http_only=False, https_only=False,
         """
         self.cache = cache
         self.http_only = kwargs.get('http_only') # Should default to false from argparse.
         self.https_only = kwargs.get('https_only') # Should default to false from argparse.
         self.infile = infile
-        self.logger = logger
+        self.logger = logger or LOGGER
         self.outfile = outfile
         self.pattern = pattern
+        # How the outfile is written (see sinks.FORMATS), and how many rows
+        # are held before being written; None -> the sink's default.
+        self.format = kwargs.get('format') or 'legacy'
+        self.buffer = kwargs.get('buffer')
         self.quietmode = kwargs.get('quietmode')
+        self.checklevels()
+        # Count of each outcome (see results.Result.outcome) written.
+        self.outcomes = collections.Counter()
+        self.closed = False
         self.logger.debug('scanner: during instantiation: pattern: {}'.format(self.pattern))
         self._regex = None
+        # A literal every match contains, looked for before running the
+        # regex; None if the pattern has none. Set by compileregex.
+        self.literal = None
         self.sleep = sleep
         self.timeout = timeout
+        # Number of requests kept in flight by runasync. None/0 -> sequential.
+        self.concurrency = kwargs.get('concurrency')
+        # Number of threads used by runthreaded. None/0 -> not threaded.
+        self.workers = kwargs.get('workers')
+        # Write rows in input order, holding at most reorder_buffer rows
+        # which are scanned (or being scanned) but not yet written.
+        self.ordered = kwargs.get('ordered')
+        self.reorder_buffer = kwargs.get('reorder_buffer') or 4 * (self.workers or 1)
+        # Read the body in chunks, matching as they arrive, and give up on a
+        # page after max_bytes (0 -> no limit). Needs the connection pool.
+        self.stream = kwargs.get('stream') or bool(kwargs.get('max_bytes'))
+        self.max_bytes = kwargs.get('max_bytes') or 0
+        self.chunk_size = kwargs.get('chunk_size') or 16384
+        # Characters kept from the previous chunks, so a match may span chunks.
+        self.overlap = kwargs.get('overlap') or 4096
+        # Match on the raw bytes of a page, decoding only the captured groups,
+        # rather than decoding every page as utf-8 first.
+        self.match_bytes = kwargs.get('match_bytes')
+        # Path to a signature pack, searched for instead of pattern; compiled
+        # to self.signatures by compileregex.
+        self.signaturefile = kwargs.get('signatures')
+        self.signatures = None
+        # Path to the checkpoint journal of the entries scanned, opened as
+        # self.journal by run. With resume, entries in it are skipped.
+        self.journalfile = kwargs.get('journal')
+        self.journal = None
+        self.resume = kwargs.get('resume')
+        # Canonicalize and deduplicate the infile before scanning. www is
+        # 'keep' (www.a.com and a.com are different) or 'strip'.
+        self.dedup = kwargs.get('dedup')
+        self.www = kwargs.get('www') or 'keep'
+        # Look up the hosts of the infile ahead of scanning, resolve_batch at a
+        # time; hosts which don't resolve are not requested. A hosts file
+        # is used before DNS.
+        self.resolver = None
+        self.resolve_batch = kwargs.get('resolve_batch') or 1000
+        if kwargs.get('resolve'):
+            hosts = resolver.Resolver.loadhosts(kwargs['hosts']) if kwargs.get('hosts') else None
+            self.resolver = resolver.Resolver(ttl=kwargs.get('dns_ttl') or 300,
+                                              negative_ttl=kwargs.get('dns_negative_ttl') or 60,
+                                              workers=kwargs.get('dns_workers') or 32,
+                                              hosts=hosts, logger=self.logger)
+        # Requests per second allowed per address, registrable domain and ASN
+        # (looked up in asn_map); a request only waits when it would go over.
+        self.limiter = None
+        rates = {'ip': kwargs.get('ip_rate'), 'domain': kwargs.get('domain_rate'),
+                 'asn': kwargs.get('asn_rate')}
+        if any(rates.values()):
+            asnmap = ratelimit.ASNMap(kwargs['asn_map']) if kwargs.get('asn_map') else None
+            self.limiter = ratelimit.RateLimiter(rates, burst=kwargs.get('rate_burst') or 1,
+                                                 resolver=self.resolver or resolver.Resolver(),
+                                                 asnmap=asnmap, logger=self.logger)
+        # Retry errors which may go away (a dropped connection, not a refused
+        # one) up to retries times, backing off. With adaptive_timeout, the
+        # timeout per host follows how fast hosts answer, up to timeout (30s
+        # without one). With a breaker, hosts which failed breaker_runs runs
+        # in a row are skipped until breaker_cooloff seconds later.
+        self.retry = resilience.RetryPolicy(retries=kwargs.get('retries') or 0)
+        self.timeouts = None
+        if kwargs.get('adaptive_timeout'):
+            self.timeouts = resilience.AdaptiveTimeouts(ceiling=self.timeout or 30)
+        self.breakerfile = kwargs.get('breaker')
+        self.breaker = None
+        self.breaker_runs = kwargs.get('breaker_runs') or 3
+        self.breaker_cooloff = kwargs.get('breaker_cooloff') or 7 * 24 * 3600
+        # Digests and matches of the pages, and what was found per entry, as of
+        # the last scan; pages with the same digest aren't matched again.
+        # With diff, only the rows of entries which changed are written:
+        # 'match' -- the miners found changed; 'page' -- or the page did.
+        self.statefile = kwargs.get('state')
+        self.state = None
+        self.diff = kwargs.get('diff')
+        self.changes = collections.Counter()
+        # Fetch the scripts a page references (<script src>), up to max_scripts
+        # of them, and match them too, if the page doesn't match. Every
+        # script is fetched and matched only once per run; see scripts.
+        self.scriptcache = scripts.ScriptCache() if kwargs.get('scripts') else None
+        self.max_scripts = kwargs.get('max_scripts') or 20
+        # Validators and matches of the pages seen, kept between runs in an
+        # SQLite database, so unchanged pages are revalidated rather than
+        # downloaded and matched again; only while what is searched for is
+        # the same (see fingerprint). Needs the connection pool.
+        self.httpcache = None
+        if kwargs.get('http_cache'):
+            self.httpcache = revalidate.ValidatorCache(kwargs['http_cache'], self.fingerprint(),
+                                                       size=kwargs.get('http_cache_size') or 100000)
+        # Report how far along a run is every progress_interval seconds: as a
+        # line on stderr with progress (unless quietmode), as JSON in
+        # status_file, and to whoever connects to the UNIX socket
+        # status_socket. Made by run, as self.progress.
+        self.progressline = kwargs.get('progress') and not self.quietmode
+        self.statusfile = kwargs.get('status_file')
+        self.statussocket = kwargs.get('status_socket')
+        self.progress_interval = kwargs.get('progress_interval') or 2.0
+        self.progress = None
+        # Time the stages of every fetch (see timing.STAGES), summarized at the
+        # end of a run, and written to timings_file (JSON Lines) if given.
+        self.timer = None
+        if kwargs.get('timings') or kwargs.get('timings_file'):
+            self.timer = timing.Recorder(kwargs.get('timings_file'))
+        # Keep-alive connections, reused per host. None -> a new httplib2.Http
+        # instance (and connection) per request. Pooled connections use the
+        # addresses looked up by the resolver (httplib2 would look them up
+        # again), so a resolver turns the pool on too, as does probe: only
+        # pooled requests can be aborted once a race is won.
+        # Pages are asked for compressed either way, but only pooled ones are
+        # decompressed as they are read, up to max_decompressed bytes;
+        # httplib2 decompresses a whole page at once, with no limit.
+        self.pool = None
+        if kwargs.get('pool_size') or self.stream or self.httpcache is not None \
+                or self.resolver or (kwargs.get('probe') or 'sequential') != 'sequential':
+            self.pool = httppool.ConnectionPool(size=kwargs.get('pool_size') or 4,
+                                                idle_timeout=kwargs.get('idle_timeout') or 30,
+                                                timeout=self.timeout, resolver=self.resolver,
+                                                logger=self.logger,
+                                                max_decompressed=kwargs.get('max_decompressed')
+                                                or 32 * 1024 * 1024)
 
         #List of protocols we will prepend to every domain/IP and make a request to.
         self.schemas = ['http', 'https']
@@ -44,6 +236,14 @@ class Scanner:
             self.schemas.remove('https')
         elif self.https_only:
             self.schemas.remove('http')
+        # How the schemas are requested: 'sequential' (https only if http
+        # fails), or at once; see race.
+        self.probe = kwargs.get('probe') or 'sequential'
+        self._probes = None
+        if self.probe != 'sequential' and len(self.schemas) > 1:
+            # Two requests per url in flight, for every worker.
+            self._probes = concurrent.futures.ThreadPoolExecutor(
+                max_workers=2 * max(self.workers or 1, self.concurrency or 1))
         if self.logger:
             self.initLog()
 
@@ -57,14 +257,60 @@ class Scanner:
             'infile: {}\n'
             'logger: {}\n'
             'outfile: {}\n'
+            'format: {}\n'
+            'buffer: {}\n'
             'pattern: {}\n'
             'regex: {}\n'
             'schemas: {}\n'
             'sleep: {}\n'
-            'timeout: {}'
+            'timeout: {}\n'
+            'concurrency: {}\n'
+            'workers: {}\n'
+            'ordered: {}\n'
+            'reorder_buffer: {}\n'
+            'stream: {}\n'
+            'max_bytes: {}\n'
+            'match_bytes: {}\n'
+            'signaturefile: {}\n'
+            'journalfile: {}\n'
+            'resume: {}\n'
+            'dedup: {}\n'
+            'www: {}\n'
+            'probe: {}\n'
+            'resolver: {}\n'
+            'limiter: {}\n'
+            'statefile: {}\n'
+            'diff: {}\n'
+            'retry: {}\n'
+            'timeouts: {}\n'
+            'breakerfile: {}\n'
+            'httpcache: {}\n'
+            'scriptcache: {}\n'
+            'max_scripts: {}\n'
+            'progressline: {}\n'
+            'statusfile: {}\n'
+            'statussocket: {}\n'
+            'timer: {}\n'
+            'pool: {}'
             .format(self.cache, self.http_only, self.https_only, self.infile,
-                    self.logger.name, self.outfile, self.pattern, self.regex,
-                    self.schemas, self.sleep, self.timeout))
+                    self.logger.name, self.outfile, self.format, self.buffer,
+                    self.pattern, self.regex,
+                    self.schemas, self.sleep, self.timeout, self.concurrency,
+                    self.workers, self.ordered, self.reorder_buffer, self.stream,
+                    self.max_bytes, self.match_bytes, self.signaturefile,
+                    self.journalfile, self.resume, self.dedup, self.www, self.probe,
+                    self.resolver, self.limiter, self.statefile, self.diff,
+                    self.retry, self.timeouts, self.breakerfile, self.httpcache, self.scriptcache, self.max_scripts,
+                    self.progressline, self.statusfile, self.statussocket, self.timer,
+                    self.pool))
+
+    def checklevels(self):
+        """Note which log levels are enabled, so the hot path doesn't build
+        messages which would be dropped. Called again by run, in case the
+        level was changed since.
+        """
+        self.debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        self.info_enabled = self.logger.isEnabledFor(logging.INFO)
 
     @property
     def regex(self):
@@ -76,16 +322,32 @@ class Scanner:
 
     # Probably should've just combined this with the regex.setter.
     def compileregex(self):
-        self.regex = re.compile(r'{}'.format(self.pattern))
+        if self.pattern is None:
+            if not self.signaturefile:
+                raise ValueError('a pattern or a signaturefile is needed')
+            self.signatures = signatures.SignaturePack.load(self.signaturefile, self.match_bytes)
+            self.logger.debug('compiled signatures: {}'.format(self.signatures))
+            return
+        pattern = r'{}'.format(self.pattern)
+        if self.match_bytes: # A bytes pattern only matches bytes.
+            pattern = pattern.encode('utf-8')
+        self.regex = re.compile(pattern)
         self.logger.debug('compiled regex: {}'.format(self.regex))
         self.regex = self.regex.search
+        # Most pages don't contain it, and a substring search is much faster
+        # than the regex, which starts with .* by default.
+        self.literal = prefilter.literal(pattern)
+        self.logger.debug('prefilter literal: {!r}'.format(self.literal))
+        if self.signaturefile:
+            self.signatures = signatures.SignaturePack.load(self.signaturefile, self.match_bytes)
+            self.logger.debug('compiled signatures: {}'.format(self.signatures))
 
     def qualifyurl(self, domainname):
         """Return a generator, which is an iterable of *thedomainname* prefixed with
         http:// and https://.
         """
-        self.logger.debug('qualifying url.')
-        self.logger.debug('qualifyurl: schemas used: {}'.format(self.schemas))
+        if self.debug_enabled:
+            self.logger.debug('qualifyurl: schemas used: %s', self.schemas)
         return ('://'.join((schema,domainname)) for schema in self.schemas)
 
     def splitdomain(self, url): # Maybe this is better as spliturl?
@@ -100,12 +362,38 @@ class Scanner:
         try:
             domain = self.domain(url).group('addr')
             schema = url.split(domain)[0].rstrip('://')
-            self.logger.debug('splitdomain: schema: {}, domain: {}'.format(schema, domain))
+            if self.debug_enabled:
+                self.logger.debug('splitdomain: schema: %s, domain: %s', schema, domain)
             return [schema, domain]
         except AttributeError:
-            self.logger.debug('Error parsing domain from url in splitdomain. Returning url: {}.'.format(url))
+            if self.debug_enabled:
+                self.logger.debug('Error parsing domain from url in splitdomain. Returning url: %s.', url)
             return [url]
 
+    def canonicalize(self, entry):
+        """Return *entry*, a line of the infile, as the domain which would be
+        scanned: without its schema or trailing slash, with its host in
+        lower case, and without a leading www. if self.www is 'strip'.
+
+        Example: HTTPS://www.Badpackets.net/ -> www.badpackets.net
+        """
+        entry = self.schema(lambda schema: schema.group().lower(), entry.strip())
+        domain = self.splitdomain(entry)[-1].rstrip('/')
+        host, sep, path = domain.partition('/')
+        host = host.lower()
+        if self.www == 'strip' and host.startswith('www.'):
+            host = host[4:]
+        return host + sep + path
+
+    def hostof(self, entry):
+        """Return the host name of *entry*, a line of the infile, without
+        any port. Example: http://badpackets.net:8080/ -> badpackets.net
+        """
+        host = self.splitdomain(entry)[-1].split('/', 1)[0]
+        if host.startswith('['): # IPv6 address.
+            return host[1:].split(']', 1)[0]
+        return host.rsplit(':', 1)[0] if host.count(':') == 1 else host
+
     def parsecontent(self, content):
         """Return a string if the pattern: CoinHive.Anonymous('HASH');
         is found embedded in *content*, the HTML page source.
@@ -115,24 +403,354 @@ class Scanner:
         Returns None if either the pattern: CoinHive.Anonymous('')
         is not found, or the string inside consists of non-alphanumeric
         characters.
+
+        With match_bytes, *content* is the undecoded page source (bytes),
+        and only the match is decoded.
+
+        With a signature pack, returns a list of (signature name, key)
+        tuples instead, one per signature found.
         """
-        # Leads to an error when there is no content returned, but a connection
-        # is able to be made, e.g., a decoding error.
-        #self.logger.debug('parsecontent: content snippet:\n{}'.format(content[:100]))
+        if self.signatures is not None: # Every signature, in one pass.
+            return self.signatures.search(content) if content else []
+        # No content when none is returned, but a connection is able to be
+        # made, e.g., a decoding error. Not matching is the usual outcome, so
+        # it's not logged; write counts it.
+        if not content:
+            return None
+        found = self.search(content)
+        if found is None:
+            return None
+        match = self.joingroups(found)
+        if self.debug_enabled:
+            self.logger.debug('parsecontent: successfully parsed a match: %s', match)
+        return match
+
+    @staticmethod
+    def joingroups(match):
+        """Return the groups of a regex *match* joined as one string,
+        skipping groups which did not participate.
+
+        Groups of a bytes match are decoded as utf-8, or latin-1 if they
+        are not valid utf-8.
+        """
+        return signatures.joingroups(match.groups())
+
+    def streammatch(self, chunks):
+        """Return the same as parsecontent, for a page given as an iterable of
+        string *chunks*, stopping as soon as the pattern is found.
+
+        The regex is run over a sliding window of the last self.overlap
+        characters plus the new chunk. A match which runs up to the end of
+        the window is only taken once more of the page (or the end of it)
+        has arrived, as it may continue in the next chunk.
+
+        With match_bytes, *chunks* are bytes.
+        """
+        if self.signatures is not None:
+            return self.streamsignatures(chunks)
+        window = b'' if self.match_bytes else ''
+        for chunk in chunks:
+            window += chunk
+            match = self.search(window)
+            if match and match.end() < len(window):
+                return self.joingroups(match)
+            if not match: # Else keep the whole window, until the match is complete.
+                window = window[-self.overlap:]
+        match = self.search(window) # End of the page.
+        if match:
+            return self.joingroups(match)
+
+    def search(self, content):
+        """Return the regex's match in *content*, or None, without running
+        it if the literal every match contains isn't there.
+        """
+        if self.literal is not None and self.literal not in content:
+            return None
+        return self.regex(content)
+
+    def streamsignatures(self, chunks):
+        """Return the same as streammatch, for a signature pack. Stops early
+        only if every signature has been found.
+        """
+        hits = collections.OrderedDict()
+        window = b'' if self.match_bytes else ''
+        for chunk in chunks:
+            window += chunk
+            hits.update(self.signatures.search(window, final=False, skip=hits))
+            if len(hits) == len(self.signatures):
+                return list(hits.items())
+            window = window[-self.overlap:]
+        hits.update(self.signatures.search(window, skip=hits)) # End of the page.
+        return list(hits.items())
+
+    def readchunks(self, response):
+        """Yield the body of *response* decoded as utf-8, self.chunk_size
+        bytes at a time, until the end of the body or self.max_bytes.
+        With match_bytes, the chunks are yielded undecoded.
+        """
+        decode = None
+        if not self.match_bytes:
+            decode = codecs.getincrementaldecoder('utf-8')(errors='replace').decode
+        total = 0
+        while not self.max_bytes or total < self.max_bytes:
+            size = self.chunk_size
+            if self.max_bytes:
+                size = min(size, self.max_bytes - total)
+            chunk = response.read(size)
+            if not chunk:
+                break
+            total += len(chunk)
+            yield decode(chunk) if decode else chunk
+        if decode: # Whatever is left of a split multibyte character.
+            yield decode(b'', final=True)
+
+    def fetchmatch(self, url, timings=None, headers=None, received=None):
+        """Return a Fetched tuple for *url*, reading the page a chunk at a
+        time; see streammatch.
+
+        The connection is closed as soon as the pattern is found, or
+        self.max_bytes have been read, rather than reading the rest of the
+        page. It's only returned to the pool if the page was read in full.
+
+        The stages are timed into *timings*, if given; the time between
+        reads is match. *headers* and *received* are as for request.
+
+        With a script cache, the scripts referenced by the part of the page
+        read are matched too; see withscripts.
+        """
+        start_time = time.monotonic()
+        try:
+            key, conn, response = self.attempt(url, lambda timeout: self.pool.open(
+                url, headers, timings=timings, timeout=timeout))
+        except Exception as err:
+            self.requestfailed(url, err)
+            return Fetched(-1, None, 0, time.monotonic() - start_time, None)
+        statuscode = response.status
+        if self.info_enabled:
+            self.logger.info('target url: %s, received http status code: %s', url, statuscode)
+        if received is not None:
+            received.update((name.lower(), value) for name, value in response.getheaders())
+        counter = ByteCounter(response, digest=self.state is not None)
         try:
-            # Changed, since I got it working. Could pose a problem. Had to
-            # accomodate coinhivehash, and I'm too tired too inspect further.
-            match = ''.join(self.regex(content).groups())
-            self.logger.debug('parsecontent: regex returned: {}, of type: {}'.format(match, type(match)))
-            if match:
-                self.logger.debug('parsecontent: successfully parserd a match: {}'.format(match))
+            if statuscode != 200:
+                conn.close()
+                return Fetched(statuscode, None, 0, time.monotonic() - start_time, None)
+            matching = time.monotonic()
+            chunks = self.readchunks(counter)
+            if self.scriptcache is not None:
+                finder = scripts.SrcFinder(url)
+                chunks = finder.tee(chunks)
+            match = self.streammatch(chunks)
+            timing.addtime(timings, 'download', counter.seconds)
+            timing.addtime(timings, 'match', time.monotonic() - matching - counter.seconds)
+        except Exception as err:
+            conn.close()
+            self.requestfailed(url, err)
+            return Fetched(-1, None, counter.bytes, time.monotonic() - start_time, None)
+        if self.debug_enabled and not match and self.max_bytes and not response.isclosed():
+            self.logger.debug('fetchmatch: no match in the first %s bytes of: %s',
+                              self.max_bytes, url)
+        self.pool.release(key, conn, response)
+        if self.scriptcache is not None:
+            match = self.withscripts(url, match, finder.srcs, timings)
+        if self.state is not None:
+            self.state.putpage(url, counter.digest(), match)
+        return Fetched(statuscode, match, counter.bytes, time.monotonic() - start_time,
+                       counter.digest())
+
+    def fetch(self, url):
+        """Return a Fetched tuple of status code, the match (None if not
+        found), bytes read and seconds taken for *url*, streamed or not.
+        Waits for the rate limiter, if any. With a timer, the stages of the
+        fetch are recorded; with a circuit breaker, whether it failed.
+        """
+        if self.limiter:
+            self.limiter.acquire(self.hostof(url))
+        timings = {} if self.timer else None
+        headers = received = None
+        if self.httpcache is not None:
+            headers, received = self.httpcache.headers(url), {}
+        fetched = self.fetchpage(url, timings, headers, received)
+        if self.pool is not None and self.pool.aborted(): # Lost a race; ignored.
+            return fetched
+        if self.httpcache is not None:
+            cached = self.httpcache.hit(url) if fetched.status == 304 else None
+            if cached is not None: # Not modified; the same match as last time.
+                last = self.state.page(url) if self.state is not None else None
+                fetched = fetched._replace(status=200, match=cached[0],
+                                           digest=last[0] if last else None)
+            else:
+                if fetched.status == 304: # Evicted since; ask again, unconditionally.
+                    fetched = self.fetchpage(url, timings, None, received)
+                if fetched.status == 200:
+                    self.httpcache.store(url, received, fetched.match, fetched.bytes)
+        if self.breaker is not None:
+            self.breaker.record(self.hostof(url), fetched.status != results.FAILED)
+        if self.timer:
+            timings['total'] = fetched.seconds
+            self.timer.record(url, fetched.status, fetched.bytes, timings)
+        return fetched
+
+    def fetchpage(self, url, timings=None, headers=None, received=None):
+        """Return a Fetched tuple for *url*, streamed or not; see fetch.
+
+        With a state store, a page with the same digest as last time isn't
+        matched again; what was matched on it then (with its scripts) is
+        returned.
+        """
+        if self.stream:
+            return self.fetchmatch(url, timings, headers, received)
+        start_time = time.monotonic()
+        statuscode, content = self.request(url, timings, headers, received)
+        match = pagedigest = None
+        if statuscode == 200:
+            matching = time.monotonic()
+            unchanged = False
+            if self.state is not None:
+                pagedigest = state.digest(content)
+                unchanged, match = self.state.unchanged(url, pagedigest)
+            if not unchanged:
+                match = self.parsecontent(self.decode(content, url))
+            timing.addtime(timings, 'match', time.monotonic() - matching)
+            if not unchanged:
+                if self.scriptcache is not None:
+                    match = self.withscripts(url, match, scripts.srcs(content, url), timings)
+                if self.state is not None:
+                    self.state.putpage(url, pagedigest, match)
+        return Fetched(statuscode, match, len(content), time.monotonic() - start_time,
+                       pagedigest)
+
+    def withscripts(self, url, match, srcs, timings=None):
+        """Return *match*, what was matched on the page at *url*, with what
+        was matched on the first self.max_scripts of *srcs*, the urls of the
+        scripts it references, through the script cache.
+
+        The pattern is only looked for in the scripts if it wasn't found in
+        the page, and only until it is found in one. With a signature pack,
+        the signatures found in the page and its scripts are combined. The
+        time taken is added to the scripts stage of *timings*.
+        """
+        pack = isinstance(match, list)
+        if not srcs or (match and not pack):
             return match
-        # Catching TypeError, in case content is None, because getsource timed out.
-        except (AttributeError, TypeError):
-            self.logger.exception('parsecontent: the regex did not match.')
+        start_time = time.monotonic()
+        hits = collections.OrderedDict(match if pack else ())
+        for src in srcs[:self.max_scripts]:
+            found = self.scriptcache.match(src, self.fetchscript, self.matchscript)
+            if not found:
+                continue
+            if self.info_enabled:
+                self.logger.info('scripts: %s found in %s, referenced by %s', found, src, url)
+            if not pack:
+                match = found
+                break
+            for name, key in found:
+                hits.setdefault(name, key)
+            if len(hits) == len(self.signatures):
+                break
+        timing.addtime(timings, 'scripts', time.monotonic() - start_time)
+        return list(hits.items()) if pack else match
+
+    def fetchscript(self, url):
+        """Return a tuple of status code and content of the script at *url*,
+        waiting for the rate limiter, if any.
+        """
+        if self.limiter:
+            self.limiter.acquire(self.hostof(url))
+        if self.pool is None:
+            return self.request(url)
+        # Other pages may be waiting for it; not aborted with a race's loser.
+        with self.pool.aborting(None):
+            return self.request(url)
+
+    def matchscript(self, url, content):
+        """Return what parsecontent matches on *content*, the script at *url*."""
+        return self.parsecontent(self.decode(content, url))
+
+    def request(self, url, timings=None, headers=None, received=None):
+        """Return a tuple of status code (-1 if no request could be made)
+        and the body, as bytes, from a host at *url*; see getsource. Over a
+        pooled connection, the stages are timed into *timings*, if given.
+
+        *headers* are sent with the request, and the response headers (with
+        names in lower case) put in *received*, a dict, if given.
+        """
+        def get(timeout):
+            if self.pool:
+                return self.pool.request(url, headers, timings, received, timeout)
+            h = httplib2.Http(cache=self.cache,
+                              timeout=timeout,
+                              disable_ssl_certificate_validation=True)
+            response, content = h.request(url, headers=headers)
+            if received is not None:
+                received.update(response)
+            return response.status, content
+
+        try:
+            statuscode, content = self.attempt(url, get)
+            if self.info_enabled:
+                self.logger.info('target url: %s, received http status code: %s', url, statuscode)
+            return statuscode, content
+        #(ConnectionRefusedError, TimeoutError): #noqa Socket still in use?.
+        except Exception as err:
+            self.requestfailed(url, err)
+            return -1, b''
+
+    def attempt(self, url, call):
+        """Return call(timeout), a request to *url*, trying again after a
+        retryable error (see resilience.retryable) up to self.retry.retries
+        times; the last error is raised.
+
+        The timeout is self.timeout, or with adaptive timeouts, that of the
+        host, which is told how long the request took, or that it timed out.
+        """
+        host = self.hostof(url)
+        attempt = 0
+        while True:
+            timeout = self.timeouts.timeout(host) if self.timeouts else self.timeout
+            start_time = time.monotonic()
+            try:
+                result = call(timeout)
+            except Exception as err:
+                if self.timeouts and resilience.timedout(err):
+                    self.timeouts.backoff(host)
+                if attempt >= self.retry.retries or not resilience.retryable(err):
+                    raise
+                delay = self.retry.wait(attempt)
+                if self.debug_enabled:
+                    self.logger.debug('attempt: retried %s after %r, waited %.2fs',
+                                      url, err, delay)
+                attempt += 1
+                continue
+            if self.timeouts:
+                self.timeouts.observe(host, time.monotonic() - start_time)
+            return result
+
+    def requestfailed(self, url, err):
+        """Log a request to *url* which raised *err*. Dead hosts are common,
+        so the traceback is only logged at debug level. A request aborted
+        (having lost a race) didn't fail, and is only logged at debug level.
+        """
+        if isinstance(err, httppool.Aborted):
+            if self.debug_enabled:
+                self.logger.debug('request to %s aborted', url)
+            return
+        self.logger.warning('request to %s failed: %r', url, err, exc_info=self.debug_enabled)
+        if self.progress is not None:
+            self.progress.error(type(err).__name__)
+
+    def decode(self, content, url):
+        """Return *content*, the body from *url*, as a string for
+        parsecontent; None if it is empty or can't be decoded. With
+        match_bytes, it's returned undecoded.
+        """
+        try:
+            if self.match_bytes: # Matched undecoded.
+                return content or None
+            return content.decode('utf-8') or None
+        except UnicodeDecodeError as decode_err:
+            self.logger.warning('Cannot decode content at url: %s: %s', url, decode_err)
 
-    # Should I be creating a new Http instance for every URI, and for
-    # every schema?
     def getsource(self, url):
         """Return the HTML source code as string from a host at *url*.
 
@@ -151,71 +769,584 @@ class Scanner:
 
         Now returns a tuple of status code (if a request could be made),
         content (if any).
+
+        If the Scanner has a connection pool, the request is made over a
+        pooled keep-alive connection rather than a new httplib2.Http.
         """
-        try:
-            h = httplib2.Http(cache=self.cache,
-                              timeout=self.timeout,
-                              disable_ssl_certificate_validation=True)
-            response, content = h.request(url)
-            statuscode = response.status
-            try:
-                content = content.decode('utf-8') if content.decode('utf-8') else None
-            except UnicodeDecodeError as decode_err:
-                content = None
-                self.logger.exception('Cannot decode content at url: {}'
-                                 .format(url))
-            self.logger.info('target url: {}, received http status code: {}'
-                             .format(url, response.status))
-            if statuscode is 200:
-                return statuscode, content
-            elif statuscode is not 200:
-                return statuscode, ''
-        #(ConnectionRefusedError, TimeoutError): #noqa Socket still in use?.
-        except Exception:
-            # Automatically prints the traceback on a newline.
-            self.logger.exception('Exception raised in getsource:')
-            return -1, ''
+        statuscode, content = self.request(url)
+        if statuscode == 200:
+            return statuscode, self.decode(content, url)
+        return statuscode, ''
 
     def scan(self, url):
-        self.logger.debug('current url: {}'.format(url))
+        """Return a tuple of the qualified url requested and its Fetched
+        tuple, trying each schema in turn until one returns a 200.
+        """
         thedomain = self.splitdomain(url)[-1]
-        self.logger.debug('current domain: {}'.format(thedomain))
+        if self.debug_enabled:
+            self.logger.debug('current url: %s, domain: %s', url, thedomain)
         for n,qualifiedurl in enumerate(self.qualifyurl(thedomain)):
-            self.logger.debug('qualified url (#{}): {}'.format(n, qualifiedurl))
-            decodedsource = self.getsource(qualifiedurl)
-            statuscode, decodedsource = decodedsource[0], decodedsource[1]
-            #self.logger.info('decoded source: {}'.format(decodedsource))
-            if statuscode is 200: # We were able to make the request.
-                pattern_found = self.parsecontent(decodedsource)
-                pattern_found = pattern_found if pattern_found else 0 # None if not found (regex AttributeError).
+            if self.debug_enabled:
+                self.logger.debug('qualified url (#%s): %s', n, qualifiedurl)
+            fetched = self.fetch(qualifiedurl)
+            if fetched.status == 200: # We were able to make the request.
                 # Have to return for https & http if not exclusively one or the other.
-                return qualifiedurl, pattern_found
-            else: # returned either statuscode or -1
-                pattern_found = -1 # Could return statuscode.
-        return qualifiedurl, pattern_found
+                return qualifiedurl, fetched
+        return qualifiedurl, fetched
+
+    def race(self, url):
+        """Return a list of (qualifiedurl, Fetched) tuples, as returned by
+        scan, requesting every schema at once rather than one after the
+        other. What is returned depends on self.probe:
+
+        first-wins   -- the first schema to return a 200
+        prefer-https -- https if it returns a 200, else http
+        both         -- every schema, whatever it returned
+
+        Requests still pending once a winner is known are cancelled, or if
+        already started, aborted (see httppool.Abort), so a schema which
+        hangs (e.g. a filtered port 443) doesn't keep a probe thread from
+        the next race.
+        """
+        thedomain = self.splitdomain(url)[-1]
+        qualifiedurls = list(self.qualifyurl(thedomain))
+        aborts = {qualifiedurl: httppool.Abort() for qualifiedurl in qualifiedurls}
+        futures = {self._probes.submit(self.abortable, qualifiedurl, aborts[qualifiedurl]):
+                   qualifiedurl for qualifiedurl in qualifiedurls}
+        outcomes = {}
+        pending = set(futures)
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    outcomes[futures[future]] = future.result()
+                    if self.debug_enabled:
+                        self.logger.debug('race: %s returned: %s', futures[future], future.result())
+                winner = self.winner(qualifiedurls, outcomes)
+                if winner:
+                    return [(winner, outcomes[winner])]
+        finally:
+            for future in pending:
+                if not future.cancel():
+                    aborts[futures[future]].abort()
+        if self.probe == 'both':
+            return [(qualifiedurl, outcomes[qualifiedurl]) for qualifiedurl in qualifiedurls]
+        # Neither won; as scan, the last one.
+        return [(qualifiedurls[-1], outcomes[qualifiedurls[-1]])]
+
+    def abortable(self, url, abort):
+        """Return fetch(*url*), aborted if *abort* is."""
+        with self.pool.aborting(abort):
+            return self.fetch(url)
+
+    def winner(self, qualifiedurls, outcomes):
+        """Return the url in *outcomes* (url -> Fetched) which won a race, or
+        None if there is none yet.
+        """
+        if self.probe == 'first-wins':
+            for qualifiedurl, fetched in outcomes.items():
+                if fetched.status == 200:
+                    return qualifiedurl
+        elif self.probe == 'prefer-https':
+            # In order of preference; a url wins if those before it failed.
+            for qualifiedurl in sorted(qualifiedurls, key=lambda url: not url.startswith('https')):
+                if qualifiedurl not in outcomes:
+                    return None
+                if outcomes[qualifiedurl].status == 200:
+                    return qualifiedurl
+
+    def results(self, url):
+        """Scan *url* and return a list of Results, usually one; see
+        scanresults. Counted as in flight meanwhile.
+        """
+        if self.progress is None:
+            return self.scanresults(url)
+        self.progress.started()
+        try:
+            return self.scanresults(url)
+        finally:
+            self.progress.finished()
+
+    def scanresults(self, url):
+        """Scan *url* and return a list of Results, usually one.
+
+        With a signature pack there is a Result for each signature found.
+        With self.probe 'both' there are Results for each schema. Hosts
+        which the resolver says don't exist, or the circuit breaker says to
+        skip, are not requested.
+        """
+        if self.resolver and self.resolver.lookup(self.hostof(url)) is None:
+            if self.info_enabled:
+                self.logger.info('result: %s does not resolve.', url)
+            return [results.Result(url, self.splitdomain(url)[-1], None, results.NXDOMAIN,
+                                   None, None, 0.0, 0, None)]
+        if self.breaker is not None and self.breaker.isopen(self.hostof(url)):
+            if self.info_enabled:
+                self.logger.info('result: %s failed the last runs; skipped.', url)
+            return [results.Result(url, self.splitdomain(url)[-1], None, results.SKIPPED,
+                                   None, None, 0.0, 0, None)]
+        if self._probes:
+            scans = self.race(url)
+        else:
+            scans = [self.scan(url)]
+        rows = []
+        for qualifiedurl, fetched in scans:
+            schema, domain = self.splitdomain(qualifiedurl)
+            row = results.Result(url, domain, schema, fetched.status, None, None,
+                                 fetched.seconds, fetched.bytes, fetched.digest)
+            if isinstance(fetched.match, list): # Signature pack; a row per signature.
+                rows.extend(row._replace(hash=key, signature=name) for name, key in fetched.match)
+                if fetched.match:
+                    continue
+            elif fetched.match and fetched.status == 200:
+                row = row._replace(hash=fetched.match)
+            rows.append(row)
+        return rows
+
+    def write(self, sink, url, rows):
+        """Write the Results of *url*, *rows*, to *sink*, and to stdout those
+        which were found. Only ever called from one thread at a time.
+
+        With diff, *rows* are only written if they changed since the last
+        scan; see state.StateStore.update.
+        """
+        for row in rows:
+            self.outcomes[row.outcome] += 1
+        if self.progress is not None:
+            self.progress.written(rows)
+        rows = self.diffed(url, rows)
+        for row in rows:
+            if row.found and not self.quietmode:
+                sys.stdout.write(row.legacy() + '\n')
+            #log to stdout & logfile if logger
+            if self.info_enabled:
+                self.logger.info('result: %s', row.legacy())
+            sink.write(row)
+        if self.journal is not None:
+            self.journal.add(url)
+            if self.journal.pending >= self.journal.batch:
+                sink.flush() # Rows are on disk before they are journaled.
+                self.journal.commit()
+
+    def diffed(self, url, rows):
+        """Return *rows*, the Results of *url*, recorded in the state store,
+        if any; with diff, only if they changed since the last scan (see
+        state.StateStore.update), else none.
+        """
+        if self.state is None:
+            return rows
+        change = self.state.update(url, rows)
+        self.changes[change] += 1
+        if change and self.info_enabled:
+            self.logger.info('diff: %s: %s', url, change)
+        if self.diff == 'match' and change not in state.MATCH_CHANGES:
+            return []
+        if self.diff and change is None:
+            return []
+        return rows
+
+    def openstores(self):
+        """Open the circuit breaker and state store, if asked for and not
+        open already; they're closed by close.
+        """
+        if self.breakerfile and self.breaker is None:
+            self.breaker = resilience.CircuitBreaker(self.breakerfile, runs=self.breaker_runs,
+                                                     cooloff=self.breaker_cooloff)
+        if self.statefile and self.state is None:
+            self.state = state.StateStore(self.statefile, self.fingerprint())
+
+    def fingerprint(self):
+        """Return a string standing for what is searched for, and how; the
+        matches kept by the state store and http cache are only good for the
+        same one.
+        """
+        packdigest = None
+        if self.signaturefile:
+            with open(self.signaturefile, 'rb') as f:
+                packdigest = state.digest(f.read())
+        return repr((self.pattern, packdigest, bool(self.match_bytes), self.max_bytes,
+                     self.scriptcache is not None and self.max_scripts))
 
     def run(self):
-        # Now this can be threaded, but the workers will have to acquire locks on outfile.
+        """Scan the infile into the outfile: scan_many, with every entry's
+        Results written (see write) as they come, and the journal, state
+        store, circuit breaker and progress kept, if asked for.
+        """
         self.compileregex() #compile & set the regex.
-        with open(self.infile) as infile, open(self.outfile, 'a') as outfile:
-            self.logger.debug('infile:{}, outfile:{}'.format(self.infile, self.outfile))
-            for url in (url.strip() for url in list(infile)):
-                # output is a tuple of domain, pattern_found
-                # pattern_found is 0 if successful request was made, or -1
-                #self.splitdomain()
-                qualifiedurl, pattern_found = self.scan(url)
-                schema, domain = self.splitdomain(qualifiedurl)
-                if pattern_found is not 0 and pattern_found is not -1:
-                    self.logger.debug('run: pattern_found is not 0 and not -1.')
-                    self.logger.debug('run: pattern_found is: {}'.format(pattern_found))
-                    output = '{},{},{}'.format(domain,pattern_found,schema)
-                    if not self.quietmode:
-                        sys.stdout.write(output + '\n')
-                else:
-                    self.logger.debug('run: pattern_found is 0 or -1: {}'.format(pattern_found))
-                    output = '{},{}'.format(domain,pattern_found)
-                #log to stdout & logfile if logger
-                self.logger.info('result: {}'.format(output))
-                outfile.write(output + '\n')
+        self.checklevels()
+        self.openstores()
+        if self.journalfile:
+            self.journal = journal.Journal(self.journalfile, resume=self.resume)
+        if self.progressline or self.statusfile or self.statussocket:
+            self.progress = progress.Progress(interval=self.progress_interval,
+                                              stream=sys.stderr if self.progressline else None,
+                                              statusfile=self.statusfile,
+                                              socketpath=self.statussocket)
+            self.progress.start()
+            if not self.dedup: # Else the deduplicator knows.
+                threading.Thread(target=self.counttotal, name='progress-count',
+                                 daemon=True).start()
+        try:
+            with inputs.openinput(self.infile) as infile, \
+                 sinks.opensink(self.outfile, self.format, self.buffer) as sink:
+                self.logger.debug('infile:{}, outfile:{}'.format(self.infile, self.outfile))
+                # Read as scanned, never all at once.
+                for url, rows in self.scanned(self.entries(infile)):
+                    self.write(sink, url, rows)
+        finally: # Even if killed, so the journal matches the outfile.
+            self.close()
+
+    def scan_many(self, urls):
+        """Yield the Results of every entry of *urls*, an iterable of domains
+        or urls, as they are scanned; see results.
+
+        Nothing is written, and no file is opened but those the Scanner was
+        given: the http cache, and the circuit breaker and state store, as
+        run keeps them (with diff, only the Results of entries which changed
+        are yielded). The journal and progress are only kept by run, and
+        raise a ValueError here. With workers or concurrency, entries are
+        scanned at once, but only read from *urls* as fast as their Results
+        are taken: at most reorder_buffer (workers) or concurrency entries
+        ahead. Results come as they are scanned, or with workers and
+        ordered, in the order of *urls*. Close the Scanner when done:
+
+            with Scanner(pattern='coinhive.min.js', workers=16) as scan:
+                for result in scan.scan_many(['example.com', 'example.org']):
+                    print(result.domain, result.outcome, result.hash)
+        """
+        if self.journalfile or self.progressline or self.statusfile or self.statussocket:
+            raise ValueError('journal and progress are only kept by run')
+        if self.regex is None and self.signatures is None:
+            self.compileregex()
+        self.checklevels()
+        self.openstores()
+        for url, rows in self.scanned(self.entries(urls)):
+            for row in rows:
+                self.outcomes[row.outcome] += 1
+            yield from self.diffed(url, rows)
+
+    def entries(self, urls):
+        """Return the entries of *urls* to scan, read as they are scanned:
+        stripped, deduplicated with dedup (else without blank ones), without
+        those in the journal with resume, and looked up ahead of being
+        scanned with a resolver.
+        """
+        urls = (url.strip() for url in urls)
+        if self.dedup:
+            urls = self.deduplicate(urls)
+        else:
+            urls = (url for url in urls if url)
+        if self.resume and self.journal is not None:
+            urls = self.unjournaled(urls)
+        if self.resolver:
+            urls = self.resolver.prefetchall(urls, self.hostof, self.resolve_batch)
+        return urls
+
+    def scanned(self, urls):
+        """Yield a tuple of (entry, Results) for every entry of *urls*: with
+        self.workers threads, self.concurrency requests in flight, or one
+        at a time.
+        """
+        if self.workers:
+            yield from self.runthreaded(urls)
+        elif self.concurrency:
+            yield from self.runasync(urls)
+        else:
+            for url in urls:
+                yield url, self.results(url)
                 if self.sleep:
                     time.sleep(self.sleep)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def deduplicate(self, urls):
+        """Yield the canonical entries of *urls* (see canonicalize), each
+        only once. All of *urls* is read, and the duplicates reported,
+        before the first entry is yielded; the entries seen are kept on
+        disk, in the cache directory, not in memory.
+        """
+        deduplicator = dedup.Deduplicator(self.canonicalize, dir=self.cache)
+        try:
+            deduplicator.write(urls)
+            if self.progress is not None:
+                self.progress.settotal(deduplicator.unique)
+            report = ('dedup: {} entries, {} unique, {} exact duplicates, '
+                      '{} near duplicates, {} blank'
+                      .format(deduplicator.total, deduplicator.unique, deduplicator.exact,
+                              deduplicator.near, deduplicator.blank))
+            self.logger.info(report)
+            if not self.quietmode:
+                sys.stderr.write(report + '\n')
+            yield from deduplicator.read()
+        finally:
+            deduplicator.cleanup()
+
+    def unjournaled(self, urls):
+        """Yield the entries of *urls* which are not in the journal."""
+        skipped = 0
+        for url in urls:
+            if url in self.journal:
+                skipped += 1
+                if self.progress is not None:
+                    self.progress.skip()
+                continue
+            yield url
+        self.logger.info('resume: skipped {} entries already scanned.'.format(skipped))
+
+    def counttotal(self):
+        """Count the entries of the infile, for the progress; read again, as
+        it's scanned without being read ahead.
+        """
+        try:
+            self.progress.settotal(inputs.count(self.infile))
+        except Exception as err: # Only the remaining and eta are missed.
+            self.logger.warning('progress: could not count the entries of {}: {!r}'
+                                .format(self.infile, err))
+
+    def close(self):
+        """Close any pooled connections, logging how often they were reused,
+        and the journal, which is committed. Only the first call does
+        anything (run closes, and so may a with statement after it).
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.progress is not None:
+            self.progress.stop()
+            self.logger.info('progress: {}'.format(self.progress.line(self.progress.status())))
+            self.progress = None
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.outcomes:
+            self.logger.info('outcomes: {}'.format(', '.join(
+                '{} {}'.format(count, outcome) for outcome, count in sorted(self.outcomes.items()))))
+        if self.state is not None:
+            self.logger.info('state: {}, {} unchanged; {} pages not matched again'.format(
+                ', '.join('{} {}'.format(count, change) for change, count
+                          in sorted(self.changes.items(), key=lambda item: str(item[0]))
+                          if change),
+                self.changes[None], self.state.skipped))
+            self.state.close()
+            self.state = None
+        if self._probes:
+            # Don't wait for the requests which lost a race.
+            self._probes.shutdown(wait=False)
+            self._probes = None
+        if self.resolver:
+            self.logger.info('resolver: {} resolved, {} nxdomain, {} failed'
+                             .format(self.resolver.resolved, self.resolver.nxdomain,
+                                     self.resolver.failed))
+            self.resolver = None
+        if self.retry.retried:
+            self.logger.info('retries: {}, {:.1f}s waited'.format(self.retry.retried,
+                                                                   self.retry.waited))
+        if self.breaker is not None:
+            self.breaker.close()
+            self.logger.info('circuit breaker: {} hosts skipped, {} skipped from now on'
+                             .format(self.breaker.skipped, self.breaker.opened))
+            self.breaker = None
+        if self.httpcache is not None:
+            self.logger.info('http cache: {} not modified ({} bytes saved), {} downloaded, '
+                             '{} evicted'.format(self.httpcache.hits, self.httpcache.saved,
+                                                 self.httpcache.misses, self.httpcache.evicted))
+            self.httpcache.close()
+            self.httpcache = None
+        if self.scriptcache is not None:
+            self.logger.info('scripts: {} fetched ({} bytes, {} the same as another), {} not '
+                             'fetched again, {} failed'.format(
+                                 self.scriptcache.fetched, self.scriptcache.bytes,
+                                 self.scriptcache.copies, self.scriptcache.hits,
+                                 self.scriptcache.failed))
+        if self.timer:
+            for line in ['timings (approximate percentiles):'] + self.timer.summary():
+                self.logger.info(line)
+                if not self.quietmode:
+                    sys.stderr.write(line + '\n')
+            self.timer.close()
+            self.timer = None
+        if self.limiter:
+            self.logger.info('rate limits: waited {} times, {:.1f}s in all'
+                             .format(self.limiter.waits, self.limiter.waited))
+            self.limiter = None
+        if self.pool:
+            self.logger.info('connections: {} created, {} reused, {} tls sessions resumed'
+                             .format(self.pool.created, self.pool.reused, self.pool.resumed))
+            if self.pool.received:
+                self.logger.info('compression: {} bytes received for {} bytes of pages ({:.1f}x)'
+                                 .format(self.pool.received, self.pool.decoded,
+                                         self.pool.decoded / self.pool.received))
+            self.pool.close()
+            self.pool = None
+
+    def runasync(self, urls):
+        """Yield a tuple of (entry, Results) for every entry of *urls*,
+        keeping self.concurrency requests in flight.
+
+        httplib2 blocks, so each worker coroutine hands its request to a
+        thread in an executor of the same size. The event loop runs in a
+        thread of its own, handing the Results over a queue of
+        self.concurrency, so workers wait for the caller to take them
+        rather than scanning further ahead. An exception scanning an entry
+        is raised to the caller, as it would be scanning one at a time.
+        """
+        done = queue.Queue(maxsize=self.concurrency)
+        stopped = threading.Event() # The caller stopped taking Results.
+
+        def runloop():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self._runasync(urls, done, stopped, loop))
+            except Exception as err: # Raised to the caller.
+                done.put(err)
+            finally:
+                loop.close()
+                done.put(None) # Sentinel; no more rows.
+
+        looper = threading.Thread(target=runloop, name='scanner-loop')
+        looper.start()
+        item = ()
+        try:
+            while True:
+                item = done.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+            while item is not None: # Until the loop is done, or it may wait on the queue.
+                item = done.get()
+            looper.join()
+
+    async def _runasync(self, urls, done, stopped, loop):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        # urls may block (stdin, dedup, the resolver's batches of lookups);
+        # read in a thread of its own, so the loop goes on meanwhile.
+        reader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        urls = iter(urls)
+        end = object()
+        # Bounded, so we never read further ahead of the workers than needed.
+        queue = asyncio.Queue(maxsize=self.concurrency)
+
+        async def worker(n):
+            while True:
+                url = await queue.get()
+                if url is None: # Sentinel; no more urls.
+                    return
+                if stopped.is_set(): # Nobody is taking Results; drain the queue.
+                    continue
+                try:
+                    item = (url, await loop.run_in_executor(executor, self.results, url))
+                except Exception as err:
+                    # Handed over rather than killing the worker; once they all
+                    # died, nothing would take urls off the queue.
+                    item = err
+                # Blocks a thread of the executor, not the loop, while done is full.
+                await loop.run_in_executor(executor, done.put, item)
+                if self.sleep: # Per worker, the others carry on.
+                    await asyncio.sleep(self.sleep)
+
+        self.logger.debug('runasync: starting {} workers.'.format(self.concurrency))
+        workers = [loop.create_task(worker(n)) for n in range(self.concurrency)]
+        try:
+            while not stopped.is_set():
+                url = await loop.run_in_executor(reader, next, urls, end)
+                if url is end:
+                    break
+                await queue.put(url)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+            executor.shutdown(wait=True)
+            reader.shutdown(wait=True)
+
+    def runthreaded(self, urls):
+        """Yield a tuple of (entry, Results) for every entry of *urls*,
+        scanned by a pool of self.workers threads.
+
+        Entries are submitted from a thread of their own, and each worker
+        puts its Results on a queue, which is drained by the caller; with
+        self.ordered, in input order. At most self.reorder_buffer entries
+        are submitted and not yet taken by the caller. An exception scanning
+        an entry is raised to the caller, in its place.
+        """
+        done = queue.Queue()
+        # Acquired for every url submitted, released when its rows are taken.
+        slots = threading.Semaphore(self.reorder_buffer)
+        stopped = threading.Event() # The caller stopped taking Results.
+        if self.ordered and self.reorder_buffer < self.workers:
+            self.logger.warning('runthreaded: reorder buffer ({}) is smaller than the '
+                                'number of workers ({}).'.format(self.reorder_buffer, self.workers))
+
+        def work(n, url):
+            if stopped.is_set(): # Nobody is taking Results.
+                return
+            try:
+                rows = self.results(url)
+            except Exception as err:
+                # Still handed over, or an ordered caller waits forever.
+                rows = err
+            done.put((n, url, rows))
+            if self.sleep: # Per worker, the others carry on.
+                time.sleep(self.sleep)
+
+        def submit():
+            try:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    for n, url in enumerate(urls):
+                        slots.acquire()
+                        if stopped.is_set():
+                            break
+                        executor.submit(work, n, url)
+            except Exception as err: # Reading urls; raised to the caller.
+                done.put(err)
+            finally:
+                done.put(None) # Sentinel; no more rows.
+
+        self.logger.debug('runthreaded: starting {} workers.'.format(self.workers))
+        submitter = threading.Thread(target=submit, name='scanner-submitter')
+        submitter.start()
+        pending = {} # Reorder buffer of row number -> row.
+        nextrow = 0
+        error = None
+        try:
+            while True:
+                item = done.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    error = item
+                    continue
+                ready = [item]
+                if self.ordered:
+                    pending[item[0]] = item
+                    ready = []
+                    while nextrow in pending:
+                        ready.append(pending.pop(nextrow))
+                        nextrow += 1
+                for n, url, rows in ready:
+                    if isinstance(rows, Exception):
+                        raise rows
+                    yield url, rows
+                    slots.release()
+            for n in sorted(pending): # Only left over if the submitter died.
+                if isinstance(pending[n][2], Exception):
+                    raise pending[n][2]
+                yield pending[n][1:]
+            if error is not None:
+                raise error
+        finally:
+            stopped.set()
+            slots.release() # So the submitter isn't left waiting for a slot.
+            submitter.join()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3.6
+
+"""Scripts referenced by pages (<script src>), fetched and matched once per
+run however many pages use them, e.g. a CDN's jquery.min.js or a shared
+coinhive.min.js.
+"""
+
+import re
+import threading
+import urllib.parse
+
+# Package modules.
+import state
+
+# The src of a script tag, quoted or not.
+SRC = re.compile(r'''<script\b[^>]*?\ssrc\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''',
+                 re.IGNORECASE)
+
+
+class SrcFinder:
+    """Collect the script srcs of a page fed a chunk at a time, as absolute
+    urls relative to *base*, the url of the page, in the order found.
+
+    The last *overlap* characters of a chunk are kept, so a tag split
+    between chunks is still found. Chunks may be bytes, which are decoded
+    as latin-1: a src is ascii.
+    """
+
+    def __init__(self, base, overlap=512):
+        self.base = base
+        self.overlap = overlap
+        self.srcs = []
+        self._seen = set()
+        self._tail = ''
+
+    def feed(self, chunk):
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode('latin-1')
+        window = self._tail + chunk
+        for found in SRC.finditer(window):
+            self.add(next(group for group in found.groups() if group is not None))
+        self._tail = window[-self.overlap:]
+
+    def add(self, src):
+        src = urllib.parse.urljoin(self.base, src.strip()).split('#', 1)[0]
+        if src.startswith(('http://', 'https://')) and src not in self._seen:
+            self._seen.add(src)
+            self.srcs.append(src)
+
+    def tee(self, chunks):
+        """Yield *chunks*, feeding each."""
+        for chunk in chunks:
+            self.feed(chunk)
+            yield chunk
+
+
+def srcs(content, base):
+    """Return the script srcs of *content*, a whole page from *base*."""
+    finder = SrcFinder(base)
+    finder.feed(content)
+    return finder.srcs
+
+
+class ScriptCache:
+    """What was matched on every script fetched this run, by url and by the
+    digest of its content (see state.digest), so a script is downloaded
+    once per url, and matched once per content however many urls serve it.
+
+    Threads asking for a url being fetched by another thread wait for it,
+    rather than fetching it again.
+    """
+
+    def __init__(self):
+        self.urls = {}    # url -> digest; None if it couldn't be fetched.
+        self.matches = {} # digest -> match
+        self._fetching = {} # url -> Event, set once fetched.
+        self._lock = threading.Lock()
+        # Counters.
+        self.fetched = 0
+        self.hits = 0    # Not downloaded again.
+        self.copies = 0  # Downloaded, but not matched again: the same content.
+        self.failed = 0
+        self.bytes = 0
+
+    def __repr__(self):
+        return 'ScriptCache({} urls, {} scripts)'.format(len(self.urls), len(self.matches))
+
+    def match(self, url, fetch, match):
+        """Return what *match* (url, content -> match) found in the script at
+        *url*; None if it couldn't be fetched. *fetch* (url -> tuple of
+        status code and content) is only called if *url* wasn't before.
+        """
+        with self._lock:
+            if url in self.urls:
+                self.hits += 1
+                return self.matches.get(self.urls[url])
+            fetching = self._fetching.get(url)
+            if fetching is None:
+                self._fetching[url] = threading.Event()
+        if fetching is not None: # Another thread is fetching it.
+            fetching.wait()
+            return self.match(url, fetch, match)
+        scriptdigest = found = None
+        try:
+            statuscode, content = fetch(url)
+            if statuscode == 200:
+                scriptdigest = state.digest(content)
+                with self._lock:
+                    known = scriptdigest in self.matches
+                    found = self.matches.get(scriptdigest)
+                if not known:
+                    found = match(url, content)
+        finally:
+            with self._lock:
+                self.urls[url] = scriptdigest
+                if scriptdigest is None:
+                    self.failed += 1
+                else:
+                    self.fetched += 1
+                    self.bytes += len(content)
+                    if scriptdigest in self.matches:
+                        self.copies += 1
+                    self.matches[scriptdigest] = found
+                self._fetching.pop(url).set()
+        return found
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3.6
+
+"""Scan an infile in shards, one Scanner per process, merging the output."""
+
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+
+# Package modules.
+import inputs
+import scanner
+import sinks
+
+
+def split(infile, paths, keyof):
+    """Write the entries of *infile* to the files at *paths*, chosen by a
+    hash of *keyof(entry)*; return the number of entries in each.
+    """
+    counts = [0] * len(paths)
+    shardfiles = [open(path, 'w') for path in paths]
+    try:
+        with inputs.openinput(infile) as f:
+            for entry in f:
+                entry = entry.strip()
+                if not entry:
+                    continue
+                n = zlib.crc32(keyof(entry).encode('utf-8')) % len(paths)
+                shardfiles[n].write(entry + '\n')
+                counts[n] += 1
+    finally:
+        for shardfile in shardfiles:
+            shardfile.close()
+    return counts
+
+
+def scanshard(job):
+    """Run a Scanner with the options of *job*, a tuple of (shard number,
+    options); return a tuple of the shard number and seconds taken.
+    """
+    n, opts = job
+    start_time = time.time()
+    logger = logging.getLogger('cryptoparser.shard{}'.format(n))
+    scan = scanner.Scanner(logger=logger, **opts)
+    scan.run()
+    return n, time.time() - start_time
+
+
+def run(processes, opts, logger, quietmode=False):
+    """Scan opts['infile'] with *processes* processes, each running its own
+    Scanner (made with *opts*) over a shard of the entries.
+
+    Entries are sharded by a hash of their canonical host, so duplicates
+    (with dedup) and hosts sharing rate limits end up in the same shard.
+    Each shard has its own outfile (outfile.shardN), journal, timings file,
+    status file and socket, and httplib2 cache directory (cache.N). The
+    progress line on stderr is left out, as the shards would overwrite it. The shard outfiles (and timings
+    files) are merged, a shard after another, and the caches removed.
+    """
+    outfile = opts['outfile']
+    tmpdir = tempfile.mkdtemp(prefix='shards-', dir=os.path.dirname(os.path.abspath(outfile)))
+    keyscanner = scanner.Scanner(logger=logger, **dict(opts, resolve=False, pool_size=None,
+                                                       stream=False, ip_rate=None,
+                                                       domain_rate=None, asn_rate=None,
+                                                       timings=False, timings_file=None,
+                                                       http_cache=None))
+    def keyof(entry):
+        return keyscanner.hostof(keyscanner.canonicalize(entry))
+
+    jobs, outfiles, caches = [], [], []
+    for n in range(processes):
+        shardopts = dict(opts, infile=os.path.join(tmpdir, 'shard{}.txt'.format(n)),
+                         outfile='{}.shard{}'.format(outfile, n))
+        if opts.get('cache'):
+            shardopts['cache'] = '{}.{}'.format(opts['cache'], n)
+            os.makedirs(shardopts['cache'], exist_ok=True)
+            caches.append(shardopts['cache'])
+        if opts.get('journal'):
+            shardopts['journal'] = shardopts['outfile'] + '.journal'
+        if opts.get('timings_file'):
+            shardopts['timings_file'] = '{}.shard{}'.format(opts['timings_file'], n)
+        for option in ('status_file', 'status_socket'):
+            if opts.get(option):
+                shardopts[option] = '{}.shard{}'.format(opts[option], n)
+        shardopts['progress'] = False
+        jobs.append((n, shardopts))
+        outfiles.append(shardopts['outfile'])
+
+    try:
+        counts = split(opts['infile'], [shardopts['infile'] for n, shardopts in jobs], keyof)
+        logger.info('shards: {} entries split into {} shards: {}'
+                    .format(sum(counts), processes, counts))
+        with multiprocessing.Pool(processes) as pool:
+            for n, elapsed in pool.imap_unordered(scanshard, jobs):
+                report = 'shard {}: {} entries in {:.4}s'.format(n, counts[n], elapsed)
+                logger.info(report)
+                if not quietmode:
+                    sys.stdout.write(report + '\n')
+        sinks.merge(outfiles, outfile, opts.get('format') or 'legacy')
+        if opts.get('timings_file'):
+            sinks.merge([shardopts['timings_file'] for n, shardopts in jobs],
+                        opts['timings_file'], 'jsonl')
+        for n, shardopts in jobs: # Merged, so nothing left to resume.
+            if shardopts.get('journal') and os.path.exists(shardopts['journal']):
+                os.remove(shardopts['journal'])
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        for cache in caches:
+            try: # Dir/files could be in use.
+                shutil.rmtree(cache)
+            except Exception as error_removing_cache:
+                logger.exception('Could not remove cache: {}'.format(error_removing_cache))
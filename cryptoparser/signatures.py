@@ -0,0 +1,123 @@
+#!/usr/bin/env python3.6
+
+r"""Signature packs: many named patterns, searched for in one pass over a page.
+
+A pack is a JSON object of signature name -> {"pattern": REGEX,
+"anchors": [LITERAL, ...]}. Every anchor is a literal which has to be in
+the page for the pattern to match; a signature without anchors is given
+the longest literal its pattern needs (see prefilter), or if it has none,
+is always searched for. The key captured by a pattern is its group named "key", else
+all of its groups joined, e.g.
+
+    {"coinhive": {"pattern": "CoinHive\\.Anonymous\\('?\"?(?P<key>\\w{,32})",
+                  "anchors": ["CoinHive.Anonymous"]}}
+"""
+
+import collections
+import json
+import re
+
+# Package modules.
+import prefilter
+
+Signature = collections.namedtuple('Signature', 'name pattern anchors')
+
+
+class SignaturePack:
+    """Search for every signature in *signatures* (an iterable of Signature)
+    at once.
+
+    The anchors of all signatures are combined into one alternation, which
+    is run over the page once; only the patterns of signatures whose
+    anchors were seen are run after that. With *match_bytes*, everything
+    is compiled to match bytes, as with Scanner.match_bytes.
+    """
+
+    def __init__(self, signatures, match_bytes=False):
+        self.signatures = list(signatures)
+        self.match_bytes = match_bytes
+        encode = (lambda s: s.encode('utf-8')) if match_bytes else (lambda s: s)
+        self.regexes = [re.compile(encode(sig.pattern)) for sig in self.signatures]
+        # Anchor -> indexes of the signatures which need it.
+        self.anchors = collections.defaultdict(set)
+        self.unanchored = set()
+        for n, sig in enumerate(self.signatures):
+            anchors = sig.anchors or [anchor for anchor in [prefilter.literal(sig.pattern)] if anchor]
+            for anchor in anchors:
+                self.anchors[encode(anchor)].add(n)
+            if not anchors:
+                self.unanchored.add(n)
+        # Longest first, so an anchor which is a prefix of another can't hide it.
+        alternation = sorted(self.anchors, key=len, reverse=True)
+        self.prefilter = re.compile(encode('|').join(map(re.escape, alternation))) if alternation else None
+
+    def __repr__(self):
+        return 'SignaturePack({})'.format(', '.join(sig.name for sig in self.signatures))
+
+    def __len__(self):
+        return len(self.signatures)
+
+    @classmethod
+    def load(cls, path, match_bytes=False):
+        """Return a SignaturePack read from the JSON file at *path*."""
+        with open(path) as f:
+            pack = json.load(f, object_pairs_hook=collections.OrderedDict)
+        return cls((Signature(name, sig['pattern'], tuple(sig.get('anchors', ())))
+                    for name, sig in pack.items()), match_bytes=match_bytes)
+
+    def candidates(self, content):
+        """Return the indexes of the signatures which may match *content*."""
+        found = set(self.unanchored)
+        if self.prefilter:
+            remaining = set(self.anchors)
+            for anchor in self.prefilter.finditer(content):
+                anchor = anchor.group()
+                if anchor in remaining:
+                    found |= self.anchors[anchor]
+                    remaining.discard(anchor)
+                    if not remaining:
+                        break
+        return sorted(found)
+
+    def search(self, content, final=True, skip=()):
+        """Return a list of (name, key) tuples, one per signature found in
+        *content*, in the order of the pack.
+
+        If *final* is false, *content* is not the whole page, and a match
+        which runs up to the end of it is not taken, as it may go on. Names
+        in *skip* are not searched for.
+        """
+        hits = []
+        for n in self.candidates(content):
+            sig = self.signatures[n]
+            if sig.name in skip:
+                continue
+            match = self.regexes[n].search(content)
+            if not match or (not final and match.end() == len(content)):
+                continue
+            hits.append((sig.name, self.key(match)))
+        return hits
+
+    @staticmethod
+    def key(match):
+        """Return the key captured by *match*, as a string."""
+        if 'key' in match.re.groupindex:
+            groups = [match.group('key')]
+        else:
+            groups = match.groups()
+        return joingroups(groups)
+
+
+def joingroups(groups):
+    """Return regex match *groups* joined as one string, skipping groups
+    which did not participate. Bytes are decoded as utf-8, or latin-1 if
+    they are not valid utf-8.
+    """
+    groups = [group for group in groups if group is not None]
+    if not groups or isinstance(groups[0], str):
+        return ''.join(groups)
+    joined = b''.join(groups)
+    try:
+        return joined.decode('utf-8')
+    except UnicodeDecodeError:
+        return joined.decode('latin-1')
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3.6
+
+"""Buffered destinations for Results: CSV, JSON Lines and SQLite."""
+
+import csv
+import io
+import json
+import os
+import shutil
+import sqlite3
+
+# Package modules.
+import results
+
+
+class Sink:
+    """Write Results to *path*, *buffer* at a time.
+
+    Subclasses implement writerows, which writes a list of Results and
+    makes sure they reach the file (or database) before returning.
+    """
+
+    def __init__(self, path, buffer=100):
+        self.path = path
+        self.size = buffer
+        self.buffer = []
+        self.written = 0
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def write(self, result):
+        self.buffer.append(result)
+        if len(self.buffer) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.writerows(self.buffer)
+            self.written += len(self.buffer)
+            self.buffer = []
+
+    def writerows(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+
+class TextSink(Sink):
+    """A Sink appending to a text file, a line per Result."""
+
+    def __init__(self, path, buffer=100):
+        super().__init__(path, buffer)
+        self.file = open(path, 'a')
+        self.new = self.file.tell() == 0
+
+    def format(self, result):
+        raise NotImplementedError
+
+    def writerows(self, rows):
+        self.file.write(''.join(self.format(result) for result in rows))
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class LegacySink(TextSink):
+    """The original output: domain,hash,schema or domain,status."""
+
+    def format(self, result):
+        return result.legacy() + '\n'
+
+
+class CSVSink(TextSink):
+    """Every field of a Result, with a header row in a new file."""
+
+    def __init__(self, path, buffer=100):
+        super().__init__(path, buffer)
+        if self.new:
+            csv.writer(self.file).writerow(results.FIELDS)
+
+    def format(self, result):
+        line = io.StringIO()
+        csv.writer(line).writerow(result)
+        return line.getvalue()
+
+
+class JSONLSink(TextSink):
+    """A JSON object per line, of every field of a Result."""
+
+    def format(self, result):
+        return json.dumps(result._asdict()) + '\n'
+
+
+class SQLiteSink(Sink):
+    """A results table in an SQLite database, committed a batch at a time
+    in one transaction. Each run's rows are kept, with the time of the run,
+    so runs can be compared.
+    """
+
+    schema = ('CREATE TABLE IF NOT EXISTS results ('
+              'run TEXT, entry TEXT, domain TEXT, schema TEXT, status INTEGER, '
+              'hash TEXT, signature TEXT, fetchtime REAL, bytes INTEGER, digest TEXT)')
+
+    def __init__(self, path, buffer=500):
+        super().__init__(path, buffer)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(self.schema)
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_domain ON results (domain, run)')
+        self.db.commit()
+        self.run = self.db.execute("SELECT strftime('%Y-%m-%dT%H:%M:%S', 'now')").fetchone()[0]
+
+    def writerows(self, rows):
+        with self.db: # One transaction.
+            self.db.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                ((self.run,) + tuple(result) for result in rows))
+
+    def close(self):
+        super().close()
+        self.db.close()
+
+
+FORMATS = {'legacy': LegacySink, 'csv': CSVSink, 'jsonl': JSONLSink, 'sqlite': SQLiteSink}
+
+
+def opensink(path, format='legacy', buffer=None):
+    """Return a Sink for *format* (one of FORMATS) writing to *path*."""
+    sink = FORMATS[format]
+    return sink(path) if buffer is None else sink(path, buffer)
+
+
+def merge(paths, outfile, format='legacy'):
+    """Append the output at *paths*, written by Sinks of *format*, to
+    *outfile*, and remove them.
+    """
+    paths = [path for path in paths if os.path.exists(path)]
+    if format == 'sqlite':
+        with SQLiteSink(outfile) as sink:
+            for path in paths:
+                sink.db.execute('ATTACH DATABASE ? AS shard', (path,))
+                with sink.db:
+                    sink.db.execute('INSERT INTO results SELECT * FROM shard.results')
+                sink.db.execute('DETACH DATABASE shard')
+    else:
+        with open(outfile, 'a') as out:
+            header = format == 'csv' and out.tell() > 0
+            for path in paths:
+                with open(path) as f:
+                    if header: # Only the first header is kept.
+                        f.readline()
+                    header = header or format == 'csv'
+                    shutil.copyfileobj(f, out)
+    for path in paths:
+        os.remove(path)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3.6
+
+"""A local HTTP(S) server standing in for the sites of a url list, for
+benchmarks and tests which shouldn't touch the internet.
+
+Every path is a different site. Whether it has a miner, fails, drops the
+connection or redirects is decided by a hash of the path, so the same
+list gets the same answers every time.
+
+    $ python3.6 standin.py --port 8080 --latency 0.05 --miner-rate 0.2
+"""
+
+import argparse
+import gzip
+import http.server
+import os
+import random
+import socketserver
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+MINER = "<script>var miner = new CoinHive.Anonymous('{}');miner.start();</script>"
+FILLER = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod.</p>\n'
+# Redirects go to LANDING + path, which is answered as path would be.
+LANDING = '/landing'
+
+
+class StandIn:
+    """What the stand-in server answers.
+
+    latency       -- seconds before every response, plus up to *jitter*
+    size          -- bytes in every page
+    miner_rate    -- fraction of the pages with a miner on them
+    fail_rate     -- fraction of the paths answered with a 500
+    drop_rate     -- fraction of the paths which drop the connection
+    redirect_rate -- fraction of the paths redirected (302) once
+    seed          -- changes which paths are which
+    compress      -- gzip pages for clients which accept it
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, size=16384, miner_rate=0.1, fail_rate=0.0,
+                 drop_rate=0.0, redirect_rate=0.0, seed=0, compress=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.size = size
+        self.miner_rate = miner_rate
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.redirect_rate = redirect_rate
+        self.seed = seed
+        self.compress = compress
+        self._clean = None # The page without a miner,
+        self._gzipped = None # and gzipped.
+
+    def __repr__(self):
+        return ('StandIn(latency={}, jitter={}, size={}, miner_rate={}, fail_rate={}, '
+                'drop_rate={}, redirect_rate={}, compress={})'.format(
+                    self.latency, self.jitter, self.size, self.miner_rate, self.fail_rate,
+                    self.drop_rate, self.redirect_rate, self.compress))
+
+    def fraction(self, path, decision):
+        """Return a number in [0, 1) for *decision* about *path*."""
+        key = '{}:{}:{}'.format(self.seed, decision, path).encode('utf-8')
+        return zlib.crc32(key) / 2**32
+
+    def key(self, path):
+        """Return the 32 character miner key of *path*."""
+        return '{:08x}'.format(zlib.crc32(path.encode('utf-8'))) * 4
+
+    def kind(self, path):
+        """Return what *path* gets: miner, clean, fail, drop or redirect."""
+        if path.startswith(LANDING):
+            path = path[len(LANDING):] or '/'
+        elif self.fraction(path, 'redirect') < self.redirect_rate:
+            return 'redirect'
+        if self.fraction(path, 'fail') < self.fail_rate:
+            return 'fail'
+        if self.fraction(path, 'drop') < self.drop_rate:
+            return 'drop'
+        if self.fraction(path, 'miner') < self.miner_rate:
+            return 'miner'
+        return 'clean'
+
+    def page(self, path, miner):
+        """Return a page of self.size bytes, with the miner of *path* in the
+        middle of it if *miner*.
+        """
+        if not miner: # Always the same.
+            if self._clean is None:
+                self._clean = self.fill('')
+            return self._clean
+        if path.startswith(LANDING):
+            path = path[len(LANDING):] or '/'
+        return self.fill(MINER.format(self.key(path)))
+
+    def gzipped(self, path, miner):
+        """Return the page of *path*, as page does, gzipped."""
+        if not miner:
+            if self._gzipped is None:
+                self._gzipped = gzip.compress(self.page(path, miner))
+            return self._gzipped
+        return gzip.compress(self.page(path, miner))
+
+    def fill(self, snippet):
+        """Return *snippet* padded with FILLER to self.size bytes."""
+        padding = max(self.size - len(snippet), 0)
+        filler = FILLER * (padding // len(FILLER) + 1)
+        return (filler[:padding // 2] + snippet + filler[:padding - padding // 2]).encode('utf-8')
+
+    def delay(self):
+        return self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Answer as self.server.standin says, with keep-alive."""
+
+    protocol_version = 'HTTP/1.1'
+    # The headers and body are written separately; with Nagle's algorithm, the
+    # body waits ~40ms for the client's delayed ACK on a reused connection.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        standin = self.server.standin
+        delay = standin.delay()
+        if delay:
+            time.sleep(delay)
+        kind = standin.kind(self.path)
+        if kind == 'drop':
+            self.close_connection = True
+            return
+        body = b''
+        if kind == 'redirect':
+            self.send_response(302)
+            self.send_header('Location', LANDING + self.path)
+        elif kind == 'fail':
+            self.send_response(500)
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            if standin.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = standin.gzipped(self.path, kind == 'miner')
+                self.send_header('Content-Encoding', 'gzip')
+            else:
+                body = standin.page(self.path, kind == 'miner')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """A thread per connection; HTTPS if given an SSL *context*, with the
+    handshake made in the connection's thread.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, standin, context=None):
+        super().__init__(address, StandInHandler)
+        self.standin = standin
+        self.context = context
+        if context:
+            self.socket = context.wrap_socket(self.socket, server_side=True,
+                                              do_handshake_on_connect=False)
+
+    def finish_request(self, request, client_address):
+        if self.context:
+            try:
+                request.do_handshake()
+            except (ssl.SSLError, OSError):
+                return
+        super().finish_request(request, client_address)
+
+
+def selfsigned(dir):
+    """Return the paths of a self-signed certificate and key for
+    localhost, made with openssl in *dir*; None if openssl isn't there.
+    """
+    certfile, keyfile = os.path.join(dir, 'standin.crt'), os.path.join(dir, 'standin.key')
+    try:
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                        '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return certfile, keyfile
+
+
+def serve(standin, host='127.0.0.1', port=0, certfile=None, keyfile=None):
+    """Start serving *standin* in a thread; HTTPS if given a *certfile*.
+    Return the server: server_address has the port, shutdown stops it.
+    """
+    context = None
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+    server = StandInServer((host, port), standin, context)
+    threading.Thread(target=server.serve_forever, name='standin', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='standin.py', description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, metavar='INT', default=8080)
+    parser.add_argument('--https', action='store_true',
+                        help='serve HTTPS, with a self-signed certificate unless --certfile')
+    parser.add_argument('--certfile', metavar='PATH', default=None)
+    parser.add_argument('--keyfile', metavar='PATH', default=None)
+    parser.add_argument('--latency', type=float, metavar='FLOAT', default=0.0,
+                        help='seconds before every response; default is 0')
+    parser.add_argument('--jitter', type=float, metavar='FLOAT', default=0.0,
+                        help='up to FLOAT more seconds before every response; default is 0')
+    parser.add_argument('--size', type=int, metavar='INT', default=16384,
+                        help='bytes in every page; default is 16384')
+    parser.add_argument('--miner-rate', type=float, metavar='FLOAT', default=0.1,
+                        help='fraction of the pages with a miner; default is 0.1')
+    parser.add_argument('--fail-rate', type=float, metavar='FLOAT', default=0.0,
+                        help='fraction of the paths answered with a 500; default is 0')
+    parser.add_argument('--drop-rate', type=float, metavar='FLOAT', default=0.0,
+                        help='fraction of the paths which drop the connection; default is 0')
+    parser.add_argument('--redirect-rate', type=float, metavar='FLOAT', default=0.0,
+                        help='fraction of the paths redirected once; default is 0')
+    parser.add_argument('--seed', type=int, metavar='INT', default=0)
+    parser.add_argument('--compress', action='store_true',
+                        help='gzip pages for clients which accept it')
+    args = parser.parse_args()
+
+    standin = StandIn(latency=args.latency, jitter=args.jitter, size=args.size,
+                      miner_rate=args.miner_rate, fail_rate=args.fail_rate,
+                      drop_rate=args.drop_rate, redirect_rate=args.redirect_rate, seed=args.seed,
+                      compress=args.compress)
+    certfile, keyfile = args.certfile, args.keyfile
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.https and not certfile:
+            pair = selfsigned(tmpdir)
+            if not pair:
+                sys.exit('standin: error: openssl not found; use --certfile and --keyfile')
+            certfile, keyfile = pair
+        server = serve(standin, port=args.port, certfile=certfile, keyfile=keyfile)
+        sys.stdout.write('Serving {} on {}://127.0.0.1:{}/\n'.format(
+            standin, 'https' if certfile else 'http', server.server_address[1]))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3.6
+
+"""What the last scan saw: a digest and match per page, and the miners
+found per entry, so a scan can report only what changed since.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+
+# What changed about an entry since the last scan, as returned by update.
+NEW = 'new'           # Not scanned before, and nothing found.
+INFECTED = 'infected' # Found, and nothing was found before.
+CLEANED = 'cleaned'   # Nothing found, where something was before.
+ROTATED = 'rotated'   # Found, but not what was found before (e.g. a new key).
+CHANGED = 'changed'   # The same found, or not, but the page changed.
+# Changes of the miners found; the others are changes of the page only.
+MATCH_CHANGES = (INFECTED, CLEANED, ROTATED)
+
+
+def digest(content):
+    """Return a 16 character hex digest of *content*, bytes."""
+    return hashlib.blake2b(content, digest_size=8).hexdigest()
+
+
+class StateStore:
+    """SQLite tables at *path* of the digest and match of every page (by
+    qualified url), and of the pages' digests and the miners found for
+    every entry, as of the last time each was scanned.
+
+    *fingerprint* is a string standing for what was searched for (e.g. the
+    pattern); if it isn't the same as last time, the matches kept per page
+    are forgotten, as they would not be found again. Writes are held in
+    memory, and written *batch* at a time in one short transaction (in WAL
+    mode, so readers never wait); until then, other processes don't see
+    them. Safe to share between threads, and between processes (e.g.
+    shards).
+    """
+
+    def __init__(self, path, fingerprint='', batch=100):
+        self.path = path
+        self.batch = batch
+        # Written since the last commit: url -> (digest, match), and
+        # entry -> (digests, found); read before the database.
+        self.pages = {}
+        self.entries = {}
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS pages '
+                        '(url TEXT PRIMARY KEY, digest TEXT, match TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries '
+                        '(entry TEXT PRIMARY KEY, digests TEXT, found TEXT)')
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            self.db.execute('DELETE FROM pages')
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+        self.db.commit()
+        # Counters.
+        self.skipped = 0 # Pages not matched again.
+
+    def __repr__(self):
+        return 'StateStore({!r})'.format(self.path)
+
+    def page(self, url):
+        """Return a tuple of (digest, match) of the page at *url* last time,
+        or None.
+        """
+        with self._lock:
+            row = self.pages.get(url)
+            if row is None:
+                row = self.db.execute('SELECT digest, match FROM pages WHERE url = ?',
+                                      (url,)).fetchone()
+        if row is None:
+            return None
+        match = json.loads(row[1])
+        if isinstance(match, list): # Signature pack.
+            match = [tuple(found) for found in match]
+        return row[0], match
+
+    def unchanged(self, url, pagedigest):
+        """Return a tuple of (True, match) if the page at *url* has the same
+        *pagedigest* as last time, with what was matched on it then; else
+        (False, None).
+        """
+        last = self.page(url)
+        if last is None or last[0] != pagedigest:
+            return False, None
+        with self._lock:
+            self.skipped += 1
+        return True, last[1]
+
+    def putpage(self, url, pagedigest, match):
+        with self._lock:
+            self.pages[url] = (pagedigest, json.dumps(match))
+            self._written()
+
+    def update(self, entry, rows):
+        """Record *rows*, the Results of *entry*, and return what changed
+        since last time (one of NEW, INFECTED, CLEANED, ROTATED or CHANGED),
+        or None if nothing did.
+        """
+        digests = ','.join(sorted(row.digest or '' for row in rows))
+        found = json.dumps(sorted([row.signature or '', row.hash] for row in rows if row.found))
+        with self._lock:
+            last = self.entries.get(entry)
+            if last is None:
+                last = self.db.execute('SELECT digests, found FROM entries WHERE entry = ?',
+                                       (entry,)).fetchone()
+            if last != (digests, found):
+                self.entries[entry] = (digests, found)
+                self._written()
+        if last is None:
+            return INFECTED if found != '[]' else NEW
+        if last[1] != found:
+            if last[1] == '[]':
+                return INFECTED
+            return CLEANED if found == '[]' else ROTATED
+        if last[0] != digests:
+            return CHANGED
+
+    def _written(self):
+        """The lock is held."""
+        if len(self.pages) + len(self.entries) >= self.batch:
+            self._commit()
+
+    def _commit(self):
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)',
+                                ((url,) + page for url, page in self.pages.items()))
+            self.db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                                ((entry,) + last for entry, last in self.entries.items()))
+        self.pages = {}
+        self.entries = {}
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self.db.close()
@@ -2,9 +2,41 @@
 
 # $ python -m unittest cryptoparser_tests.py
 
+import gzip
+import http.server
+import io
+import json
+import logging
+import os
+import re
+import socket
+import socketserver
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
+import zlib
 
 import cryptoparser
+import dedup
+import httppool
+import inputs
+import journal
+import prefilter
+import progress
+import ratelimit
+import resilience
+import resolver
+import results
+import revalidate
+import scanner
+import shards
+import signatures
+import standin
+import state
+import timing
 
 # * Add a test to handle importing httplib2 if it doesn't exist.
 # * More testing with regexes?
@@ -13,20 +45,26 @@ import cryptoparser
 
 class RegexTestCase(unittest.TestCase):
 
+    def setUp(self):
+        self.scanner = scanner.Scanner(None, None, cryptoparser.coinhivehash,
+                                       logger=logging.getLogger('tests'))
+        self.scanner.compileregex()
+
     def test_spliturl(self):
-        self.assertEqual(cryptoparser.splitdomain('http://www.alluc.ee/'), 'www.alluc.ee/')
+        self.assertEqual(self.scanner.splitdomain('http://www.alluc.ee/'), ['http', 'www.alluc.ee/'])
+        self.assertEqual(self.scanner.splitdomain('www.alluc.ee/'), ['www.alluc.ee/'])
 
     def test_contentparser(self):
         # 'oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq'
-        self.assertEqual(cryptoparser.parsecontent(
+        self.assertEqual(self.scanner.parsecontent(
 """window.miner = new CoinHive.Anonymous('oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq');"""),
             'oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq')
-        thehash = cryptoparser.parsecontent(None) if cryptoparser.parsecontent(None) else 0
+        thehash = self.scanner.parsecontent(None) if self.scanner.parsecontent(None) else 0
         self.assertEqual(thehash, 0)
-        self.assertEqual(cryptoparser.parsecontent(
+        self.assertEqual(self.scanner.parsecontent(
 """miner = new CoinHive.Anonymous('8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2');"""),
         '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2')
-        self.assertEqual(cryptoparser.parsecontent(
+        self.assertEqual(self.scanner.parsecontent(
 """/
 <script src="https://coin-hive.com/lib/coinhive.min.js"></script>
 <script>
@@ -42,13 +80,13 @@ Hello
 
     def test_qualifyurl(self):
         self.assertEqual(
-            [url for url in cryptoparser.qualifyurl('www.alluc.ee/')],
+            [url for url in self.scanner.qualifyurl('www.alluc.ee/')],
             ['http://www.alluc.ee/', 'https://www.alluc.ee/'])
         self.assertEqual(
-            [url for url in cryptoparser.qualifyurl('badpackets.net')],
+            [url for url in self.scanner.qualifyurl('badpackets.net')],
             ['http://badpackets.net', 'https://badpackets.net'])
         self.assertNotEqual(
-            [url for url in cryptoparser.qualifyurl('dailystormer.ph')],
+            [url for url in self.scanner.qualifyurl('dailystormer.ph')],
             ['https://dailystormer.com',])
 
 
@@ -69,12 +107,922 @@ Hello
     #        print(qualifiedurl)
 
 
+# Pages served by FakeScanner instead of making requests.
+pages = {
+    'http://miner.test': (200, "var miner = new CoinHive.Anonymous('8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2');"),
+    'http://clean.test': (200, '<html>Hello</html>'),
+    'http://dead.test': (-1, ''),
+    'https://dead.test': (-1, ''),
+    'https://secure.test': (200, "new CoinHive.Anonymous('oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq');"),
+    'http://both.test': (200, '<html>Hello</html>'),
+    'https://both.test': (200, "new CoinHive.Anonymous('oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq');"),
+    }
+
+
+class FakeScanner(scanner.Scanner):
+    """A Scanner which looks up pages instead of requesting them."""
+
+    def request(self, url, timings=None, headers=None, received=None):
+        statuscode, content = pages.get(url, (-1, ''))
+        if statuscode == -1:
+            self.requestfailed(url, ConnectionRefusedError(111, 'Connection refused'))
+        return statuscode, content.encode('utf-8')
+
+
+class RunTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.infile = os.path.join(self.tmpdir.name, 'urls.txt')
+        self.outfile = os.path.join(self.tmpdir.name, 'out.csv')
+        with open(self.infile, 'w') as f:
+            f.write('miner.test\nclean.test\ndead.test\n' * 5)
+        self.expected = ['miner.test,8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2,http',
+                         'clean.test,0', 'dead.test,-1'] * 5
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def scan(self, **kwargs):
+        scan = FakeScanner(self.infile, self.outfile, cryptoparser.coinhivehash,
+                           logger=logging.getLogger('tests'), quietmode=True, **kwargs)
+        scan.run()
+        with open(self.outfile) as f:
+            return f.read().splitlines()
+
+    def test_run(self):
+        self.assertEqual(self.scan(), self.expected)
+
+    def test_outcomes(self):
+        scan = FakeScanner(self.infile, self.outfile, cryptoparser.coinhivehash,
+                           logger=logging.getLogger('tests'), quietmode=True)
+        with self.assertLogs('tests', 'WARNING') as logs:
+            scan.run()
+        self.assertEqual(scan.outcomes, {'found': 5, 'nomatch': 5, 'failed': 5})
+        # Only the dead host is logged, once per schema; not the clean page.
+        self.assertEqual(len(logs.records), 10)
+        self.assertTrue(all('dead.test' in record.getMessage() for record in logs.records))
+
+    def test_close_twice(self):
+        with self.assertLogs('tests', 'INFO') as logs:
+            with FakeScanner(self.infile, self.outfile, cryptoparser.coinhivehash, timings=True,
+                             pool_size=1, logger=logging.getLogger('tests'),
+                             quietmode=True) as scan:
+                scan.run() # Closes, and so does the with statement.
+        messages = [record.getMessage() for record in logs.records]
+        self.assertEqual(messages.count('timings (approximate percentiles):'), 1)
+        self.assertEqual(sum(message.startswith('outcomes:') for message in messages), 1)
+        self.assertIsNone(scan.pool)
+
+    def test_diff(self):
+        with open(self.infile, 'w') as f:
+            f.write('miner.test\nclean.test\ndead.test\n')
+        statefile = os.path.join(self.tmpdir.name, 'state.db')
+
+        def diff(mode):
+            if os.path.exists(self.outfile):
+                os.remove(self.outfile)
+            scan = FakeScanner(self.infile, self.outfile, cryptoparser.coinhivehash, state=statefile,
+                               diff=mode, logger=logging.getLogger('tests'), quietmode=True)
+            scan.run()
+            with open(self.outfile) as f:
+                return f.read().splitlines(), scan.changes
+
+        rows, changes = diff('match')
+        self.assertEqual(rows, ['miner.test,8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2,http'])
+        self.assertEqual(changes, {'infected': 1, 'new': 2})
+        self.assertEqual(diff('page')[0], []) # Nothing changed.
+        saved = dict(pages)
+        try:
+            pages['http://miner.test'] = pages['http://clean.test']
+            pages['http://clean.test'] = (200, "<html>CoinHive.Anonymous('oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq')")
+            pages['http://dead.test'] = (200, '<html>Back</html>')
+            rows, changes = diff('match')
+            self.assertEqual(rows, ['miner.test,0', 'clean.test,oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq,http'])
+            self.assertEqual(changes, {'cleaned': 1, 'infected': 1, 'changed': 1})
+            pages['http://dead.test'] = (200, '<html>Back again</html>')
+            self.assertEqual(diff('page')[0], ['dead.test,0'])
+        finally:
+            pages.clear()
+            pages.update(saved)
+
+    def test_state_shared(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'state.db')
+            # As two shards would: neither locks the other out until it closes.
+            first, second = (state.StateStore(path, 'pattern') for _ in range(2))
+            first.putpage('http://a.test', 'aaaa', 'KEY')
+            second.putpage('http://b.test', 'bbbb', None)
+            second.close()
+            first.close()
+            store = state.StateStore(path, 'pattern')
+            self.assertEqual(store.page('http://a.test'), ('aaaa', 'KEY'))
+            # Writes not yet committed are read back.
+            store.putpage('http://c.test', 'cccc', None)
+            self.assertEqual(store.page('http://c.test'), ('cccc', None))
+            self.assertEqual(store.update('c.test', []), state.NEW)
+            self.assertIsNone(store.update('c.test', []))
+            store.close()
+
+    def test_state_skips_match(self):
+        statefile = os.path.join(self.tmpdir.name, 'state.db')
+        for run in range(2):
+            scan = FakeScanner(self.infile, self.outfile, cryptoparser.coinhivehash, state=statefile,
+                               logger=logging.getLogger('tests'), quietmode=True)
+            scan.parsecontent = unittest.mock.Mock(wraps=scan.parsecontent)
+            scan.run()
+        os.remove(self.outfile)
+        # All unchanged since the first run, so none were matched again.
+        self.assertEqual(scan.parsecontent.call_count, 0)
+        self.assertEqual(self.scan(state=statefile), self.expected)
+
+    def test_scripts(self):
+        with open(self.infile, 'w') as f:
+            f.write('loader1.test\nloader2.test\nloader3.test\nclean.test\n')
+        saved = dict(pages)
+        try:
+            pages['http://loader1.test'] = (200, '<script src="http://cdn.test/miner.js"></script>')
+            pages['http://loader2.test'] = (200, "<script async src=/app.js></script>"
+                                                 "<script src='//cdn.test/miner.js'></script>")
+            pages['http://loader3.test'] = (200, '<SCRIPT SRC="http://mirror.test/miner.js#x">')
+            pages['http://cdn.test/miner.js'] = pages['http://miner.test']
+            pages['http://mirror.test/miner.js'] = pages['http://miner.test']
+            scan = FakeScanner(self.infile, self.outfile, cryptoparser.coinhivehash, scripts=True,
+                               logger=logging.getLogger('tests'), quietmode=True)
+            scan.request = unittest.mock.Mock(wraps=scan.request)
+            scan.matchscript = unittest.mock.Mock(wraps=scan.matchscript)
+            with self.assertLogs('tests', 'WARNING'): # loader2.test/app.js.
+                scan.run()
+        finally:
+            pages.clear()
+            pages.update(saved)
+        with open(self.outfile) as f:
+            self.assertEqual(f.read().splitlines(),
+                             ['loader{}.test,8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2,http'.format(n)
+                              for n in (1, 2, 3)] + ['clean.test,0'])
+        requested = [call[0][0] for call in scan.request.call_args_list]
+        self.assertEqual(requested.count('http://cdn.test/miner.js'), 1)
+        self.assertIn('http://loader2.test/app.js', requested)
+        self.assertEqual(scan.matchscript.call_count, 1) # The mirror's is a copy.
+        cache = scan.scriptcache
+        self.assertEqual((cache.fetched, cache.hits, cache.copies, cache.failed), (2, 1, 1, 1))
+
+    def test_formats(self):
+        self.outfile = os.path.join(self.tmpdir.name, 'out.jsonl')
+        rows = [json.loads(row) for row in self.scan(format='jsonl', buffer=4)]
+        self.assertEqual(len(rows), 15)
+        self.assertEqual(set(rows[0]), set(results.FIELDS))
+        self.assertEqual(rows[0]['hash'], '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2')
+        self.assertEqual(rows[0]['bytes'], len(pages['http://miner.test'][1]))
+        self.assertEqual([row['status'] for row in rows[:3]], [200, 200, -1])
+
+        self.outfile = os.path.join(self.tmpdir.name, 'out.csv')
+        self.scan(format='csv')
+        rows = self.scan(format='csv') # Appended to, without a second header.
+        self.assertEqual(rows[0], ','.join(results.FIELDS))
+        self.assertEqual(len(rows), 31)
+        self.assertTrue(rows[1].startswith('miner.test,miner.test,http,200,8nZ6'))
+
+        self.outfile = os.path.join(self.tmpdir.name, 'out.db')
+        FakeScanner(self.infile, self.outfile, cryptoparser.coinhivehash, format='sqlite',
+                    buffer=2, logger=logging.getLogger('tests'), quietmode=True).run()
+        db = sqlite3.connect(self.outfile)
+        self.assertEqual(db.execute('SELECT domain, schema, status, hash FROM results '
+                                    'ORDER BY rowid LIMIT 3').fetchall(),
+                         [('miner.test', 'http', 200, '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2'),
+                          ('clean.test', 'http', 200, None), ('dead.test', 'https', -1, None)])
+        self.assertEqual(db.execute('SELECT count(*) FROM results').fetchone(), (15,))
+        db.close()
+
+    def test_run_compressed(self):
+        with open(self.infile) as f:
+            urls = f.read()
+        for extension, opener in inputs.OPENERS.items():
+            self.infile = os.path.join(self.tmpdir.name, 'urls.txt' + extension)
+            with opener(self.infile, 'wt') as f:
+                f.write(urls)
+            self.assertEqual(self.scan(), self.expected)
+            os.remove(self.outfile)
+
+    def test_run_concurrency(self):
+        self.assertEqual(sorted(self.scan(concurrency=4)), sorted(self.expected))
+
+    def test_run_workers(self):
+        self.assertEqual(sorted(self.scan(workers=4)), sorted(self.expected))
+
+    def test_run_workers_ordered(self):
+        self.assertEqual(self.scan(workers=4, ordered=True, reorder_buffer=3), self.expected)
+
+    def test_probe(self):
+        with open(self.infile, 'w') as f:
+            f.write('secure.test\nboth.test\ndead.test\n')
+        for probe, expected in (
+                ('sequential', ['secure.test,oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq,https',
+                                'both.test,0', 'dead.test,-1']),
+                ('first-wins', ['secure.test,oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq,https', 'dead.test,-1']),
+                ('prefer-https', ['secure.test,oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq,https',
+                                  'both.test,oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq,https', 'dead.test,-1']),
+                ('both', ['secure.test,-1', 'secure.test,oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq,https',
+                          'both.test,0', 'both.test,oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq,https',
+                          'dead.test,-1', 'dead.test,-1'])):
+            rows = self.scan(probe=probe)
+            os.remove(self.outfile)
+            if probe == 'first-wins': # Either of both.test's schemas may win.
+                rows = [row for row in rows if not row.startswith('both.test')]
+            self.assertEqual(rows, expected, probe)
+
+    def test_resolve(self):
+        hostsfile = os.path.join(self.tmpdir.name, 'hosts')
+        with open(hostsfile, 'w') as f:
+            f.write('127.0.0.1 miner.test clean.test # Stand-ins.\n')
+        lookups = []
+        def stub(host): # Nothing else exists.
+            lookups.append(host)
+            return None
+        scan = FakeScanner(self.infile, self.outfile, cryptoparser.coinhivehash,
+                           logger=logging.getLogger('tests'), quietmode=True,
+                           resolve=True, hosts=hostsfile)
+        scan.resolver.resolve = stub
+        self.assertIsNotNone(scan.pool) # Which connects to the addresses looked up.
+        scan.run()
+        with open(self.outfile) as f:
+            self.assertEqual(f.read().splitlines(), (self.expected[:2] + ['dead.test,-2']) * 5)
+        self.assertEqual(lookups, ['dead.test']) # The negative answer was cached.
+        # Until it expires.
+        stubresolver = resolver.Resolver(negative_ttl=0, resolve=stub)
+        self.assertIsNone(stubresolver.lookup('dead.test'))
+        self.assertIsNone(stubresolver.lookup('dead.test'))
+        self.assertEqual(lookups, ['dead.test'] * 3)
+
+    def test_resume(self):
+        journalfile = self.outfile + '.journal'
+        self.assertEqual(self.scan(journal=journalfile), self.expected)
+        self.assertEqual(len(journal.Journal(journalfile, resume=True)), 3)
+        with open(self.infile, 'a') as f:
+            f.write('miner.test\nnew.test\n')
+        # Only the new entry is scanned.
+        self.assertEqual(self.scan(journal=journalfile, resume=True), self.expected + ['new.test,-1'])
+
+    def test_dedup(self):
+        with open(self.infile, 'a') as f:
+            f.write('https://Miner.test/\nhttp://www.miner.test\n\n')
+        self.assertEqual(self.scan(dedup=True), self.expected[:3] + ['www.miner.test,-1'])
+        os.remove(self.outfile)
+        self.assertEqual(self.scan(dedup=True, www='strip'), self.expected[:3])
+
+    def test_canonicalize(self):
+        scan = FakeScanner(None, None, '', logger=logging.getLogger('tests'), www='strip')
+        self.assertEqual(scan.canonicalize('HTTPS://www.Badpackets.net/'), 'badpackets.net')
+        self.assertEqual(scan.canonicalize('Badpackets.net/Path/'), 'badpackets.net/Path')
+        deduplicator = dedup.Deduplicator(scan.canonicalize)
+        deduplicator.write(['a.com', 'a.com', 'http://A.com/', 'www.a.com', '', 'b.com'])
+        self.assertEqual(list(deduplicator.read()), ['a.com', 'b.com'])
+        self.assertEqual((deduplicator.unique, deduplicator.exact, deduplicator.near, deduplicator.blank),
+                         (2, 1, 2, 1))
+        deduplicator.cleanup()
+
+
+class ScanManyTestCase(unittest.TestCase):
+
+    urls = ['miner.test', 'clean.test', 'dead.test'] * 5
+
+    def scan_many(self, **kwargs):
+        with FakeScanner(pattern=cryptoparser.coinhivehash, **kwargs) as scan:
+            return [(row.entry, row.outcome) for row in scan.scan_many(self.urls)]
+
+    def test_scan_many(self):
+        expected = [('miner.test', 'found'), ('clean.test', 'nomatch'), ('dead.test', 'failed')] * 5
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cwd = os.getcwd()
+            os.chdir(tmpdir)
+            try:
+                self.assertEqual(self.scan_many(), expected)
+                self.assertEqual(sorted(self.scan_many(concurrency=4)), sorted(expected))
+                self.assertEqual(sorted(self.scan_many(workers=4)), sorted(expected))
+                self.assertEqual(self.scan_many(workers=4, ordered=True), expected)
+                self.assertEqual(os.listdir(tmpdir), []) # Nothing written.
+            finally:
+                os.chdir(cwd)
+
+    def test_stalled_input(self):
+        for kwargs in ({'workers': 4}, {'concurrency': 4}):
+            def urls():
+                yield from ['miner.test'] * 4
+                time.sleep(1) # As stdin, or the resolver's next batch, may.
+                yield 'miner.test'
+            with FakeScanner(pattern=cryptoparser.coinhivehash, **kwargs) as scan:
+                start_time = time.monotonic()
+                found = scan.scan_many(urls())
+                for _ in range(4):
+                    next(found)
+                # Not held up until the next entry is read.
+                self.assertLess(time.monotonic() - start_time, 0.5, kwargs)
+                self.assertEqual(len(list(found)), 1)
+
+    def test_backpressure(self):
+        for kwargs in ({'workers': 2, 'reorder_buffer': 4}, {'concurrency': 4}):
+            read = []
+            def urls():
+                for n in range(1000):
+                    read.append(n)
+                    yield 'miner.test'
+            with FakeScanner(pattern=cryptoparser.coinhivehash, **kwargs) as scan:
+                found = scan.scan_many(urls())
+                self.assertEqual(next(found).outcome, 'found')
+                time.sleep(0.2)
+                found.close()
+            # Read no further ahead than the results were taken.
+            self.assertLess(len(read), 20, kwargs)
+
+    def test_error(self):
+        class BrokenScanner(FakeScanner):
+            def scanresults(self, url):
+                if url == 'dead.test':
+                    raise sqlite3.OperationalError('database is locked')
+                return super().scanresults(url)
+        for kwargs in ({}, {'concurrency': 2}, {'workers': 2}, {'workers': 2, 'ordered': True}):
+            with BrokenScanner(pattern=cryptoparser.coinhivehash, **kwargs) as scan:
+                with self.assertRaises(sqlite3.OperationalError, msg=kwargs):
+                    list(scan.scan_many(self.urls))
+
+    def test_state(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            statefile = os.path.join(tmpdir, 'state.db')
+            # Once, as infected; the same again isn't a change.
+            self.assertEqual(self.scan_many(state=statefile, diff='match'),
+                             [('miner.test', 'found')])
+            self.assertEqual(self.scan_many(state=statefile, diff='match'), []) # Nothing changed.
+            with self.assertRaises(ValueError):
+                self.scan_many(journal=os.path.join(tmpdir, 'journal'))
+
+    def test_no_pattern(self):
+        with self.assertRaises(ValueError):
+            list(FakeScanner().scan_many(['miner.test']))
+
+
+class PageHandler(http.server.BaseHTTPRequestHandler):
+    """Serve pages[http://miner.test + path] with keep-alive."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # See standin.StandInHandler.
+
+    def do_GET(self):
+        status, content = pages.get('http://miner.test' + self.path.rstrip('/'), (404, ''))
+        body = content.encode('utf-8')
+        etag = '"{}"'.format(zlib.crc32(body))
+        if self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class ServerTestCase(unittest.TestCase):
+    """Runs a local HTTP server on 127.0.0.1."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+        cls.host = '127.0.0.1:{}'.format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+
+class PoolTestCase(ServerTestCase):
+
+    def test_reuse(self):
+        pool = httppool.ConnectionPool(size=2)
+        for _ in range(3):
+            status, content = pool.request('http://{}/'.format(self.host))
+            self.assertEqual(status, 200)
+            self.assertIn(b'CoinHive.Anonymous', content)
+        self.assertEqual((pool.created, pool.reused), (1, 2))
+        pool.close()
+
+    def test_idle_timeout(self):
+        pool = httppool.ConnectionPool(size=2, idle_timeout=0)
+        pool.request('http://{}/'.format(self.host))
+        pool.request('http://{}/'.format(self.host))
+        self.assertEqual((pool.created, pool.reused), (2, 0))
+        pool.close()
+
+    def test_race_abort(self):
+        # Connections are accepted (into the backlog) and never answered, as
+        # a filtered port 443 may as well not be.
+        hanging = socket.socket()
+        hanging.bind(('127.0.0.1', 0))
+        hanging.listen(64)
+        port = hanging.getsockname()[1]
+
+        class HangingScanner(scanner.Scanner):
+            def qualifyurl(self, domainname):
+                return ['http://' + domainname, 'https://127.0.0.1:{}'.format(port)]
+
+        try:
+            with HangingScanner(pattern=cryptoparser.coinhivehash, probe='first-wins', workers=2,
+                                timeout=5, retries=0) as scan:
+                start_time = time.monotonic()
+                rows = list(scan.scan_many([self.host] * 20))
+                elapsed = time.monotonic() - start_time
+        finally:
+            hanging.close()
+        self.assertEqual([row.outcome for row in rows], ['found'] * 20)
+        # Every loser left hanging would hold a probe thread for 5s.
+        self.assertLess(elapsed, 2.5)
+
+
+class CompressedHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the miner page compressed as the path says (/gzip, /deflate or
+    /raw, raw deflate), or /bomb, 8MB of zeros gzipped.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # See standin.StandInHandler.
+
+    def do_GET(self):
+        page = (pages['http://miner.test'][1] + '<p>Hello</p>' * 1000).encode('utf-8')
+        encoding = self.path.strip('/')
+        if encoding == 'gzip':
+            body = gzip.compress(page)
+        elif encoding == 'deflate':
+            body = zlib.compress(page)
+        elif encoding == 'raw':
+            deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            body, encoding = deflate.compress(page) + deflate.flush(), 'deflate'
+        else:
+            body, encoding = gzip.compress(bytes(8 * 1024 * 1024)), 'gzip'
+        self.send_response(200)
+        self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CompressionTestCase(ServerTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), CompressedHandler)
+        cls.host = '127.0.0.1:{}'.format(cls.server.server_address[1])
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    def test_request(self):
+        pool = httppool.ConnectionPool(size=1, max_decompressed=1024 * 1024)
+        for encoding in ('gzip', 'deflate', 'raw'):
+            status, content = pool.request('http://{}/{}'.format(self.host, encoding))
+            self.assertEqual(status, 200)
+            self.assertTrue(content.startswith(b'var miner = new CoinHive.Anonymous'))
+            self.assertTrue(content.endswith(b'<p>Hello</p>'))
+        self.assertEqual((pool.created, pool.reused), (1, 2))
+        self.assertEqual(pool.decoded, 3 * len(content))
+        self.assertLess(pool.received * 20, pool.decoded)
+        with self.assertRaises(httppool.BodyTooLarge):
+            pool.request('http://{}/bomb'.format(self.host))
+        pool.close()
+
+    def test_fetch(self):
+        for stream in (False, True):
+            scan = scanner.Scanner(None, None, cryptoparser.coinhivehash, stream=stream,
+                                   pool_size=1, chunk_size=64, max_decompressed=1024 * 1024,
+                                   logger=logging.getLogger('tests'))
+            scan.compileregex()
+            fetched = scan.fetch('http://{}/gzip'.format(self.host))
+            self.assertEqual(fetched[:2], (200, '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2'))
+            with self.assertLogs('tests', 'WARNING'):
+                self.assertEqual(scan.fetch('http://{}/bomb'.format(self.host)).status, -1)
+            scan.close()
+
+
+class StandInTestCase(unittest.TestCase):
+
+    def test_scan(self):
+        site = standin.StandIn(size=2048, miner_rate=0.3, fail_rate=0.1, drop_rate=0.1,
+                               redirect_rate=0.2)
+        server = standin.serve(site)
+        try:
+            host = '127.0.0.1:{}'.format(server.server_address[1])
+            kinds = {'/{}'.format(n): site.kind('/{}'.format(n)) for n in range(40)}
+            self.assertEqual(set(kinds.values()), {'miner', 'clean', 'fail', 'drop', 'redirect'})
+            with tempfile.TemporaryDirectory() as tmpdir:
+                infile, outfile = os.path.join(tmpdir, 'urls.txt'), os.path.join(tmpdir, 'out.csv')
+                with open(infile, 'w') as f:
+                    f.write(''.join(host + path + '\n' for path in kinds))
+                scan = scanner.Scanner(infile, outfile, cryptoparser.coinhivehash, workers=4,
+                                       pool_size=2, http_only=True, quietmode=True,
+                                       logger=logging.getLogger('tests'))
+                with self.assertLogs('tests', 'WARNING'): # The dropped connections.
+                    scan.run()
+                with open(outfile) as f:
+                    rows = [row.split(',') for row in f.read().splitlines()]
+        finally:
+            server.shutdown()
+            server.server_close()
+        # Redirected paths are answered as their landing page.
+        kinds = [site.kind(standin.LANDING + path) if kind == 'redirect' else kind
+                 for path, kind in kinds.items()]
+        self.assertEqual(sorted(row[1] for row in rows if len(row) == 3),
+                         sorted(site.key('/{}'.format(n)) for n, kind in enumerate(kinds)
+                                if kind == 'miner'))
+        self.assertEqual([row[1] for row in rows].count('0'), kinds.count('clean'))
+        self.assertEqual([row[1] for row in rows].count('-1'),
+                         kinds.count('fail') + kinds.count('drop'))
+
+
+class RevalidateTestCase(ServerTestCase):
+
+    def test_fetch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'httpcache.db')
+            for stream in (False, True):
+                fetched = []
+                for run in range(2): # Each run with a Scanner of its own.
+                    scan = scanner.Scanner(None, None, cryptoparser.coinhivehash, stream=stream,
+                                           http_cache=path, logger=logging.getLogger('tests'))
+                    scan.compileregex()
+                    fetched.append(scan.fetch('http://{}/'.format(self.host)))
+                    hits = scan.httpcache.hits
+                    scan.close()
+                first, second = fetched
+                self.assertEqual(first[:2], (200, '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2'))
+                self.assertEqual(second[:2], first[:2])
+                self.assertEqual(second.bytes, 0) # Not modified; not downloaded again.
+                self.assertEqual(hits, 1)
+                os.remove(path)
+
+    def test_pattern_changed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'httpcache.db')
+            fetched = []
+            for pattern in (cryptoparser.coinhivehash, r'nothing(?P<x>here)'):
+                scan = scanner.Scanner(None, None, pattern, http_cache=path,
+                                       logger=logging.getLogger('tests'))
+                scan.compileregex()
+                fetched.append(scan.fetch('http://{}/'.format(self.host)))
+                scan.close()
+            self.assertEqual(fetched[0][:2], (200, '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2'))
+            # Not the first run's match: the page is downloaded and matched again.
+            self.assertEqual(fetched[1][:2], (200, None))
+            self.assertGreater(fetched[1].bytes, 0)
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = revalidate.ValidatorCache(os.path.join(tmpdir, 'httpcache.db'), size=2, batch=1)
+            cache.store('http://a.test', {'etag': '"a"'}, 'KEY', 10)
+            cache.store('http://b.test', {'last-modified': 'Sun, 18 Oct 2026 09:00:00 GMT'},
+                        [('coinhive', 'KEY')], 10)
+            self.assertEqual(cache.hit('http://a.test'), ('KEY', 10)) # a used after b.
+            cache.store('http://c.test', {'etag': '"c"'}, None, 10)
+            cache.store('http://d.test', {}, None, 10) # No validators; not kept.
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.headers('http://a.test'), {'If-None-Match': '"a"'})
+            self.assertEqual(cache.headers('http://b.test'), {}) # Evicted.
+            self.assertEqual(cache.hit('http://c.test'), (None, 10))
+            self.assertEqual(cache.evicted, 1)
+            cache.close()
+
+
+    def test_shared(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'httpcache.db')
+            # As two shards would: neither locks the other out until it commits.
+            first, second = (revalidate.ValidatorCache(path) for _ in range(2))
+            first.store('http://a.test', {'etag': '"a"'}, 'KEY', 10)
+            second.store('http://b.test', {'etag': '"b"'}, None, 10)
+            second.commit()
+            first.close()
+            self.assertEqual(second.headers('http://a.test'), {'If-None-Match': '"a"'})
+            self.assertEqual(len(second), 2)
+            second.close()
+
+
+class TimingTestCase(ServerTestCase):
+
+    def test_histogram(self):
+        histogram = timing.Histogram(start=1, factor=2)
+        for value in range(1, 101):
+            histogram.add(value)
+        self.assertEqual((histogram.count, histogram.max), (100, 100))
+        self.assertEqual(histogram.percentile(50), 64)
+        self.assertEqual(histogram.percentile(99), 100)
+
+    def test_fetch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'timings.jsonl')
+            for stream in (False, True):
+                scan = scanner.Scanner(None, None, cryptoparser.coinhivehash,
+                                       logger=logging.getLogger('tests'), pool_size=1,
+                                       stream=stream, timings_file=path, quietmode=True)
+                scan.compileregex()
+                for _ in range(2):
+                    self.assertEqual(scan.fetch('http://{}/'.format(self.host)).status, 200)
+                summary = scan.timer.summary()
+                scan.close()
+                with open(path) as f:
+                    rows = [json.loads(row) for row in f]
+                os.remove(path)
+                self.assertEqual(len(rows), 2)
+                new, reused = rows
+                for stage in ('dns', 'connect', 'ttfb', 'download', 'match', 'total'):
+                    self.assertGreaterEqual(new[stage], 0)
+                self.assertIsNone(reused['connect']) # Kept alive.
+                self.assertEqual(new['bytes'], len(pages['http://miner.test'][1]))
+                self.assertGreater(new['total'], new['ttfb'])
+                self.assertEqual([line.split()[0] for line in summary],
+                                 ['stage', 'dns', 'connect', 'ttfb', 'download', 'match',
+                                  'total', 'bytes'])
+
+
+class BytesTestCase(unittest.TestCase):
+
+    def test_parsecontent_bytes(self):
+        scan = scanner.Scanner(None, None, cryptoparser.coinhivehash,
+                               logger=logging.getLogger('tests'), match_bytes=True)
+        scan.compileregex()
+        # Not valid utf-8.
+        page = "<p>Caf\xe9</p><script>new CoinHive.Anonymous('oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq');"
+        self.assertEqual(scan.parsecontent(page.encode('latin-1')), 'oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq')
+        self.assertEqual(scan.streammatch([page[:40].encode('latin-1'), page[40:].encode('latin-1')]),
+                         'oZFH0SLOx5v0DuQug1dqDykUWYnfbEgq')
+        self.assertFalse(scan.parsecontent(b'<html>Hello</html>'))
+
+
+class PrefilterTestCase(unittest.TestCase):
+
+    def test_literal(self):
+        self.assertEqual(prefilter.literal(cryptoparser.coinhivehash), 'Anonymous(')
+        self.assertEqual(prefilter.literal(cryptoparser.coinhivehash.encode()), b'Anonymous(')
+        self.assertEqual(prefilter.literal(r'coinhive\.min\.js'), 'coinhive.min.js')
+        self.assertEqual(prefilter.literal(r'x(?:miner)+y'), 'miner')
+        self.assertEqual(prefilter.literal(r'a{2}bcd'), 'bcd')
+        for pattern in (r'(miner)?', r'miner|loot', r'(?i)CoinHive', r'[a-z]+', r'ab', r'('):
+            self.assertIsNone(prefilter.literal(pattern), pattern)
+
+    def test_parsecontent(self):
+        scan = FakeScanner(None, None, cryptoparser.coinhivehash, logger=logging.getLogger('tests'))
+        scan.compileregex()
+        scan.regex = unittest.mock.Mock(wraps=scan.regex)
+        for url, (status, content) in pages.items():
+            found = scan.parsecontent(content)
+            self.assertEqual(found, re.search(cryptoparser.coinhivehash, content).group('hash')
+                             if 'CoinHive' in content else None)
+        # Only run on the pages with the literal.
+        self.assertEqual(scan.regex.call_count, 3)
+
+    def test_signature_anchors(self):
+        pack = signatures.SignaturePack([signatures.Signature('coinhive', r'CoinHive\.Anonymous'
+                                                              r"\('(?P<key>\w+)", ())])
+        self.assertEqual(pack.unanchored, set())
+        self.assertEqual(pack.search("new CoinHive.Anonymous('KEY')"), [('coinhive', 'KEY')])
+        self.assertEqual(pack.candidates('<html>Hello</html>'), [])
+
+
+class SignaturesTestCase(unittest.TestCase):
+
+    page = """<script src="https://coin-hive.com/lib/coinhive.min.js"></script>
+<script>var miner = new CoinHive.Anonymous('8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2');</script>
+<script src="https://load.jsecoin.com/load/12345/example.com/0/0/"></script>
+<script>var m = new CRLT.Anonymous("b23efb4650150d5bc5b2de6f05267272cada06d985a0");</script>
+"""
+    hits = [('coinhive', '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2'),
+            ('cryptoloot', 'b23efb4650150d5bc5b2de6f05267272cada06d985a0'),
+            ('jsecoin', '12345')]
+    packfile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'signatures.json')
+
+    def test_search(self):
+        for match_bytes in (False, True):
+            pack = signatures.SignaturePack.load(self.packfile, match_bytes)
+            page = self.page.encode('utf-8') if match_bytes else self.page
+            self.assertEqual(pack.search(page), self.hits)
+            self.assertEqual(pack.search(page[:20]), [])
+
+    def test_streamsignatures(self):
+        scan = scanner.Scanner(None, None, cryptoparser.coinhivehash,
+                               logger=logging.getLogger('tests'), signatures=self.packfile)
+        scan.compileregex()
+        self.assertEqual(scan.parsecontent(self.page), self.hits)
+        chunks = [self.page[i:i+10] for i in range(0, len(self.page), 10)]
+        self.assertEqual(sorted(scan.streammatch(chunks)), self.hits)
+
+
+class ProgressTestCase(unittest.TestCase):
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile, outfile = os.path.join(tmpdir, 'urls.txt'), os.path.join(tmpdir, 'out.csv')
+            statusfile = os.path.join(tmpdir, 'status.json')
+            with open(infile, 'w') as f:
+                f.write('miner.test\nclean.test\ndead.test\n' * 5)
+            scan = FakeScanner(infile, outfile, cryptoparser.coinhivehash, status_file=statusfile,
+                               progress_interval=0.01, logger=logging.getLogger('tests'),
+                               quietmode=True)
+            with self.assertLogs('tests', 'WARNING'):
+                scan.run()
+            with open(statusfile) as f:
+                status = json.load(f)
+        self.assertEqual({key: status[key] for key in ('running', 'done', 'total', 'remaining',
+                                                       'inflight', 'hits')},
+                         {'running': False, 'done': 15, 'total': 15, 'remaining': 0,
+                          'inflight': 0, 'hits': 5})
+        self.assertEqual(status['outcomes'], {'found': 5, 'nomatch': 5, 'failed': 5})
+        self.assertEqual(status['errors'], {'ConnectionRefusedError': 10}) # Both schemas.
+
+    def test_socket(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'status.sock')
+            stream = io.StringIO()
+            watch = progress.Progress(total=4, interval=0.01, stream=stream, socketpath=path)
+            watch.start()
+            watch.started()
+            watch.written([results.Result('a.test', 'a.test', 'http', 200, 'KEY', None, 0.1,
+                                          10, None)])
+            watch.error('timeout')
+            client = socket.socket(socket.AF_UNIX)
+            client.connect(path)
+            status = json.loads(client.makefile().readline())
+            client.close()
+            watch.stop()
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual((status['done'], status['remaining'], status['inflight'], status['hits']),
+                         (1, 3, 1, 1))
+        self.assertTrue(status['running'])
+        self.assertRegex(stream.getvalue(), r'1/4 done, [0-9.]+ urls/s, 1 in flight, 1 hits, '
+                                            r'eta [0-9:?]+; errors: 1 timeout\n$')
+        self.assertEqual(progress.duration(3725), '1:02:05')
+
+
+class ResilienceTestCase(unittest.TestCase):
+
+    def test_attempt(self):
+        scan = FakeScanner(None, None, '', logger=logging.getLogger('tests'), retries=2)
+        scan.retry.base = 0
+        errors = [ConnectionResetError(104, 'Connection reset by peer')] * 2
+        def call(timeout):
+            if errors:
+                raise errors.pop()
+            return 200, b''
+        self.assertEqual(scan.attempt('http://a.test', call), (200, b''))
+        self.assertEqual(scan.retry.retried, 2)
+        errors = [ConnectionResetError(104, 'Connection reset by peer')] * 3
+        with self.assertRaises(ConnectionResetError): # Out of retries.
+            scan.attempt('http://a.test', call)
+        errors = [ConnectionRefusedError(111, 'Connection refused')]
+        with self.assertRaises(ConnectionRefusedError): # Not retried.
+            scan.attempt('http://a.test', call)
+        self.assertEqual(scan.retry.retried, 4)
+
+    def test_adaptive_timeouts(self):
+        timeouts = resilience.AdaptiveTimeouts(ceiling=30, floor=1, warmup=10)
+        self.assertEqual(timeouts.timeout('a.test'), 30)
+        for _ in range(10):
+            timeouts.observe('a.test', 0.5)
+        self.assertEqual(timeouts.timeout('a.test'), 1) # Steady, so the floor.
+        self.assertAlmostEqual(timeouts.timeout('b.test'), 1.0, delta=0.2) # 2 * p99.
+        timeouts.backoff('a.test')
+        self.assertEqual(timeouts.timeout('a.test'), 2)
+        timeouts.observe('c.test', 100)
+        self.assertEqual(timeouts.timeout('c.test'), 30)
+        # Never over the ceiling, even if it's under the floor (--timeout 1).
+        timeouts = resilience.AdaptiveTimeouts(ceiling=1)
+        timeouts.observe('a.test', 0.1)
+        self.assertEqual(timeouts.timeout('a.test'), 1)
+        timeouts.backoff('a.test')
+        self.assertEqual(timeouts.timeout('a.test'), 1)
+
+    def test_breaker(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile, outfile = os.path.join(tmpdir, 'urls.txt'), os.path.join(tmpdir, 'out.csv')
+            path = os.path.join(tmpdir, 'breaker.db')
+            with open(infile, 'w') as f:
+                f.write('miner.test\ndead.test\n')
+            for run in range(3):
+                scan = FakeScanner(infile, outfile, cryptoparser.coinhivehash, breaker=path,
+                                   breaker_runs=2, logger=logging.getLogger('tests'),
+                                   quietmode=True)
+                with self.assertLogs('tests', 'INFO'):
+                    scan.run()
+            with open(outfile) as f:
+                self.assertEqual(f.read().splitlines()[-2:],
+                                 ['miner.test,8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2,http',
+                                  'dead.test,-3'])
+            self.assertEqual(scan.outcomes, {'found': 1, 'skipped': 1})
+
+            db = sqlite3.connect(path)
+            db.execute('UPDATE hosts SET open_until = 0') # Cooled off; tried again.
+            db.commit()
+            db.close()
+            breaker = resilience.CircuitBreaker(path, runs=2)
+            self.assertFalse(breaker.isopen('dead.test'))
+            breaker.record('dead.test', False)
+            breaker.record('dead.test', True) # Back; forgotten.
+            breaker.close()
+            breaker = resilience.CircuitBreaker(path, runs=2)
+            self.assertFalse(breaker.isopen('dead.test'))
+            breaker.close()
+
+
+class RateLimitTestCase(unittest.TestCase):
+
+    def test_registrable(self):
+        self.assertEqual(ratelimit.registrable('www.example.co.uk'), 'example.co.uk')
+        self.assertEqual(ratelimit.registrable('a.b.badpackets.net'), 'badpackets.net')
+
+    def test_acquire(self):
+        stub = resolver.Resolver(hosts={'a.shared.test': ['10.0.0.1'], 'b.other.test': ['10.0.0.1'],
+                                        'c.elsewhere.test': ['10.0.0.2']})
+        limiter = ratelimit.RateLimiter({'ip': 20}, burst=1, resolver=stub)
+        start = time.monotonic()
+        limiter.acquire('a.shared.test')
+        limiter.acquire('c.elsewhere.test') # Unrelated; doesn't wait.
+        self.assertEqual(limiter.waits, 0)
+        limiter.acquire('b.other.test') # Same address; waits 1/20s.
+        self.assertEqual(limiter.waits, 1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_asnmap(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'pfx2as')
+            with open(path, 'w') as f:
+                f.write('10.0.0.0\t8\t64500\n10.1.0.0/16 64501\n')
+            asnmap = ratelimit.ASNMap(path)
+        self.assertEqual(asnmap.lookup('10.1.2.3'), '64501')
+        self.assertEqual(asnmap.lookup('10.2.2.3'), '64500')
+        self.assertIsNone(asnmap.lookup('192.0.2.1'))
+
+
+class ShardsTestCase(ServerTestCase):
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile, outfile = os.path.join(tmpdir, 'urls.txt'), os.path.join(tmpdir, 'out.csv')
+            port = self.host.split(':')[1]
+            entries = ['127.0.0.1:{}'.format(port), 'localhost:{}'.format(port), '127.0.0.2:1']
+            with open(infile, 'w') as f:
+                f.write('\n'.join(entries * 2) + '\n')
+            opts = dict(infile=infile, outfile=outfile, pattern=cryptoparser.coinhivehash,
+                        cache=os.path.join(tmpdir, 'cache'), http_only=True, quietmode=True,
+                        journal=outfile + '.journal')
+            shards.run(2, opts, logging.getLogger('tests'), quietmode=True)
+            with open(outfile) as f:
+                rows = sorted(f.read().splitlines())
+            self.assertEqual(rows, sorted(['{},8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2,http'.format(entry)
+                                           for entry in entries[:2]] * 2 + ['127.0.0.2:1,-1'] * 2))
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['out.csv', 'urls.txt'])
+
+
+class StreamTestCase(ServerTestCase):
+
+    def scanner(self, **kwargs):
+        scan = scanner.Scanner(None, None, cryptoparser.coinhivehash,
+                               logger=logging.getLogger('tests'), **kwargs)
+        scan.compileregex()
+        return scan
+
+    def test_streammatch_across_chunks(self):
+        page = pages['http://miner.test'][1]
+        scan = self.scanner(stream=True, overlap=64)
+        for size in (1, 7, 30, len(page)):
+            chunks = [page[i:i+size] for i in range(0, len(page), size)]
+            self.assertEqual(scan.streammatch(chunks), '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2')
+        self.assertIsNone(scan.streammatch(['<html>', 'Hello', '</html>']))
+
+    def test_fetchmatch_scripts(self):
+        saved = dict(pages)
+        try:
+            pages['http://miner.test/loader'] = (200, '<html>' + 'x' * 40 +
+                                                 '<script src="/miner.js"></script>')
+            pages['http://miner.test/miner.js'] = pages['http://miner.test']
+            scan = self.scanner(stream=True, chunk_size=8, scripts=True)
+            self.assertEqual(scan.fetchmatch('http://{}/loader'.format(self.host))[:2],
+                             (200, '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2'))
+            scan.close()
+        finally:
+            pages.clear()
+            pages.update(saved)
+
+    def test_fetchmatch(self):
+        scan = self.scanner(stream=True, chunk_size=8)
+        self.assertEqual(scan.fetchmatch('http://{}/'.format(self.host))[:2],
+                         (200, '8nZ6lEbgaSJd7c977LBLcLBO2sX43tb2'))
+        scan = self.scanner(max_bytes=20, chunk_size=8)
+        self.assertEqual(scan.fetchmatch('http://{}/'.format(self.host))[:2], (200, None))
+        scan.close()
+
+
 if __name__ == '__main__':
-    regex = RegexTestCase()
-    regex.test_spliturl()
-    regex.test_contentparser()
-
-# ----------------------------------------------------------------------
-# Ran 2 tests in 0.000s
-#
-# OK
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3.6
+
+"""Per-request timings: where the time of each fetch went, and a summary."""
+
+import json
+import math
+import threading
+
+# Stages of a fetch, in order. All but match, scripts and total are only
+# timed over pooled connections, and dns, connect and tls only for new
+# connections. ttfb is the time to first byte; match includes decoding;
+# scripts is fetching and matching the scripts a page references; total is
+# the whole fetch.
+STAGES = ('dns', 'connect', 'tls', 'ttfb', 'download', 'match', 'scripts', 'total')
+
+
+def addtime(timings, stage, seconds):
+    """Add *seconds* to *stage* of *timings*, a dict, if there is one."""
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def connecting(timings):
+    """Return the seconds of *timings* spent connecting: dns, connect and tls."""
+    if not timings:
+        return 0.0
+    return sum(timings.get(stage, 0.0) for stage in ('dns', 'connect', 'tls'))
+
+
+class Histogram:
+    """Counts of values in buckets growing by *factor* from *start*, so any
+    number of values takes the same memory. Percentiles are the upper
+    bound of the bucket they fall in: within *factor* of the true value.
+    """
+
+    def __init__(self, start=0.0001, factor=1.2):
+        self.start = start
+        self.factor = factor
+        self.buckets = {} # bucket number -> count
+        self.count = 0
+        self.max = 0
+
+    def add(self, value):
+        n = 0 if value <= self.start else math.ceil(math.log(value / self.start, self.factor))
+        self.buckets[n] = self.buckets.get(n, 0) + 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """Return the value below which *p* percent of values fall."""
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for n in sorted(self.buckets):
+            seen += self.buckets[n]
+            if seen >= rank:
+                return min(self.start * self.factor ** n, self.max)
+
+
+class Recorder:
+    """Collect the timings of every fetch into a Histogram per stage, and if
+    given a *path*, write each one as a line of JSON to it (a sidecar to
+    the outfile). Safe to share between threads.
+    """
+
+    percentiles = (50, 90, 99)
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.bytes = Histogram(start=64, factor=1.5)
+        self.file = open(path, 'a') if path else None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'Recorder({!r})'.format(self.path)
+
+    def record(self, url, status, nbytes, timings):
+        """Record a fetch of *url*, which returned *status* and *nbytes*, and
+        took *timings*, a dict of stage -> seconds.
+        """
+        with self._lock:
+            for stage, seconds in timings.items():
+                if stage in self.stages:
+                    self.stages[stage].add(seconds)
+            self.bytes.add(nbytes)
+            if self.file:
+                row = dict(url=url, status=status, bytes=nbytes)
+                row.update((stage, timings.get(stage)) for stage in STAGES)
+                self.file.write(json.dumps(row) + '\n')
+
+    def summary(self):
+        """Return a list of lines: a row of percentiles, in milliseconds,
+        per stage timed, and one of the bytes read.
+        """
+        lines = ['{:<9}{:>8}'.format('stage', 'count')
+                 + ''.join('{:>10}'.format('p{}'.format(p)) for p in self.percentiles)
+                 + '{:>10}'.format('max')]
+        for stage in STAGES:
+            histogram = self.stages[stage]
+            if histogram.count:
+                lines.append('{:<9}{:>8}'.format(stage, histogram.count)
+                             + ''.join('{:>8.1f}ms'.format(histogram.percentile(p) * 1000)
+                                       for p in self.percentiles)
+                             + '{:>8.1f}ms'.format(histogram.max * 1000))
+        if self.bytes.count:
+            lines.append('{:<9}{:>8}'.format('bytes', self.bytes.count)
+                         + ''.join('{:>10}'.format(int(self.bytes.percentile(p)))
+                                   for p in self.percentiles)
+                         + '{:>10}'.format(self.bytes.max))
+        return lines
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None